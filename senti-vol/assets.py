@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import NamedTuple
+
+from common import get_env, stable_id
+from relevance import (
+    EMPTY_SCORE_ROW,
+    SCORE_VERSION,
+    RelevanceMatcher,
+    ScoreCache,
+    as_string_array,
+    cached_automaton,
+    clean_terms,
+    first_pair,
+    first_words,
+    get_score_cache,
+    read_terms_sections,
+    score_frame_columns,
+    score_hits,
+    score_row,
+    token_candidates,
+)
+
+
+# Multi-asset relevance routing.
+# Every tracked asset has a CORE/CTX term profile; all profiles are compiled
+# into one keyword automaton whose hits carry a CORE and a CTX bit per asset,
+# so a text is fetched once, scanned once, and tagged with every asset it is
+# relevant to. Rows are written once per (item, asset) with an `asset` column.
+
+PRIMARY_ASSET = get_env("ASSET_TICKER", default="CL=F")
+ASSETS = [a.strip() for a in get_env("ASSETS", default=PRIMARY_ASSET).split(",") if a.strip()]
+
+
+class AssetProfile(NamedTuple):
+    core: tuple
+    ctx: tuple
+
+
+_MARKET_CTX = (
+    "price", "prices", "futures", "spot", "curve", "spread", "backwardation", "contango", "hedge", "hedging",
+    "inventory", "inventories", "stocks", "storage", "output", "production", "exports", "imports", "demand",
+    "supply", "shutdown", "outage", "sanctions", "disruption", "capacity", "rally", "selloff", "slump", "surge",
+)
+
+ASSET_PROFILES = {
+    "CL=F": AssetProfile(
+        core=("wti", "west texas intermediate", "crude", "crude oil", "petroleum", "opec", "opec+", "eia",
+              "nymex", "cushing", "barrel", "barrels", "refinery", "refineries", "shale", "permian"),
+        ctx=_MARKET_CTX + ("rig count", "maintenance", "pipeline", "refinery", "quota", "cut", "cuts"),
+    ),
+    "BZ=F": AssetProfile(
+        core=("brent", "brent crude", "ice brent", "dated brent", "north sea", "forties", "opec", "opec+"),
+        ctx=_MARKET_CTX + ("tanker", "tankers", "shipping", "quota", "cut", "cuts"),
+    ),
+    "NG=F": AssetProfile(
+        core=("natural gas", "natgas", "nat gas", "henry hub", "lng", "ttf"),
+        ctx=_MARKET_CTX + ("injection", "withdrawal", "heating", "weather", "freeport", "pipeline"),
+    ),
+    "GC=F": AssetProfile(
+        core=("gold", "bullion", "xau", "comex gold", "spot gold", "gold futures"),
+        ctx=_MARKET_CTX + ("fed", "yields", "inflation", "safe haven", "etf", "etfs", "central bank"),
+    ),
+}
+
+
+def _bits(i: int) -> tuple[int, int]:
+    # CORE / CTX bit of the i-th asset; asset 0 uses relevance.CORE / CTX
+    return 1 << (2 * i), 1 << (2 * i + 1)
+
+
+class AssetRouter:
+
+    def __init__(self, assets: list[str], proximity: int, matcher: RelevanceMatcher | None = None,
+                 profiles: dict[str, AssetProfile] | None = None):
+        self.assets = list(assets)
+        self.proximity = int(proximity)
+        self._matcher = matcher
+        self.automaton = None
+        self._first_tokens = None
+
+        if matcher is not None:
+            # single asset: reuse that ingestor's own matcher as-is
+            fp = matcher.fingerprint
+        else:
+            terms: dict[str, int] = {}
+            all_core, all_ctx = [], []
+            for i, asset in enumerate(self.assets):
+                core_bit, ctx_bit = _bits(i)
+                for bit, ts, acc in ((core_bit, profiles[asset].core, all_core), (ctx_bit, profiles[asset].ctx, all_ctx)):
+                    for t in clean_terms(ts):
+                        terms[t] = terms.get(t, 0) | bit
+                        acc.append(t)
+            self.automaton = cached_automaton(terms)
+            core_words, ctx_words = first_words(all_core), first_words(all_ctx)
+            if core_words is not None and ctx_words is not None:
+                self._first_tokens = [pa.array(sorted(core_words)), pa.array(sorted(ctx_words))]
+            fp = stable_id(repr(sorted(terms.items())))
+
+        # one cache namespace per asset
+        self._ns = {a: stable_id(f"{SCORE_VERSION}\x1f{fp}\x1f{self.proximity}\x1f{a}") for a in self.assets}
+
+    @classmethod
+    def for_matcher(cls, asset: str, matcher: RelevanceMatcher) -> "AssetRouter":
+        return cls([asset], matcher.proximity, matcher=matcher)
+
+    @classmethod
+    def from_profiles(cls, profiles: dict[str, AssetProfile], proximity: int = 80) -> "AssetRouter":
+        return cls(list(profiles), proximity, profiles=profiles)
+
+    def _tagged_hits(self, text: str) -> list[tuple[int, int, int]]:
+        # (start, end, bits) for the one scan of `text`
+        if self._matcher is not None:
+            return [(s, e, (1 if c else 0) | (2 if x else 0)) for s, e, c, x in self._matcher.hits(text)]
+        return self.automaton.scan(text)
+
+    def _asset_hits(self, hits, i: int) -> list:
+        core_bit, ctx_bit = _bits(i)
+        return [(s, e, bool(b & core_bit), bool(b & ctx_bit)) for s, e, b in hits if b & (core_bit | ctx_bit)]
+
+    def route(self, text: str) -> list[str]:
+        if not text:
+            return []
+        hits = self._tagged_hits(text)
+        return [a for i, a in enumerate(self.assets) if first_pair(self._asset_hits(hits, i), self.proximity)]
+
+    def candidates(self, arr: pa.Array) -> np.ndarray:
+        if self._matcher is not None:
+            return self._matcher.candidates(arr)
+        if self._first_tokens is None:
+            return np.flatnonzero(pc.is_valid(arr).to_numpy(zero_copy_only=False))
+        return token_candidates(arr, self._first_tokens)
+
+    def route_frame(self, df: pd.DataFrame, texts: pd.Series, cache: ScoreCache | None = None) -> pd.DataFrame:
+        # one output row per (input row, relevant asset), with `asset` and the
+        # relevance score columns; repeated texts come from the score cache
+        if df.empty:
+            return df.assign(asset=pd.Series(dtype=object), **score_frame_columns([]))
+        cache = cache if cache is not None else get_score_cache()
+        # rows without some CORE and some CTX term cannot be relevant to any
+        # asset: the column prefilter drops them before any hashing or caching
+        arr = as_string_array(texts)
+        cand = self.candidates(arr)
+        values = arr.take(pa.array(cand)).to_pylist() if len(cand) else []
+        keys = [stable_id(t) for t in values]
+        distinct = set(keys)
+        known = {a: cache.get_many(self._ns[a], distinct) for a in self.assets}
+
+        todo = [k for k in distinct if not all(k in known[a] for a in self.assets)]
+        if todo:
+            first = {}
+            for j, k in enumerate(keys):
+                first.setdefault(k, j)
+            fresh = {a: {} for a in self.assets}
+            for k in todo:
+                hits = self._tagged_hits(values[first[k]])
+                for i, a in enumerate(self.assets):
+                    fresh[a][k] = score_row(score_hits(self._asset_hits(hits, i), self.proximity))
+            for a in self.assets:
+                cache.put_many(self._ns[a], fresh[a])
+                known[a].update(fresh[a])
+
+        rows, assets, scores = [], [], []
+        for pos, k in zip(cand.tolist(), keys):
+            for a in self.assets:
+                r = known[a].get(k, EMPTY_SCORE_ROW)
+                if r[0] > 0:
+                    rows.append(pos)
+                    assets.append(a)
+                    scores.append(r)
+
+        out = df.iloc[rows].assign(asset=assets, **score_frame_columns(scores))
+        return out.reset_index(drop=True)
+
+
+def asset_profiles_from_env(assets: list[str]) -> dict[str, AssetProfile]:
+    # built-in profiles, extended by RELEVANCE_TERMS_FILE sections ([core] /
+    # [ctx] for the primary asset, [core NG=F] / [ctx NG=F] for the others)
+    extra = {}
+    path = get_env("RELEVANCE_TERMS_FILE", default="")
+    if path:
+        extra = read_terms_sections(path)
+
+    profiles = {}
+    for asset in assets:
+        base = ASSET_PROFILES.get(asset, AssetProfile((), ()))
+        core = base.core + tuple(extra.get(("core", asset), ()))
+        ctx = base.ctx + tuple(extra.get(("ctx", asset), ()))
+        if asset == PRIMARY_ASSET:
+            core += tuple(extra.get(("core", None), ()))
+            ctx += tuple(extra.get(("ctx", None), ()))
+        if not core or not ctx:
+            raise ValueError(
+                f"No relevance terms for asset '{asset}'. Built-in: {', '.join(ASSET_PROFILES)}; "
+                f"add [core {asset}] / [ctx {asset}] sections to RELEVANCE_TERMS_FILE"
+            )
+        profiles[asset] = AssetProfile(core, ctx)
+    return profiles
+
+
+def router_from_env(matcher: RelevanceMatcher) -> AssetRouter:
+    # ASSETS=CL=F (the default) keeps the ingestor's own tuned matcher;
+    # several assets switch to the combined profile automaton
+    if ASSETS == [PRIMARY_ASSET]:
+        return AssetRouter.for_matcher(PRIMARY_ASSET, matcher)
+    return AssetRouter.from_profiles(asset_profiles_from_env(ASSETS), proximity=matcher.proximity)
@@ -0,0 +1,133 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+import glob
+import tempfile
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import get_env, bq_table, upsert_stream_to_bq, init_logging
+from relevance import SCORE_COLUMNS, ScoreCache
+from sentiment import SENTIMENT_COLUMNS, get_lexicon
+
+
+# Historical backfill: the relevance routing and sentiment stages of an
+# ingestor, run over a large input (Parquet files, e.g. a warehouse export of
+# reddit_posts / news_articles) on a process pool.
+#
+# The parent writes the text column once to an Arrow IPC file; every worker
+# memory-maps it and scores a zero-copy slice of rows, so texts are never
+# pickled. Workers send back row positions and score columns only; the parent
+# joins them to the input rows and returns them in key order.
+#
+#   python backfill.py reddit_posts export/reddit_posts-*.parquet
+
+BACKFILL_WORKERS = int(get_env("BACKFILL_WORKERS", default=str(os.cpu_count() or 1)))
+BACKFILL_SHARD_ROWS = int(get_env("BACKFILL_SHARD_ROWS", default="50000"))
+
+# table -> (ingestor module with ROUTER and text_blob(), id column, text columns)
+SOURCES = {
+    "reddit_posts": ("reddit_ingest", "post_id", ("title", "selftext")),
+    "news_articles": ("news_ingest", "article_id", ("title", "description")),
+}
+
+# recomputed by the backfill, dropped from the input first
+_DERIVED = ("asset", *SCORE_COLUMNS, *SENTIMENT_COLUMNS, "row_hash")
+
+
+def _score_shard(table: str, ipc_path: str, start: int, stop: int) -> pd.DataFrame:
+    # one row per (input row, relevant asset): _row, asset and the scores
+    ingestor = importlib.import_module(SOURCES[table][0])
+    with pa.memory_map(ipc_path) as source:
+        texts = pa.ipc.open_file(source).read_all().column("text").slice(start, stop - start)
+        rows = pd.DataFrame({"_row": np.arange(start, stop)})
+        # each shard dedupes its own texts; a shared sqlite cache would only
+        # serialize the workers
+        routed = ingestor.ROUTER.route_frame(rows, texts.to_pandas(), cache=ScoreCache(None))
+        if routed.empty:
+            return routed
+        picked = texts.take(pa.array(routed["_row"].to_numpy() - start))
+        return routed.assign(**get_lexicon().score_columns(picked))
+
+
+def read_input(paths) -> pd.DataFrame:
+    files = []
+    for p in paths:
+        files.extend(sorted(glob.glob(p)) or [p])
+    return pa.concat_tables([pq.read_table(f) for f in files], promote_options="default").to_pandas()
+
+
+def backfill(table: str, df: pd.DataFrame, workers: int | None = None, shard_rows: int | None = None) -> pd.DataFrame:
+    module, id_col, text_cols = SOURCES[table]
+    ingestor = importlib.import_module(module)
+    workers = workers or BACKFILL_WORKERS
+    shard_rows = shard_rows or BACKFILL_SHARD_ROWS
+
+    base = df.drop(columns=[c for c in _DERIVED if c in df.columns]).reset_index(drop=True)
+    texts = ingestor.text_blob(base.assign(**{c: base[c].fillna("") for c in text_cols}))
+    n = len(base)
+    starts = list(range(0, n, shard_rows))
+    stops = [min(s + shard_rows, n) for s in starts]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ipc_path = os.path.join(tmp, "texts.arrow")
+        text_table = pa.table({"text": pa.array(texts, type=pa.large_string(), from_pandas=True)})
+        with pa.OSFile(ipc_path, "wb") as sink, pa.ipc.new_file(sink, text_table.schema) as writer:
+            writer.write_table(text_table, max_chunksize=shard_rows)
+        del text_table
+
+        k = len(starts)
+        if workers > 1 and k > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, k)) as pool:
+                parts = list(pool.map(_score_shard, [table] * k, [ipc_path] * k, starts, stops))
+        else:
+            parts = [_score_shard(table, ipc_path, s, e) for s, e in zip(starts, stops)]
+
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return base.iloc[:0].assign(asset=pd.Series(dtype=object), **{c: [] for c in (*SCORE_COLUMNS, *SENTIMENT_COLUMNS)})
+    scored = pd.concat(parts, ignore_index=True)
+    out = base.iloc[scored["_row"].to_numpy()].reset_index(drop=True)
+    out = out.assign(**{c: scored[c].to_numpy() for c in scored.columns if c != "_row"})
+    return out.sort_values([id_col, "asset"], kind="stable").reset_index(drop=True)
+
+
+def main(argv=None):
+    args = argv if argv is not None else sys.argv[1:]
+    if len(args) < 2 or args[0] not in SOURCES:
+        raise SystemExit(f"Usage: python backfill.py <{'|'.join(SOURCES)}> <parquet file/dir/glob> [...]")
+    init_logging()
+    table, paths = args[0], args[1:]
+    id_col = SOURCES[table][1]
+
+    df = read_input(paths)
+    print(f"[backfill] {table}: {len(df)} input rows, workers={BACKFILL_WORKERS}, shard_rows={BACKFILL_SHARD_ROWS}")
+    out = backfill(table, df)
+    print(f"[backfill] {table}: {len(out)} scored rows")
+
+    # BACKFILL_OUTPUT=<file.parquet> writes the result instead of upserting it
+    output = get_env("BACKFILL_OUTPUT", default="")
+    if output:
+        pq.write_table(pa.Table.from_pandas(out, preserve_index=False), output)
+        print(f"[backfill] wrote {output}")
+        return
+
+    chunk = BACKFILL_SHARD_ROWS
+    n = upsert_stream_to_bq(
+        target_table=bq_table(table),
+        batches=(out.iloc[i:i + chunk] for i in range(0, len(out), chunk)),
+        schema=None,
+        key_fields=[id_col, "asset"],
+        staging_table=bq_table(f"{table}_staging"),
+    )
+    print(f"[backfill] upserted {n} {table} rows")
+
+
+if __name__ == "__main__":
+    main()
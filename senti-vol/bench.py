@@ -0,0 +1,833 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from google.cloud import bigquery
+
+from coercion import coerce_to_schema
+
+
+# Offline micro-benchmarks: python bench.py <name> [<name> ...]
+
+def _timeit(fn, *args, repeat: int = 3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _report(label: str, n: int, seconds: float):
+    print(f"  {label:<28} rows={n:>9,}  {seconds * 1000:9.1f} ms  {n / seconds:>14,.0f} rows/s")
+
+
+# Coercion
+
+COERCION_SCHEMA = [
+    bigquery.SchemaField("post_id", "STRING"),
+    bigquery.SchemaField("created_at", "TIMESTAMP"),
+    bigquery.SchemaField("observation_date", "DATE"),
+    bigquery.SchemaField("score", "INT64"),
+    bigquery.SchemaField("value", "FLOAT64"),
+    bigquery.SchemaField("title", "STRING"),
+    bigquery.SchemaField("meta", "JSON"),
+]
+
+
+def _coercion_frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    days = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2000, n), unit="D")
+    meta = np.array([None] * n, dtype=object)
+    meta[::50] = [{"flair": "oil", "n": i} for i in range(len(meta[::50]))]
+    return pd.DataFrame({
+        "post_id": [f"t3_{i:x}" for i in range(n)],
+        "created_at": days.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        "observation_date": days.strftime("%Y-%m-%d"),
+        "score": rng.integers(0, 5000, n),
+        "value": rng.integers(0, 100, n).astype(str),
+        "title": np.where(rng.random(n) < 0.05, None, "WTI crude futures slide on inventory build"),
+        "meta": meta,
+    })
+
+
+def _legacy_coerce(df: pd.DataFrame, schema) -> pd.DataFrame:
+    # per-cell reference implementation (pre-vectorization upsert_to_bq)
+    def to_date(v):
+        if pd.isna(v):
+            return None
+        try:
+            return pd.to_datetime(v).date()
+        except Exception:
+            return None
+
+    def ensure_string(x):
+        if x is None or (isinstance(x, float) and np.isnan(x)):
+            return None
+        if isinstance(x, str):
+            return x
+        if isinstance(x, (dict, list)):
+            return json.dumps(x, ensure_ascii=False)
+        return str(x)
+
+    for fld in schema:
+        name, ftype = fld.name, fld.field_type.upper()
+        if ftype == "INT64":
+            df[name] = pd.to_numeric(df[name], errors="coerce").astype("Int64")
+        elif ftype == "FLOAT64":
+            df[name] = pd.to_numeric(df[name], errors="coerce").astype("float64")
+        elif ftype == "TIMESTAMP":
+            df[name] = pd.to_datetime(df[name], utc=True, errors="coerce")
+        elif ftype == "DATE":
+            df[name] = df[name].apply(to_date)
+        elif ftype in ("STRING", "JSON"):
+            df[name] = df[name].apply(ensure_string)
+    return df
+
+
+def bench_coercion(sizes=(10_000, 100_000, 1_000_000)):
+    print("[bench] coercion (upsert_to_bq schema coercion)")
+    for n in sizes:
+        base = _coercion_frame(n)
+        t_new = _timeit(lambda: coerce_to_schema(base.copy(), COERCION_SCHEMA))
+        _report("vectorized", n, t_new)
+        if n <= 100_000:
+            t_old = _timeit(lambda: _legacy_coerce(base.copy(), COERCION_SCHEMA), repeat=1)
+            _report("legacy per-cell", n, t_old)
+            print(f"  {'speedup':<28} {t_old / t_new:.1f}x")
+
+
+# Upsert (local warehouse, no cloud latency)
+
+def _reddit_frame(n: int, offset: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(offset)
+    created = pd.Timestamp("2024-01-01", tz="UTC") + pd.to_timedelta(rng.integers(0, 86400 * 30, n), unit="s")
+    return pd.DataFrame({
+        "source": "reddit_public",
+        "post_id": [f"t3_{i + offset:x}" for i in range(n)],
+        "created_at": created,
+        "subreddit": rng.choice(["energy", "investing", "commodities"], n),
+        "author": [f"user{i % 997}" for i in range(n)],
+        "title": "OPEC+ output cut lifts WTI futures",
+        "selftext": "Brent spreads widen as inventories draw for a third week.",
+        "url": "https://reddit.com/r/energy/",
+        "score": rng.integers(0, 5000, n),
+        "num_comments": rng.integers(0, 300, n),
+    })
+
+
+def bench_upsert(sizes=(10_000, 100_000)):
+    from common import upsert_to_bq
+    from warehouse import SQLiteBackend, set_backend
+
+    print("[bench] upsert_to_bq against the local sqlite warehouse")
+    with tempfile.TemporaryDirectory() as tmp:
+        set_backend(SQLiteBackend(os.path.join(tmp, "bench.db")))
+        try:
+            for n in sizes:
+                # first pass inserts, second pass updates every row
+                for label in ("insert", "update"):
+                    df = _reddit_frame(n)
+                    t0 = time.perf_counter()
+                    upsert_to_bq("reddit_posts", df, key_fields=["post_id"])
+                    _report(f"upsert ({label})", n, time.perf_counter() - t0)
+        finally:
+            set_backend(None)
+
+
+def bench_stream(total: int = 200_000, batch: int = 20_000):
+    from common import upsert_to_bq, upsert_stream_to_bq
+    from warehouse import SQLiteBackend, set_backend
+
+    print(f"[bench] peak memory: single upsert vs streamed upsert ({total:,} rows)")
+    frames = lambda: (_reddit_frame(batch, offset=off) for off in range(0, total, batch))
+    with tempfile.TemporaryDirectory() as tmp:
+        set_backend(SQLiteBackend(os.path.join(tmp, "bench.db")))
+        try:
+            for label, run in (
+                ("concat + upsert_to_bq", lambda: upsert_to_bq(
+                    "reddit_posts", pd.concat(list(frames()), ignore_index=True), key_fields=["post_id"])),
+                ("upsert_stream_to_bq", lambda: upsert_stream_to_bq(
+                    "reddit_posts", frames(), key_fields=["post_id"], chunk_rows=batch)),
+            ):
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - t0
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"  {label:<28} {elapsed * 1000:9.1f} ms  peak={peak / 2**20:8.1f} MiB")
+        finally:
+            set_backend(None)
+
+
+# Arrow-native vs pandas load path (FRED-shaped rows up to the Parquet bytes a load job ships)
+
+def _fred_observations(n: int) -> list[dict]:
+    start = pd.Timestamp("1990-01-01")
+    dates = (start + pd.to_timedelta(np.arange(n) % 12000, unit="D")).strftime("%Y-%m-%d").tolist()
+    return [{"date": d, "value": f"{i * 0.01:.2f}"} for i, d in enumerate(dates)]
+
+
+def _pandas_path(obs, plan):
+    import io
+    import pyarrow.parquet as pq
+    from common import _prepare_frame, now_utc
+
+    rows = [
+        {"series_id": "CPIAUCSL", "observation_date": o["date"], "value": float(o["value"]), "ingested_at": now_utc()}
+        for o in obs
+    ]
+    df = _prepare_frame(pd.DataFrame(rows), ["series_id", "observation_date"], plan)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), io.BytesIO())
+
+
+def _arrow_path(obs, plan):
+    import io
+    import datetime as dt
+    import pyarrow.parquet as pq
+    from common import ArrowBatchBuilder, _prepare_arrow, now_utc
+    from fred_ingest import FRED_SCHEMA
+
+    rows = ArrowBatchBuilder(FRED_SCHEMA)
+    ingested_at = now_utc()
+    for o in obs:
+        rows.append(series_id="CPIAUCSL", observation_date=dt.date.fromisoformat(o["date"]),
+                    value=float(o["value"]), ingested_at=ingested_at)
+    table = _prepare_arrow(pa.Table.from_batches([rows.flush()]), plan, ["series_id", "observation_date"])
+    pq.write_table(table, io.BytesIO())
+
+
+def bench_arrow(sizes=(100_000, 1_000_000)):
+    from coercion import CoercionPlan
+    from warehouse import TABLE_SCHEMAS
+
+    plan = CoercionPlan([f for f in TABLE_SCHEMAS["macro_indicators"] if f.name != "row_hash"])
+    print("[bench] load path: pandas DataFrame vs Arrow builders (to Parquet bytes)")
+    for n in sizes:
+        obs = _fred_observations(n)
+        for label, fn in (("pandas", _pandas_path), ("arrow", _arrow_path)):
+            t0 = time.perf_counter()
+            fn(obs, plan)
+            elapsed = time.perf_counter() - t0
+            tracemalloc.start()
+            fn(obs, plan)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label:<10} rows={n:>9,}  {elapsed * 1000:9.1f} ms  {n / elapsed:>12,.0f} rows/s  "
+                  f"peak={peak / 2**20:8.1f} MiB")
+
+
+# Null normalization on text-heavy frames
+
+def _text_frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    body = np.array(["Brent spreads widen as inventories draw for a third week.", "", "   ", "\t\n", None], dtype=object)
+    pick = rng.choice(len(body), n, p=[0.85, 0.05, 0.04, 0.03, 0.03])
+    df = pd.DataFrame({
+        "comment_id": [f"c{i:x}" for i in range(n)],
+        "video_id": rng.choice(["vid_a", "vid_b", "vid_c"], n),
+        "text": body[pick],
+        "author": np.where(rng.random(n) < 0.02, " ", "someone"),
+        "like_count": rng.integers(0, 500, n),
+    })
+    # object columns, as older pandas builds them from API payloads (the legacy
+    # pass skipped anything else)
+    return df.astype({c: object for c in ("comment_id", "video_id", "text", "author")})
+
+
+def _legacy_nulls(df: pd.DataFrame) -> pd.DataFrame:
+    # reference: the pre-plan _clean_df_drop_nulls string pass
+    for c in [c for c in df.columns if df[c].dtype == object]:
+        df[c] = df[c].where(~df[c].astype(str).str.strip().eq(""), None)
+    return df
+
+
+def bench_nulls(sizes=(100_000, 1_000_000)):
+    from coercion import blank_strings_to_null
+
+    string_cols = ["comment_id", "video_id", "text", "author"]
+    print("[bench] blank-string -> null normalization")
+    for n in sizes:
+        base = _text_frame(n)
+        text = base.astype({c: "str" for c in string_cols})
+        for label, fn in (
+            ("legacy astype(str).strip()", lambda: _legacy_nulls(base.copy(deep=False))),
+            ("arrow kernel (object cols)", lambda: blank_strings_to_null(base, string_cols)),
+            ("arrow kernel (str cols)", lambda: blank_strings_to_null(text, string_cols)),
+        ):
+            elapsed = _timeit(fn)
+            tracemalloc.start()
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  {label:<28} rows={n:>9,}  {elapsed * 1000:9.1f} ms  peak={peak / 2**20:8.1f} MiB")
+        legacy, new = _legacy_nulls(base.copy()), blank_strings_to_null(base, string_cols)
+        for c in string_cols:
+            assert legacy[c].isna().equals(new[c].isna())
+            assert new[c].isna().equals(blank_strings_to_null(text, string_cols)[c].isna())
+
+
+# Relevance filter on long Reddit selftexts
+
+_FILLER = ("the", "a", "market", "traders", "said", "week", "while", "analysts", "expect", "more",
+           "volatility", "ahead", "of", "the", "report", "and", "some", "funds", "cut", "risk")
+_CORE_WORDS = ("WTI", "Brent", "crude", "OPEC+", "barrels", "petroleum", "EIA", "NYMEX")
+_CTX_WORDS = ("price", "futures", "supply", "demand", "inventory", "outage", "spread", "exports")
+
+
+def _selftexts(n: int, words: int = 1500, hits: int = 40) -> list[str]:
+    # long posts with many CORE and CTX mentions, mostly too far apart; one in
+    # ten closes with an adjacent pair so the whole text has to be scanned
+    rng = np.random.default_rng(0)
+    half = words // 2
+    texts = []
+    for i in range(n):
+        toks = rng.choice(_FILLER, words).astype(object)
+        toks[rng.choice(half, hits, replace=False)] = rng.choice(_CORE_WORDS, hits)
+        toks[half + rng.choice(half, hits, replace=False)] = rng.choice(_CTX_WORDS, hits)
+        if i % 10 == 0:
+            toks[-2:] = ["Brent", "futures"]
+        texts.append(" ".join(toks))
+    return texts
+
+
+def _legacy_is_relevant(core_re, ctx_re, proximity, text):
+    # reference: the per-ingestor filter before relevance.py
+    if not text:
+        return False
+    if not core_re.search(text) or not ctx_re.search(text):
+        return False
+    t = text.lower()
+    core_hits = [m.start() for m in core_re.finditer(t)]
+    ctx_hits = [m.start() for m in ctx_re.finditer(t)]
+    return any(abs(i - j) <= proximity for i in core_hits for j in ctx_hits)
+
+
+def bench_relevance(n: int = 2_000):
+    from reddit_ingest import RELEVANCE as m
+
+    texts = _selftexts(n)
+    legacy = lambda: [_legacy_is_relevant(m.core_re, m.ctx_re, m.proximity, t) for t in texts]
+    shared = lambda: [m.is_relevant(t) for t in texts]
+    assert legacy() == shared()
+    print(f"[bench] relevance filter ({sum(shared())}/{n} relevant, ~9 KB selftexts)")
+    t_old, t_new = _timeit(legacy), _timeit(shared)
+    _report("legacy pairwise", n, t_old)
+    _report("single scan + merge", n, t_new)
+    print(f"  {'speedup':<28} {t_old / t_new:.1f}x")
+
+
+def _post_column(n: int) -> pd.Series:
+    # backfill-shaped: short posts, most off-topic, some with only one side
+    rng = np.random.default_rng(1)
+    off = "Anyone else think the index rallies into earnings season this quarter?"
+    core_only = "Long thread on Brent and WTI history, no numbers today, just charts."
+    ctx_only = "Futures positioning and inventory data point to tighter supply."
+    hit = "WTI futures slide after a surprise inventory build at Cushing."
+    far = "Brent is in the title. " + "Filler words about nothing in particular. " * 4 + "Prices later."
+    pick = rng.choice(5, n, p=[0.6, 0.15, 0.15, 0.05, 0.05])
+    return pd.Series(np.array([off, core_only, ctx_only, hit, far], dtype=object)[pick]).astype("str")
+
+
+def bench_relevance_batch(n: int = 1_000_000):
+    from reddit_ingest import RELEVANCE as m, ROUTER
+    from relevance import ScoreCache
+
+    # distinct texts, so route_frame's dedupe does not skip the scans
+    posts = _post_column(n) + pd.Series(np.arange(n)).map(" #{}".format)
+    texts = posts.tolist()
+    print(f"[bench] batch relevance over a {n:,}-row text column")
+    t0 = time.perf_counter()
+    loop = np.array([m.score(t).score > 0 for t in texts])
+    t_loop = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    routed = ROUTER.route_frame(pd.DataFrame({"_row": np.arange(n)}), posts, cache=ScoreCache(None, max_memory=0))
+    t_batch = time.perf_counter() - t0
+    assert (np.flatnonzero(loop) == np.sort(routed["_row"].to_numpy())).all()
+    _report("per-row score loop", n, t_loop)
+    _report("route_frame", n, t_batch)
+    print(f"  {'speedup':<28} {t_loop / t_batch:.1f}x  ({int(loop.sum()):,} relevant)")
+
+
+def _vocabulary(n: int, seed: int) -> list[str]:
+    # pseudo names (e.g. refinery / pipeline / minister names), a third multi-word
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = ["".join(rng.choice(letters, rng.integers(4, 10))) for _ in range(n)]
+    return [f"{w} {words[i - 1]}" if i % 3 == 0 else w for i, w in enumerate(words)]
+
+
+def bench_keywords(sizes=(30, 300, 3_000), n: int = 50):
+    from relevance import KeywordMatcher, RelevanceMatcher
+
+    texts = _selftexts(n)
+    print(f"[bench] regex alternation vs keyword automaton by vocabulary size ({n} ~9 KB selftexts)")
+    for size in sizes:
+        # "opec+" left out: \b after "+" never matches in the regex version
+        core = [w for w in _CORE_WORDS if w.isalpha()] + _vocabulary(size, seed=1)
+        ctx = list(_CTX_WORDS) + _vocabulary(size, seed=2)
+        regex = RelevanceMatcher.from_terms(core, ctx)
+        t0 = time.perf_counter()
+        auto = KeywordMatcher(core, ctx)
+        t_load = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        expected = [regex.is_relevant(t) for t in texts]
+        t_re = time.perf_counter() - t0
+        assert expected == [auto.is_relevant(t) for t in texts]
+        t_ac = _timeit(lambda: [auto.is_relevant(t) for t in texts])
+        print(f"  terms={len(core) + len(ctx):>6,}  regex {t_re * 1000:8.1f} ms   "
+              f"automaton {t_ac * 1000:8.1f} ms   (compile/load {t_load * 1000:.1f} ms)")
+
+
+def bench_relevance_cache(runs: int = 10, page: int = 500, overlap: float = 0.9):
+    from reddit_ingest import RELEVANCE as m
+    from relevance import ScoreCache
+
+    # consecutive runs re-fetch mostly the same posts (new.json / comment pages)
+    fresh = int(page * (1 - overlap))
+    pool = _selftexts(page + fresh * runs, words=300)
+    batches = [pool[i * fresh: i * fresh + page] for i in range(runs)]
+    print(f"[bench] relevance scoring over {runs} runs of {page} posts, {overlap:.0%} overlap between runs")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, cache in (
+            ("no cache", ScoreCache(None, max_memory=0)),
+            ("LRU + sqlite cache", ScoreCache(os.path.join(tmp, "scores.db"))),
+        ):
+            t0 = time.perf_counter()
+            for b in batches:
+                m.score_columns(b, cache=cache)
+            elapsed = time.perf_counter() - t0
+            print(f"  {label:<28} {elapsed * 1000:9.1f} ms  scored={cache.misses:>6,}  cached={cache.hits:>6,}")
+
+
+def bench_routing(n: int = 2_000):
+    from assets import ASSET_PROFILES, AssetRouter
+    from relevance import KeywordMatcher
+
+    texts = _selftexts(n, words=300)
+    print(f"[bench] asset routing: one matcher per asset vs one combined scan ({n:,} posts)")
+    for k in range(1, len(ASSET_PROFILES) + 1):
+        profiles = dict(list(ASSET_PROFILES.items())[:k])
+        per_asset = {a: KeywordMatcher(p.core, p.ctx) for a, p in profiles.items()}
+        router = AssetRouter.from_profiles(profiles)
+        separate = lambda: [[a for a, m in per_asset.items() if m.is_relevant(t)] for t in texts]
+        combined = lambda: [router.route(t) for t in texts]
+        assert separate() == combined()
+        t_sep, t_one = _timeit(separate), _timeit(combined)
+        print(f"  assets={k}  per-asset scans {t_sep * 1000:8.1f} ms   combined scan {t_one * 1000:8.1f} ms")
+
+
+# Lexicon sentiment
+
+def _news_texts(n: int, words: int = 40) -> pd.Series:
+    # headline + description sized texts, about one word in eight from the lexicon
+    from sentiment import get_lexicon
+
+    rng = np.random.default_rng(2)
+    lex = np.array(get_lexicon().terms.to_pylist(), dtype=object)
+    pool = np.array(_FILLER + _CORE_WORDS + _CTX_WORDS, dtype=object)
+    toks = pool[rng.integers(0, len(pool), (n, words))]
+    mask = rng.random((n, words)) < 0.125
+    toks[mask] = lex[rng.integers(0, len(lex), int(mask.sum()))]
+    return pd.Series([" ".join(row) + "." for row in toks]).astype("str")
+
+
+def _legacy_sentiment(categories: dict, texts) -> np.ndarray:
+    # reference: per-document tokenize + dict lookups
+    import re
+    from sentiment import CATEGORIES
+
+    word_re = re.compile(r"\w+")
+    cats = {}
+    for k, cat in enumerate(CATEGORIES):
+        for w in categories.get(cat, ()):
+            cats.setdefault(w, []).append(k)
+    out = np.zeros((len(texts), len(CATEGORIES)), dtype=np.int64)
+    for i, t in enumerate(texts):
+        for w in word_re.findall(t.lower()):
+            for k in cats.get(w, ()):
+                out[i, k] += 1
+    return out
+
+
+def bench_sentiment(sizes=(10_000, 100_000, 1_000_000)):
+    from sentiment import CATEGORIES, SENTIMENT_LEXICON_FILE, ContextLexicon, Lexicon, read_lexicon
+
+    plain, context = Lexicon.from_file(SENTIMENT_LEXICON_FILE), ContextLexicon.from_file(SENTIMENT_LEXICON_FILE)
+    categories = read_lexicon(SENTIMENT_LEXICON_FILE)
+    print(f"[bench] lexicon sentiment ({len(plain.terms):,} words, 40-word texts)")
+    for n in sizes:
+        texts = _news_texts(n)
+        if n <= 100_000:
+            values = texts.tolist()
+            t0 = time.perf_counter()
+            legacy = _legacy_sentiment(categories, values)
+            _report("per-document loop", n, time.perf_counter() - t0)
+            for lexicon in (plain, context):
+                cols = lexicon.score_columns(texts)
+                assert (np.column_stack([cols[f"sentiment_{c}"] for c in CATEGORIES]) == legacy).all()
+        _report("sparse lexicon product", n, _timeit(plain.score_columns, texts))
+        _report("+ negation/intensifiers", n, _timeit(context.score_columns, texts))
+
+
+def bench_sentiment_cache(runs: int = 10, page: int = 5_000, overlap: float = 0.9, lengths=(40, 300)):
+    from sentiment import SENTIMENT_CACHE_COLUMNS, get_lexicon
+    from relevance import ScoreCache
+
+    # each run re-fetches most of the previous run's posts under the same ids;
+    # a few of the repeats were edited since
+    lexicon = get_lexicon()
+    fresh = int(page * (1 - overlap))
+    for words in lengths:
+        pool = _news_texts(page + fresh * runs, words=words)
+        ids = pd.Series([f"post_id:{i}" for i in range(len(pool))])
+        batches = []
+        for r in range(runs):
+            sl = slice(r * fresh, r * fresh + page)
+            texts = pool[sl].reset_index(drop=True)
+            edited = np.random.default_rng(r).random(page) < 0.01
+            texts[edited] = texts[edited] + " edited"
+            batches.append((texts, ids[sl].reset_index(drop=True)))
+        print(f"[bench] sentiment scoring over {runs} runs of {page:,} {words}-word texts, {overlap:.0%} overlap between runs")
+        with tempfile.TemporaryDirectory() as tmp:
+            for label, cache in (
+                ("no cache", ScoreCache(None, max_memory=0, table="sentiment_scores", columns=SENTIMENT_CACHE_COLUMNS)),
+                ("LRU + sqlite cache", ScoreCache(os.path.join(tmp, "sentiment.db"), table="sentiment_scores",
+                                                  columns=SENTIMENT_CACHE_COLUMNS)),
+            ):
+                t0 = time.perf_counter()
+                for texts, keys in batches:
+                    cols = lexicon.cached_score_columns(texts, keys, cache=cache)
+                elapsed = time.perf_counter() - t0
+                assert (cols["sentiment_score"] == lexicon.score_columns(texts)["sentiment_score"]).all()
+                print(f"  {label:<28} {elapsed * 1000:9.1f} ms  scored={cache.misses:>7,}  cached={cache.hits:>7,}")
+
+
+def bench_backfill(n: int = 20_000, shard_rows: int = 2_500):
+    from backfill import backfill
+    from reddit_ingest import ROUTER, text_blob
+    from relevance import ScoreCache
+    from sentiment import get_lexicon
+
+    # distinct long posts: nothing to dedupe, every row is scanned and scored
+    df = pd.DataFrame({
+        "post_id": [f"t3_{i:07d}" for i in range(n)],
+        "title": [f"Daily thread #{i}" for i in range(n)],
+        "selftext": pd.Series(_selftexts(n, words=200, hits=4)).astype("str"),
+    })
+    cpus = os.cpu_count() or 1
+    print(f"[bench] backfill of {n:,} reddit posts, shards of {shard_rows:,} rows ({cpus} CPU)")
+
+    def serial():
+        # the ingest path in one process: route + score the whole frame
+        routed = ROUTER.route_frame(df, text_blob(df), cache=ScoreCache(None))
+        return routed.assign(**get_lexicon().score_columns(text_blob(routed)))
+
+    _report("ingest path, 1 process", n, _timeit(serial, repeat=1))
+    # the backfill must give exactly the ingest path's rows, in key order
+    want = serial().sort_values(["post_id", "asset"], kind="stable").reset_index(drop=True)
+    base = None
+    for workers in sorted({1, 2, cpus}):
+        t0 = time.perf_counter()
+        out = backfill("reddit_posts", df, workers=workers, shard_rows=shard_rows)
+        t = time.perf_counter() - t0
+        _report(f"backfill workers={workers}", n, t)
+        if base is None:
+            base = t
+        else:
+            print(f"  {'':<28} speedup {base / t:.1f}x over workers=1")
+        pd.testing.assert_frame_equal(out, want)
+    if cpus < 2:
+        print("  (1 CPU: the scaling with workers is not measured here)")
+
+
+def bench_sentiment_index(history: int = 500_000, page: int = 2_000, runs: int = 5):
+    from sentiment_index import GRAINS, SentimentIndex, bucket_stats, index_columns
+
+    rng = np.random.default_rng(7)
+    n = history + page * runs
+    df = pd.DataFrame({
+        "post_id": [f"t3_{i:07d}" for i in range(n)],
+        "asset": rng.choice(["WTI", "BRENT", "NG"], n),
+        "created_at": pd.Timestamp("2026-01-01", tz="UTC") + pd.to_timedelta(np.sort(rng.integers(0, 90 * 86400, n)), unit="s"),
+        "score": rng.integers(0, 2_000, n),
+        "sentiment_score": np.round(rng.uniform(-1, 1, n), 4),
+    })
+    print(f"[bench] sentiment index: {history:,} rows of history, {runs} runs of {page:,} new rows")
+
+    def full(rows):
+        # what the index replaces: re-aggregate every row on every run
+        secs = rows["created_at"].astype("datetime64[s, UTC]").astype("int64")
+        frame = pd.concat([pd.DataFrame({
+            "source": "reddit", "asset": rows["asset"], "grain": grain, "bucket": secs // width * width,
+            "x": rows["sentiment_score"], "w": 1.0 + rows["score"],
+        }) for grain, width in GRAINS.items()], ignore_index=True)
+        return index_columns(bucket_stats(frame))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SentimentIndex(os.path.join(tmp, "index.db"))
+        t0 = time.perf_counter()
+        index.update("reddit", df.iloc[:history], "post_id", "created_at", "score")
+        _report("initial load", history, time.perf_counter() - t0)
+
+        inc = rerun = rescan = 0.0
+        for r in range(runs):
+            upto = history + (r + 1) * page
+            batch = df.iloc[upto - page:upto]
+            t0 = time.perf_counter()
+            index.update("reddit", batch, "post_id", "created_at", "score")
+            inc += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            index.update("reddit", batch, "post_id", "created_at", "score")
+            rerun += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            expected = full(df.iloc[:upto])
+            rescan += time.perf_counter() - t0
+        _report("full re-aggregation / run", history, rescan / runs)
+        _report("incremental update / run", page, inc / runs)
+        _report("same rows again / run", page, rerun / runs)
+
+        got = index.series("day", "reddit").sort_values(["asset", "bucket"]).reset_index(drop=True)
+        want = expected[expected["grain"] == "day"].sort_values(["asset", "bucket"]).reset_index(drop=True)
+        assert np.allclose(got["weighted_mean"], want["weighted_mean"]) and np.allclose(got["std"], want["std"])
+
+
+def _ohlc_bars(tickers: int, years: int, seed: int = 3) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    days = 252 * years
+    n = tickers * days
+    close = 50.0 * np.exp(np.cumsum(rng.normal(0, 0.02, (tickers, days)), axis=1)).ravel()
+    open_ = close * np.exp(rng.normal(0, 0.01, n))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.01, n)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.01, n)))
+    ts = pd.bdate_range("2000-01-03", periods=days, tz="UTC")
+    return pd.DataFrame({
+        "ticker": np.repeat([f"T{i:04d}" for i in range(tickers)], days),
+        "ts": np.tile(ts, tickers),
+        "open": open_, "high": high, "low": low, "close": close,
+        "volume": rng.integers(1_000, 100_000, n),
+    })
+
+
+def _legacy_realized_vol(df: pd.DataFrame, windows, periods_per_year: float = 252.0) -> pd.DataFrame:
+    # per-ticker pandas rolling reference
+    parts = []
+    for ticker, g in df.sort_values(["ticker", "ts"]).groupby("ticker", sort=True):
+        lo, lh, ll, lc = (np.log(g[c]) for c in ("open", "high", "low", "close"))
+        r = lc.diff()
+        overnight = lo - lc.shift()
+        co = lc - lo
+        park = (lh - ll) ** 2 / (4 * np.log(2))
+        gk = 0.5 * (lh - ll) ** 2 - (2 * np.log(2) - 1) * co ** 2
+        rs = (lh - lc) * (lh - lo) + (ll - lc) * (ll - lo)
+        out = pd.DataFrame({"ticker": ticker, "ts": g["ts"]})
+        for w in windows:
+            k = 0.34 / (1.34 + (w + 1) / (w - 1))
+            rs_w = rs.where(overnight.notna()).rolling(w).mean()
+            var = {
+                "cc": r.rolling(w).var(),
+                "parkinson": park.rolling(w).mean(),
+                "garman_klass": gk.rolling(w).mean(),
+                "rogers_satchell": rs.rolling(w).mean(),
+                "yang_zhang": overnight.rolling(w).var() + k * co.where(overnight.notna()).rolling(w).var() + (1 - k) * rs_w,
+            }
+            for est, v in var.items():
+                out[f"{est}_{w}"] = np.sqrt(v.clip(lower=0) * periods_per_year)
+        parts.append(out)
+    return pd.concat(parts, ignore_index=True)
+
+
+def bench_volatility(ticker_years=((100, 10), (1_000, 2), (1_000, 5), (2_000, 5)), windows=(20, 60, 120)):
+    from volatility import realized_vol
+
+    print(f"[bench] realized volatility, 5 estimators x windows {windows}")
+    for tickers, years in ticker_years:
+        df = _ohlc_bars(tickers, years)
+        got = realized_vol(df, windows=windows, periods_per_year=252)
+        _report(f"{tickers * years:,} ticker-years", len(df), _timeit(lambda: realized_vol(df, windows=windows, periods_per_year=252)))
+        if tickers * years <= 1_000:
+            t0 = time.perf_counter()
+            want = _legacy_realized_vol(df, windows)
+            _report("per-ticker pandas rolling", len(df), time.perf_counter() - t0)
+            cols = [c for c in got.columns if c not in ("ticker", "ts")]
+            assert np.allclose(got[cols].to_numpy(), want[cols].to_numpy(), rtol=1e-6, equal_nan=True)
+
+
+def bench_vol_state(tickers: int = 2_000, years: int = 2, days: int = 5, windows=(20, 60, 120)):
+    from volatility import realized_vol
+    from vol_state import VolState
+
+    df = _ohlc_bars(tickers, years)
+    dates = np.sort(df["ts"].unique())
+    history = len(dates) - days
+    print(f"[bench] volatility state: {tickers:,} tickers, {history} days of history, then {days} daily runs")
+    with tempfile.TemporaryDirectory() as tmp:
+        state = VolState(os.path.join(tmp, "state.db"), windows=windows, periods_per_year=252)
+        t0 = time.perf_counter()
+        state.update(df[df["ts"] < dates[history]])
+        _report("seed", tickers * history, time.perf_counter() - t0)
+
+        inc = full = 0.0
+        for d in range(history, len(dates)):
+            # what market_ingest hands over: the last 60 days, one of them new
+            run = df[(df["ts"] <= dates[d]) & (df["ts"] > dates[d - 60])]
+            t0 = time.perf_counter()
+            state.update(run)
+            inc += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            expected = realized_vol(df[df["ts"] <= dates[d]], windows=windows, periods_per_year=252)
+            full += time.perf_counter() - t0
+        _report("full recompute / day", tickers * (d + 1), full / days)
+        _report("incremental / day", tickers, inc / days)
+
+        # a correction 10 days back on every 10th ticker
+        fixed = df[df["ts"] == dates[-10]].iloc[::10].assign(close=lambda f: f["close"] * 1.01)
+        t0 = time.perf_counter()
+        state.update(fixed)
+        _report("correction rewind", len(fixed), time.perf_counter() - t0)
+
+        got = state.latest()
+        cols = [c for c in got.columns if c not in ("ticker", "ts")]
+        want = expected.groupby("ticker").tail(1).reset_index(drop=True)
+        changed = got["ticker"].isin(fixed["ticker"]).to_numpy()
+        assert np.allclose(got[cols].to_numpy()[~changed], want[cols].to_numpy()[~changed], equal_nan=True)
+
+
+def _garch_bars(tickers: int, days: int, seed: int = 5) -> pd.DataFrame:
+    # closes driven by GJR-GARCH(1,1) returns with per-ticker parameters
+    rng = np.random.default_rng(seed)
+    alpha = rng.uniform(0.02, 0.06, tickers)
+    gamma = rng.uniform(0.0, 0.10, tickers)
+    beta = rng.uniform(0.80, 0.88, tickers)
+    omega = 0.02 * (1.0 - alpha - gamma / 2 - beta)
+    s2, e = omega / (1.0 - alpha - gamma / 2 - beta), np.zeros(tickers)
+    r = np.empty((tickers, days))
+    for t in range(days):
+        s2 = omega + (alpha + gamma * (e < 0)) * e * e + beta * s2
+        e = np.sqrt(s2) * rng.standard_normal(tickers)
+        r[:, t] = e
+    ts = pd.bdate_range("2000-01-03", periods=days, tz="UTC")
+    return pd.DataFrame({
+        "ticker": np.repeat([f"T{i:04d}" for i in range(tickers)], days),
+        "ts": np.tile(ts, tickers),
+        "close": (50.0 * np.exp(np.cumsum(r, axis=1) / 10.0)).ravel(),
+    })
+
+
+def bench_garch(tickers: int = 500, days: int = 1_100, refits: int = 3):
+    import garch
+
+    bars = _garch_bars(tickers, days)
+    dates = np.sort(bars["ts"].unique())
+    print(f"[bench] GARCH fits: {tickers:,} tickers, window {garch.GARCH_WINDOW} returns, {refits} daily refits")
+    for model in garch.MODELS:
+        print(f"  {model}")
+        prev, hinv = garch.fit_garch(bars[bars["ts"] <= dates[-refits - 1]], model, workers=1)
+        cold = warm = 0.0
+        for d in range(len(dates) - refits, len(dates)):
+            day = bars[bars["ts"] <= dates[d]]
+            cold += _timeit(garch.fit_garch, day, model, None, None, 1)
+            warm += _timeit(garch.fit_garch, day, model, prev, hinv, 1)
+            want, _ = garch.fit_garch(day, model, workers=1)
+            prev, hinv = garch.fit_garch(day, model, start=prev, hinv=hinv, workers=1)
+        _report("cold fit / day", tickers, cold / refits)
+        _report("warm refit / day", tickers, warm / refits)
+        # both fits must end at an optimum: where they differ, the likelihood has
+        # several local optima, and neither fit may improve when it is refitted from
+        # its own parameters with a fresh inverse Hessian. A likelihood whose
+        # supremum is a degenerate edge (alpha -> 0, beta -> 1) can still be
+        # creeping toward it after GARCH_MAX_ITER; those are left out
+        done = (prev["converged"] & want["converged"]).to_numpy()
+        diff = (prev["loglik"] - want["loglik"]).to_numpy()
+        split = done & (np.abs(diff) > 1e-3)
+        for fit in (prev, want) if split.any() else ():
+            redo, _ = garch.fit_garch(day[day["ticker"].isin(fit["ticker"][split])], model,
+                                      start=fit[split], workers=1)
+            assert (redo["loglik"].to_numpy() - fit["loglik"][split].to_numpy() <= 1e-3).all()
+        print(f"  {'':<28} iterations cold {want['iterations'].mean():.1f}, warm {prev['iterations'].mean():.1f}, "
+              f"speedup {cold / warm:.1f}x; {(done & ~split).mean():.1%} agree, "
+              f"{split.mean():.1%} at different local optima, {(~done).mean():.1%} not converged")
+
+
+def bench_har(tickers: int = 50, years: int = 10, window: int = 1_000):
+    import har
+
+    bars = _ohlc_bars(tickers, years)
+    rng = np.random.default_rng(7)
+    days = pd.bdate_range("2000-01-03", periods=252 * years, tz="UTC")
+    names = bars["ticker"].unique()
+    sentiment = har.sentiment_regressors(pd.DataFrame({
+        "asset": np.repeat(names, len(days) // 2),
+        "bucket": np.concatenate([rng.choice(days, len(days) // 2, replace=False) for _ in names]),
+        "count": rng.integers(1, 50, len(names) * (len(days) // 2)),
+        "mean": rng.normal(0.0, 0.3, len(names) * (len(days) // 2)),
+    }))
+    fred = har.fred_regressors(pd.DataFrame({
+        "series_id": np.repeat(["UNRATE", "DCOILWTICO"], [12 * years, len(days)]),
+        "observation_date": np.r_[pd.date_range("2000-01-01", periods=12 * years, freq="MS").date, days.date],
+        "value": np.r_[rng.normal(5.0, 0.5, 12 * years), 50.0 + np.cumsum(rng.normal(0.0, 1.0, len(days)))],
+    }))
+    print(f"[bench] HAR-RV rolling fits: {tickers} tickers x {years} years, window {window}")
+    rv = har.realized_variance(bars)
+    _report("realized variance", len(bars), _timeit(har.realized_variance, bars))
+    fits = har.fit_har(rv, window=window)
+    _report("HAR, all windows", len(fits), _timeit(lambda: har.fit_har(rv, window=window)))
+    _report("HAR + sentiment + FRED", len(fits), _timeit(lambda: har.fit_har(rv, sentiment, fred, window=window)))
+
+    # per-window least squares on the first ticker, for reference
+    design, cols = har.har_design(rv)
+    one = design[design["ticker"] == names[0]].reset_index(drop=True)
+    x = np.column_stack([np.ones(len(one)), one[cols].to_numpy()])
+    y = one["y"].to_numpy()
+    got = fits[fits["ticker"] == names[0]]["rv_forecast"].to_numpy()
+    want = []
+    t0 = time.perf_counter()
+    for t in range(len(one)):
+        xw, yw = x[max(t - window, 0):t], y[max(t - window, 0):t]
+        ok = np.isfinite(xw).all(axis=1) & np.isfinite(yw)
+        if ok.sum() >= har.HAR_MIN_OBS and np.isfinite(x[t]).all():
+            want.append(x[t] @ np.linalg.lstsq(xw[ok], yw[ok], rcond=None)[0])
+    loop = time.perf_counter() - t0
+    _report("per-window lstsq, 1 ticker", len(want), loop)
+    print(f"  {'':<28} per-window lstsq for all {tickers} tickers would take ~{loop * tickers:.0f} s")
+    assert np.allclose(got, want, rtol=1e-6)
+
+
+BENCHES = {
+    "coercion": bench_coercion,
+    "upsert": bench_upsert,
+    "stream": bench_stream,
+    "arrow": bench_arrow,
+    "nulls": bench_nulls,
+    "relevance": bench_relevance,
+    "relevance_batch": bench_relevance_batch,
+    "keywords": bench_keywords,
+    "relevance_cache": bench_relevance_cache,
+    "routing": bench_routing,
+    "sentiment": bench_sentiment,
+    "sentiment_cache": bench_sentiment_cache,
+    "backfill": bench_backfill,
+    "sentiment_index": bench_sentiment_index,
+    "volatility": bench_volatility,
+    "vol_state": bench_vol_state,
+    "garch": bench_garch,
+    "har": bench_har,
+}
+
+
+def main(argv=None):
+    names = (argv if argv is not None else sys.argv[1:]) or list(BENCHES)
+    for name in names:
+        if name not in BENCHES:
+            raise SystemExit(f"Unknown benchmark '{name}'. Valid: {', '.join(sorted(BENCHES))}")
+        BENCHES[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+# Column-level coercion to BigQuery field types.
+# Every coercer takes a whole Series and returns a whole Series; Python-level
+# work is limited to the cells that cannot be handled by a vectorized kernel.
+
+INT_TYPES = ("INT64", "INTEGER")
+FLOAT_TYPES = ("FLOAT64", "FLOAT", "NUMERIC", "BIGNUMERIC", "DOUBLE")
+TIMESTAMP_TYPES = ("TIMESTAMP", "DATETIME")
+DATE_TYPES = ("DATE",)
+STRING_TYPES = ("STRING", "JSON")
+
+# infer_dtype() kinds whose str() is the same as Series.astype(str)
+_STR_CASTABLE = ("integer", "floating", "mixed-integer-float", "boolean", "decimal")
+
+
+def _nulls_to_none(s: pd.Series) -> pd.Series:
+    out = s.astype(object)
+    return out.where(s.notna(), None)
+
+
+def coerce_int(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_integer_dtype(s.dtype):
+        return s.astype("Int64")
+    return pd.to_numeric(s, errors="coerce").astype("Int64")
+
+
+def coerce_float(s: pd.Series) -> pd.Series:
+    if s.dtype == np.float64:
+        return s
+    return pd.to_numeric(s, errors="coerce").astype("float64")
+
+
+def coerce_timestamp(s: pd.Series) -> pd.Series:
+    if isinstance(s.dtype, pd.DatetimeTZDtype) and str(s.dtype.tz) == "UTC":
+        return s
+    return pd.to_datetime(s, utc=True, errors="coerce")
+
+
+def _to_date_scalar(v):
+    if pd.isna(v):
+        return None
+    try:
+        return pd.to_datetime(v).date()
+    except Exception:
+        return None
+
+
+def coerce_date(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return _nulls_to_none(s.dt.date)
+
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) in ("date", "empty"):
+        return _nulls_to_none(s)
+
+    try:
+        parsed = pd.to_datetime(s, errors="coerce")
+    except (TypeError, ValueError):
+        return s.map(_to_date_scalar).astype(object)
+    if not pd.api.types.is_datetime64_any_dtype(parsed.dtype):
+        # mixed tz offsets come back as object Timestamps
+        return s.map(_to_date_scalar).astype(object)
+
+    out = _nulls_to_none(parsed.dt.date)
+
+    # the format is inferred from the first value, so re-parse the stragglers
+    # one by one instead of silently dropping them
+    missed = parsed.isna() & s.notna()
+    if missed.any():
+        out[missed] = s[missed].map(_to_date_scalar)
+    return out
+
+
+def _to_string_scalar(x):
+    if isinstance(x, str):
+        return x
+    if isinstance(x, (dict, list)):
+        return json.dumps(x, ensure_ascii=False)
+    if isinstance(x, (bytes, bytearray)):
+        try:
+            return x.decode("utf-8")
+        except Exception:
+            return str(x)
+    return str(x)
+
+
+def coerce_string(s: pd.Series) -> pd.Series:
+    kind = pd.api.types.infer_dtype(s, skipna=True)
+
+    if kind == "empty":
+        return pd.Series([None] * len(s), index=s.index, dtype=object)
+
+    if kind == "string":
+        return _nulls_to_none(s)
+
+    if kind in _STR_CASTABLE:
+        return s.astype(str).astype(object).where(s.notna(), None)
+
+    # mixed column: only non-str cells (dict/list/bytes/...) go through Python
+    out = _nulls_to_none(s)
+    todo = out.notna() & ~out.map(type).eq(str)
+    if todo.any():
+        out[todo] = out[todo].map(_to_string_scalar)
+    return out
+
+
+COERCERS = {}
+for _t in INT_TYPES:
+    COERCERS[_t] = coerce_int
+for _t in FLOAT_TYPES:
+    COERCERS[_t] = coerce_float
+for _t in TIMESTAMP_TYPES:
+    COERCERS[_t] = coerce_timestamp
+for _t in DATE_TYPES:
+    COERCERS[_t] = coerce_date
+for _t in STRING_TYPES:
+    COERCERS[_t] = coerce_string
+
+
+def coerce_series(s: pd.Series, field_type: str) -> pd.Series:
+    fn = COERCERS.get((field_type or "").upper())
+    return fn(s) if fn else s
+
+
+# Null normalization: empty and whitespace-only strings -> null. utf8_is_space
+# uses the same character set as str.isspace()/str.strip(), and Arrow-backed
+# string columns are handed to the kernel without a copy.
+
+def _is_blank(arr):
+    return pc.fill_null(pc.or_(pc.utf8_is_space(arr), pc.equal(pc.binary_length(arr), 0)), False)
+
+
+def _blank_mask(s: pd.Series) -> np.ndarray | None:
+    if isinstance(s.dtype, (pd.StringDtype, pd.ArrowDtype)) or s.dtype == object:
+        try:
+            arr = pa.array(s, from_pandas=True)
+            if not (pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)):
+                return None
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # mixed cells (dict/list/bytes): only the str cells can be blank
+            is_str = s.map(type).eq(str)
+            if not is_str.any():
+                return None
+            mask = np.zeros(len(s), dtype=bool)
+            mask[is_str.to_numpy()] = _blank_mask(s[is_str].astype(object))
+            return mask
+        return _is_blank(arr).to_numpy(zero_copy_only=False)
+    return None
+
+
+def blank_strings_to_null(df: pd.DataFrame, columns) -> pd.DataFrame:
+    cols = {}
+    for c in columns:
+        if c not in df.columns:
+            continue
+        mask = _blank_mask(df[c])
+        if mask is not None and mask.any():
+            cols[c] = df[c].where(~mask, None)
+    return df.assign(**cols) if cols else df
+
+
+class CoercionPlan:
+    # Compiled once per target schema: the column -> coercer lookups are
+    # resolved up front so applying the plan is a single pass over the frame.
+
+    def __init__(self, schema, partition_field: str | None = None):
+        self.schema = list(schema)
+        self.partition_field = partition_field
+        self.field_types = {f.name: (f.field_type or "").upper() for f in self.schema}
+        self.string_columns = [f.name for f in self.schema if self.field_types[f.name] in STRING_TYPES]
+        self.columns = [f.name for f in self.schema]
+        self.steps = [
+            (f.name, COERCERS[f.field_type.upper()])
+            for f in self.schema
+            if (f.field_type or "").upper() in COERCERS
+        ]
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        cols = {name: fn(df[name]) for name, fn in self.steps if name in df.columns}
+        return df.assign(**cols) if cols else df
+
+
+def coerce_to_schema(df: pd.DataFrame, schema) -> pd.DataFrame:
+    return CoercionPlan(schema).apply(df)
+
+
+# Arrow path: the same coercions as casts on Arrow columns, no pandas involved
+
+def arrow_type(field_type: str) -> pa.DataType:
+    ftype = (field_type or "").upper()
+    if ftype in INT_TYPES:
+        return pa.int64()
+    if ftype in FLOAT_TYPES:
+        return pa.float64()
+    if ftype == "TIMESTAMP":
+        return pa.timestamp("us", tz="UTC")
+    if ftype == "DATETIME":
+        return pa.timestamp("us")
+    if ftype in DATE_TYPES:
+        return pa.date32()
+    if ftype in ("BOOL", "BOOLEAN"):
+        return pa.bool_()
+    return pa.string()
+
+
+def arrow_schema(schema) -> pa.Schema:
+    return pa.schema([pa.field(f.name, arrow_type(f.field_type)) for f in schema])
+
+
+def _blank_to_null(col):
+    return pc.if_else(_is_blank(col), pa.scalar(None, col.type), col)
+
+
+def _cast(col, field_type: str, target: pa.DataType):
+    # safe casts: truncating 1.9 or wrapping 1e20 into INT64 fails instead of
+    # corrupting the value; only timestamp precision (ns -> us) may be dropped,
+    # as BigQuery itself stores microseconds
+    safe = not (pa.types.is_timestamp(col.type) and pa.types.is_timestamp(target))
+    try:
+        return pc.cast(col, target, safe=safe)
+    except pa.ArrowInvalid:
+        # an unparsable, truncated or out-of-range value aborts the cast: the
+        # column then goes through its pandas coercer, which nulls or raises
+        # exactly as upsert_to_bq would
+        fn = COERCERS.get((field_type or "").upper())
+        if fn is None:
+            raise
+        return pa.array(fn(col.to_pandas()), type=target, from_pandas=True)
+
+
+def coerce_arrow_table(table: pa.Table, schema) -> pa.Table:
+    for fld in schema:
+        if fld.name not in table.column_names:
+            continue
+        i = table.column_names.index(fld.name)
+        col = table.column(i)
+        target = arrow_type(fld.field_type)
+        if pa.types.is_string(col.type) or pa.types.is_large_string(col.type):
+            col = _blank_to_null(col)
+        if not col.type.equals(target):
+            col = _cast(col, fld.field_type, target)
+        table = table.set_column(i, fld.name, col)
+    return table
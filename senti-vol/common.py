@@ -1,231 +1,634 @@
-import os
-import json
-import hashlib
-import logging
-import numpy as np
-import pandas as pd
-from google.cloud import bigquery
-from dotenv import load_dotenv
-from datetime import datetime, timezone
-
-load_dotenv()
-
-
-# Env
-def get_env(key: str, required: bool = False, default=None):
-    val = os.getenv(key, default)
-    if required and (val is None or val == ""):
-        raise EnvironmentError(f"Missing required environment variable: {key}")
-    return val
-
-
-def init_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(message)s",
-        handlers=[logging.StreamHandler()]
-    )
-
-
-# Timestamp
-def now_utc():
-    return datetime.now(timezone.utc)
-
-
-def stable_id(value: str | None) -> str | None:
-    if value is None:
-        return None
-    return hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:32]
-
-
-# BigQuery helpers
-def bq_client() -> bigquery.Client:
-    project = get_env("GCP_PROJECT_ID", required=True)
-    return bigquery.Client(project=project)
-
-
-def bq_table(table_name: str) -> str:
-    project = get_env("GCP_PROJECT_ID", required=True)
-    dataset = get_env("BQ_DATASET", required=True)
-    return f"{project}.{dataset}.{table_name}"
-
-
-# Null Removal
-def _clean_df_drop_nulls(df: pd.DataFrame, required_non_null: list[str] | None = None) -> pd.DataFrame:
-    if df is None or df.empty:
-        return df
-
-    obj_cols = [c for c in df.columns if df[c].dtype == object]
-    for c in obj_cols:
-        df[c] = df[c].where(~df[c].astype(str).str.strip().eq(""), None)
-
-    df = df.dropna(how="all")
-
-    if required_non_null:
-        df = df.dropna(subset=required_non_null, how="any")
-
-    return df
-
-
-def upsert_to_bq(target_table: str, df: pd.DataFrame, schema=None, key_fields=None, staging_table: str = None, location: str = "US"):
-    if not key_fields:
-        raise ValueError("key_fields is required for upsert_to_bq")
-
-    client = bq_client()
-
-    if df is None or df.empty:
-        print(f"[upsert_to_bq] Empty dataframe, skipping upsert → {target_table}")
-        return
-
-    if "ingested_at" not in df.columns:
-        df["ingested_at"] = pd.to_datetime(now_utc())
-
-    ts_cols = [c for c in df.columns if isinstance(c, str) and c.endswith("_at") and c != "ingested_at"]
-    for c in ts_cols:
-        df[c] = pd.to_datetime(df[c], utc=True, errors="coerce")
-
-    df = _clean_df_drop_nulls(df, required_non_null=key_fields)
-    if df is None or df.empty:
-        print(f"[upsert_to_bq] All rows dropped after null-cleaning (null keys/empty rows) → {target_table}")
-        return
-
-    staging = staging_table if staging_table else (target_table + "_staging")
-    print(f"[upsert_to_bq] Using staging table: {staging}")
-
-    # Fetch target schema
-    try:
-        target_tbl = client.get_table(target_table)
-    except Exception as e:
-        raise RuntimeError(f"[upsert_to_bq] Unable to fetch target table schema for {target_table}: {e}")
-
-    target_schema = target_tbl.schema  
-
-    # Coerce DataFrame columns to match target types where possible
-    for fld in target_schema:
-        name = fld.name
-        ftype = fld.field_type.upper()
-        mode = fld.mode.upper() if fld.mode else "NULLABLE"
-        if name not in df.columns:
-            continue
-
-        # INT64 
-        if ftype == "INT64":
-            df[name] = pd.to_numeric(df[name], errors="coerce").astype("Int64")
-            continue
-
-        # FLOAT64 / NUMERIC-like
-        if ftype in ("FLOAT64", "NUMERIC", "BIGNUMERIC", "DOUBLE"):
-            df[name] = pd.to_numeric(df[name], errors="coerce").astype("float64")
-            continue
-
-        # TIMESTAMP / DATETIME 
-        if ftype in ("TIMESTAMP", "DATETIME"):
-            df[name] = pd.to_datetime(df[name], utc=True, errors="coerce")
-            continue
-
-        # DATE 
-        if ftype == "DATE":
-            def to_date(v):
-                if pd.isna(v):
-                    return None
-                try:
-                    return pd.to_datetime(v).date()
-                except Exception:
-                    return None
-            df[name] = df[name].apply(to_date)
-            continue
-
-        # JSON/STRING ensure string (serialize dict/list)
-        if ftype in ("STRING", "JSON"):
-            def ensure_string(x):
-                if x is None or (isinstance(x, float) and np.isnan(x)):
-                    return None
-                if isinstance(x, str):
-                    return x
-                if isinstance(x, (dict, list)):
-                    return json.dumps(x, ensure_ascii=False)
-                if isinstance(x, (bytes, bytearray)):
-                    try:
-                        return x.decode("utf-8")
-                    except Exception:
-                        return str(x)
-                return str(x)
-            df[name] = df[name].apply(ensure_string)
-            continue
-
-    #Truncate
-    job_config = bigquery.LoadJobConfig(write_disposition="WRITE_TRUNCATE")
-    job_config.schema = schema if schema is not None else target_schema
-
-    print(f"[upsert_to_bq] Loading {len(df)} rows → STAGING {staging}")
-    load_job = client.load_table_from_dataframe(df, staging, job_config=job_config, location=location)
-    load_job.result()
-    print(f"[upsert_to_bq] Staging load complete: job_id={load_job.job_id}")
-
-    # Build usable columns list and validate keys
-    target_cols = [f.name for f in target_schema]
-    usable_cols = [c for c in df.columns if c in target_cols]
-    if not usable_cols:
-        raise RuntimeError("[upsert_to_bq] No DataFrame columns match target table schema; aborting MERGE.")
-
-    missing_keys = [k for k in key_fields if k not in target_cols]
-    if missing_keys:
-        raise ValueError(f"[upsert_to_bq] key_fields not in target table schema: {missing_keys}")
-
-    rn_partition = ", ".join([f"`{k}`" for k in key_fields])
-    if "ingested_at" in usable_cols:
-        rn_order = "SAFE_CAST(ingested_at AS TIMESTAMP) DESC"
-    else:
-        rn_order = rn_partition
-
-    col_list = ", ".join([f"`{c}`" for c in usable_cols])
-    insert_cols = col_list
-    insert_vals = ", ".join([f"S.`{c}`" for c in usable_cols])
-    non_key_cols = [c for c in usable_cols if c not in key_fields]
-    update_assignments = ",\n      ".join([f"T.`{c}` = S.`{c}`" for c in non_key_cols])
-    on_clause = " AND ".join([f"T.`{k}` = S.`{k}`" for k in key_fields])
-
-    staging_select = f"""
-        SELECT
-          {col_list},
-          ROW_NUMBER() OVER (
-            PARTITION BY {rn_partition}
-            ORDER BY {rn_order}
-          ) AS rn
-        FROM `{staging}`
-    """
-
-    if non_key_cols:
-        merge_sql = f"""
-        MERGE `{target_table}` T
-        USING (
-          SELECT * FROM ({staging_select}) WHERE rn = 1
-        ) S
-        ON {on_clause}
-        WHEN MATCHED THEN
-          UPDATE SET
-          {update_assignments}
-        WHEN NOT MATCHED THEN
-          INSERT ({insert_cols})
-          VALUES ({insert_vals});
-        """
-    else:
-        merge_sql = f"""
-        MERGE `{target_table}` T
-        USING (
-          SELECT * FROM ({staging_select}) WHERE rn = 1
-        ) S
-        ON {on_clause}
-        WHEN NOT MATCHED THEN
-          INSERT ({insert_cols})
-          VALUES ({insert_vals});
-        """
-
-    print("[upsert_to_bq] Running MERGE...")
-    merge_job = client.query(merge_sql, location=location)
-    try:
-        merge_job.result()
-    except Exception as e:
-        print(f"[upsert_to_bq] MERGE failed for target {target_table}: {e}\nSQL:\n{merge_sql}")
-        raise
-    print(f"[upsert_to_bq] MERGE complete: job_id={merge_job.job_id}")
+import os
+import time
+import atexit
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import NamedTuple
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.cloud import bigquery
+from dotenv import load_dotenv
+from datetime import datetime, timezone, timedelta
+
+from coercion import CoercionPlan, blank_strings_to_null, coerce_arrow_table
+
+load_dotenv()
+
+
+# Env
+def get_env(key: str, required: bool = False, default=None):
+    val = os.getenv(key, default)
+    if required and (val is None or val == ""):
+        raise EnvironmentError(f"Missing required environment variable: {key}")
+    return val
+
+
+def init_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.StreamHandler()]
+    )
+
+
+# Timestamp
+def now_utc():
+    return datetime.now(timezone.utc)
+
+
+def stable_id(value: str | None) -> str | None:
+    if value is None:
+        return None
+    return hashlib.sha256(str(value).encode("utf-8")).hexdigest()[:32]
+
+
+# BigQuery helpers
+# One client (credentials + pooled HTTP session) per project, shared by every
+# source running in this process so auth and TLS setup are paid once.
+BQ_HTTP_POOL_SIZE = int(get_env("BQ_HTTP_POOL_SIZE", default="16"))
+BQ_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+_bq_clients: dict[str, bigquery.Client] = {}
+_bq_client_lock = threading.Lock()
+_bq_client_stats = {"created": 0, "reused": 0, "setup_seconds": 0.0}
+
+
+def _build_bq_client(project: str) -> bigquery.Client:
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession, Request
+    from requests.adapters import HTTPAdapter
+
+    credentials, _ = google.auth.default(scopes=BQ_SCOPES)
+    credentials.refresh(Request())
+
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=BQ_HTTP_POOL_SIZE, pool_maxsize=BQ_HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return bigquery.Client(project=project, credentials=credentials, _http=session)
+
+
+def bq_client() -> bigquery.Client:
+    project = get_env("GCP_PROJECT_ID", required=True)
+    with _bq_client_lock:
+        client = _bq_clients.get(project)
+        if client is not None:
+            _bq_client_stats["reused"] += 1
+            return client
+
+        t0 = time.perf_counter()
+        client = _build_bq_client(project)
+        _bq_client_stats["setup_seconds"] += time.perf_counter() - t0
+        _bq_client_stats["created"] += 1
+        _bq_clients[project] = client
+        return client
+
+
+def bq_client_stats() -> dict:
+    with _bq_client_lock:
+        stats = dict(_bq_client_stats)
+    avg = stats["setup_seconds"] / stats["created"] if stats["created"] else 0.0
+    stats["avg_setup_seconds"] = avg
+    stats["saved_seconds_est"] = avg * stats["reused"]
+    return stats
+
+
+def close_bq_clients():
+    with _bq_client_lock:
+        for client in _bq_clients.values():
+            client.close()
+        _bq_clients.clear()
+
+
+atexit.register(close_bq_clients)
+
+
+def bq_table(table_name: str) -> str:
+    project = get_env("GCP_PROJECT_ID", required=True)
+    dataset = get_env("BQ_DATASET", required=True)
+    return f"{project}.{dataset}.{table_name}"
+
+
+# Schema registry: one compiled coercion plan per target table
+SCHEMA_TTL_SECONDS = float(get_env("BQ_SCHEMA_TTL_SECONDS", default="900"))
+
+_plan_cache: dict[tuple[str, str], tuple[float, CoercionPlan]] = {}
+_plan_lock = threading.Lock()
+
+
+def get_coercion_plan(backend, table: str) -> CoercionPlan:
+    key = (backend.name, table)
+    now = time.monotonic()
+    with _plan_lock:
+        hit = _plan_cache.get(key)
+        if hit and now - hit[0] < SCHEMA_TTL_SECONDS:
+            return hit[1]
+
+    try:
+        target_schema, partition_field = backend.describe(table)
+    except Exception as e:
+        raise RuntimeError(f"[upsert_to_bq] Unable to fetch target table schema for {table}: {e}")
+
+    plan = CoercionPlan(target_schema, partition_field)
+    with _plan_lock:
+        _plan_cache[key] = (now, plan)
+    return plan
+
+
+def invalidate_schema_cache(table: str | None = None):
+    with _plan_lock:
+        if table is None:
+            _plan_cache.clear()
+        else:
+            for key in [k for k in _plan_cache if k[1] == table]:
+                del _plan_cache[key]
+
+
+# Null normalization
+def _normalize_nulls(df: pd.DataFrame, string_cols: list[str], required_non_null: list[str] | None = None) -> pd.DataFrame:
+    # only columns the target stores as STRING/JSON can hold blank text; the
+    # numeric/time coercers already turn blanks into nulls on their own
+    if df is None or df.empty:
+        return df
+
+    df = blank_strings_to_null(df, string_cols)
+
+    df = df.dropna(how="all")
+
+    if required_non_null:
+        df = df.dropna(subset=required_non_null, how="any")
+
+    return df
+
+
+def _prepare_frame(df: pd.DataFrame, key_fields: list[str], plan: CoercionPlan) -> pd.DataFrame | None:
+    if "ingested_at" not in df.columns:
+        df["ingested_at"] = pd.to_datetime(now_utc())
+
+    ts_cols = [c for c in df.columns if isinstance(c, str) and c.endswith("_at") and c != "ingested_at"]
+    for c in ts_cols:
+        df[c] = pd.to_datetime(df[c], utc=True, errors="coerce")
+
+    # coerce first: a blank or unparsable non-STRING key only becomes null here,
+    # and must be dropped with the other null keys rather than staged
+    df = plan.apply(df)
+    df = _normalize_nulls(df, plan.string_columns, required_non_null=key_fields)
+    if df is None or df.empty:
+        return None
+    return df
+
+
+def _check_columns(plan: CoercionPlan, columns, key_fields: list[str]) -> list[str]:
+    target_cols = plan.columns
+    usable_cols = [c for c in columns if c in target_cols]
+    if not usable_cols:
+        raise RuntimeError("[upsert_to_bq] No DataFrame columns match target table schema; aborting MERGE.")
+
+    missing_keys = [k for k in key_fields if k not in target_cols]
+    if missing_keys:
+        raise ValueError(f"[upsert_to_bq] key_fields not in target table schema: {missing_keys}")
+    return usable_cols
+
+
+# Client-side dedup: keep the latest row per key (same rule as the MERGE's
+# ROW_NUMBER() ... ORDER BY ingested_at DESC), so duplicates are never staged
+def _dedup_latest(df: pd.DataFrame, key_fields: list[str]) -> pd.DataFrame:
+    if not df.duplicated(subset=key_fields).any():
+        return df
+    if "ingested_at" in df.columns:
+        df = df.sort_values("ingested_at", kind="stable")
+    return df.drop_duplicates(subset=key_fields, keep="last").sort_index()
+
+
+# Partition pruning: bound the MERGE's target scan to the batch's partition range
+def _prunable(plan: CoercionPlan, key_fields: list[str]) -> str | None:
+    # only a key column is safe to bound: a non-key partition value can change
+    # between runs (e.g. a revised published_at), and the stored row would then
+    # fall outside the batch's range, miss the match and be inserted twice
+    field = plan.partition_field
+    return field if field in key_fields else None
+
+
+def _partition_range(plan: CoercionPlan, values: pd.Series | None):
+    field = plan.partition_field
+    if not field or values is None or values.empty or values.isna().any():
+        # null partition values could match target rows outside any range
+        return None
+    return (field, plan.field_types.get(field, ""), values.min(), values.max())
+
+
+def _widen_range(a, b):
+    if a is None or b is None:
+        return None
+    return (a[0], a[1], min(a[2], b[2]), max(a[3], b[3]))
+
+
+# Per-run staging: every upsert gets its own staging table, so concurrent
+# sources writing the same target never truncate each other's stage.
+STAGING_TTL_MINUTES = int(get_env("STAGING_TTL_MINUTES", default="60"))
+
+
+def run_staging_table(target_table: str, staging_table: str | None = None) -> str:
+    base = staging_table if staging_table else (target_table + "_staging")
+    return f"{base}_{now_utc():%Y%m%d%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+def _open_staging(backend, staging: str, schema, location: str):
+    backend.create_staging(staging, schema, now_utc() + timedelta(minutes=STAGING_TTL_MINUTES), location=location)
+
+
+def _load_fields(schema, columns) -> tuple[list, list[str]]:
+    # the stage has the full schema, but a load job wants its data and schema to
+    # agree: only the fields the data has are loaded, the rest stay NULL
+    present = set(columns)
+    fields = [f for f in schema if f.name in present]
+    return fields, [f.name for f in fields]
+
+
+def _drop_staging(backend, staging: str, location: str):
+    try:
+        backend.drop_table(staging, location=location)
+    except Exception as e:
+        # it still expires on its own
+        print(f"[upsert_to_bq] Could not drop staging table {staging}: {e}")
+
+
+class StagedUpsert(NamedTuple):
+    target_table: str
+    staging: str
+    usable_cols: list[str]
+    key_fields: list[str]
+    location: str
+    hash_index: object = None
+    hashed: list = []
+    prune: tuple | None = None
+
+
+def _finish_upsert(backend, stage: StagedUpsert):
+    if stage.hash_index is not None:
+        from rowhash import index_table
+
+        for keys in stage.hashed:
+            stage.hash_index.record(index_table(backend, stage.target_table), keys, stage.key_fields)
+
+
+# Batch commit: inside `with batch_commit():` upserts only stage; all MERGEs
+# then run as one transaction when the block exits cleanly.
+_batch: list | None = None
+_after_commit: list = []
+_batch_lock = threading.Lock()
+
+
+def after_commit(fn, *args, **kwargs):
+    # for local state derived from upserted rows: runs once those rows are
+    # committed - at the end of the enclosing batch_commit (dropped if it rolls
+    # back), or right away outside one, where the MERGE has already run
+    with _batch_lock:
+        if _batch is not None:
+            _after_commit.append((fn, args, kwargs))
+            return
+    fn(*args, **kwargs)
+
+
+def _run_after_commit(callbacks):
+    for fn, args, kwargs in callbacks:
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            # the MERGEs are committed; one failed follow-up must not stop the rest
+            print(f"[upsert_to_bq] Post-commit {getattr(fn, '__name__', fn)} failed: {e}")
+
+
+def _commit_stage(backend, stage: StagedUpsert):
+    with _batch_lock:
+        if _batch is not None:
+            _batch.append((backend, stage))
+            print(f"[upsert_to_bq] Staged for batch commit → {stage.target_table}")
+            return
+
+    try:
+        backend.merge(stage.target_table, stage.staging, stage.usable_cols, stage.key_fields,
+                      location=stage.location, prune=stage.prune)
+    except Exception:
+        # the cached schema may be stale (e.g. column added/retyped)
+        invalidate_schema_cache(stage.target_table)
+        raise
+    finally:
+        _drop_staging(backend, stage.staging, stage.location)
+    _finish_upsert(backend, stage)
+
+
+@contextmanager
+def batch_commit():
+    global _batch
+    with _batch_lock:
+        nested = _batch is not None
+        if not nested:
+            _batch = []
+            _after_commit.clear()
+    if nested:
+        # the outer block commits; the lock is not held while the body stages
+        yield
+        return
+
+    pending, callbacks = [], []
+    try:
+        yield
+        with _batch_lock:
+            pending, _batch = _batch, None
+            callbacks = _after_commit[:]
+            _after_commit.clear()
+
+        backends = {id(b): b for b, _ in pending}
+        for bid, backend in backends.items():
+            stages = [st for b, st in pending if id(b) == bid]
+            print(f"[upsert_to_bq] Batch commit: {len(stages)} MERGE(s) in one transaction")
+            try:
+                backend.merge_many(stages)
+            except Exception:
+                for st in stages:
+                    invalidate_schema_cache(st.target_table)
+                raise
+        for backend, st in pending:
+            _finish_upsert(backend, st)
+        _run_after_commit(callbacks)
+    finally:
+        with _batch_lock:
+            if _batch is not None:
+                # rolled back: the follow-ups never run
+                pending, _batch = _batch, None
+                _after_commit.clear()
+        for backend, st in pending:
+            _drop_staging(backend, st.staging, st.location)
+
+
+# Change detection (targets with a row_hash column)
+def _hash_and_filter(backend, plan: CoercionPlan, df: pd.DataFrame, key_fields: list[str], target_table: str):
+    from rowhash import HASH_COLUMN, add_row_hash, content_columns, get_hash_index, index_table
+
+    if HASH_COLUMN not in plan.columns:
+        return df, None
+
+    df = add_row_hash(df, content_columns([c for c in df.columns if c in plan.columns], key_fields))
+    index = get_hash_index()
+    if index is not None:
+        before = len(df)
+        df = index.drop_unchanged(index_table(backend, target_table), df, key_fields)
+        if len(df) < before:
+            print(f"[upsert_to_bq] Skipped {before - len(df)} unchanged rows (row_hash) → {target_table}")
+    return df, index
+
+
+def upsert_to_bq(target_table: str, df: pd.DataFrame, schema=None, key_fields=None, staging_table: str = None, location: str = "US"):
+    from warehouse import get_backend
+
+    if not key_fields:
+        raise ValueError("key_fields is required for upsert_to_bq")
+
+    backend = get_backend()
+
+    if df is None or df.empty:
+        print(f"[upsert_to_bq] Empty dataframe, skipping upsert → {target_table}")
+        return
+
+    # Cached target schema + coercion plan
+    plan = get_coercion_plan(backend, target_table)
+
+    df = _prepare_frame(df, key_fields, plan)
+    if df is None:
+        print(f"[upsert_to_bq] All rows dropped after null-cleaning (null keys/empty rows) → {target_table}")
+        return
+
+    df = _dedup_latest(df, key_fields)
+
+    df, hash_index = _hash_and_filter(backend, plan, df, key_fields, target_table)
+    if df.empty:
+        print(f"[upsert_to_bq] No changed rows, skipping upsert → {target_table}")
+        return
+
+    # Build usable columns list and validate keys
+    usable_cols = _check_columns(plan, df.columns, key_fields)
+
+    staging = run_staging_table(target_table, staging_table)
+    print(f"[upsert_to_bq] Using staging table: {staging}")
+
+    load_schema = schema if schema is not None else plan.schema
+    fields, cols = _load_fields(load_schema, df.columns)
+    try:
+        _open_staging(backend, staging, load_schema, location)
+        backend.load_staging(df[cols], staging, fields, location=location, write_disposition="WRITE_APPEND")
+    except Exception:
+        invalidate_schema_cache(target_table)
+        _drop_staging(backend, staging, location)
+        raise
+
+    hashed = [df[key_fields + ["row_hash"]]] if hash_index is not None else []
+    part = _prunable(plan, key_fields)
+    prune = _partition_range(plan, df[part] if part in df.columns else None)
+    _commit_stage(backend, StagedUpsert(target_table, staging, usable_cols, key_fields, location, hash_index, hashed, prune))
+
+
+# Streaming upsert
+STREAM_CHUNK_ROWS = int(get_env("UPSERT_CHUNK_ROWS", default="50000"))
+
+
+def _iter_slices(batches, chunk_rows: int):
+    # DataFrames or Arrow RecordBatches/Tables, cut to at most chunk_rows
+    for batch in batches:
+        if batch is None:
+            continue
+        if isinstance(batch, pd.DataFrame):
+            if len(batch) <= chunk_rows:
+                yield batch
+                continue
+            for off in range(0, len(batch), chunk_rows):
+                yield batch.iloc[off:off + chunk_rows].copy()
+        else:
+            for off in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(off, chunk_rows).to_pandas()
+
+
+def _iter_chunks(batches, chunk_rows: int):
+    # small frames are buffered up to chunk_rows so a stream of tiny batches
+    # does not turn into one load job per batch
+    buf, buf_rows = [], 0
+    for frame in _iter_slices(batches, chunk_rows):
+        if frame.empty:
+            continue
+        buf.append(frame)
+        buf_rows += len(frame)
+        if buf_rows >= chunk_rows:
+            yield buf[0] if len(buf) == 1 else pd.concat(buf, ignore_index=True)
+            buf, buf_rows = [], 0
+    if buf:
+        yield buf[0] if len(buf) == 1 else pd.concat(buf, ignore_index=True)
+
+
+def upsert_stream_to_bq(target_table: str, batches, schema=None, key_fields=None, staging_table: str = None,
+                        location: str = "US", chunk_rows: int | None = None) -> int:
+    # Bounded-memory variant of upsert_to_bq: each chunk is prepared, coerced and
+    # appended to staging on its own, then one MERGE runs over the whole stage.
+    from warehouse import get_backend
+
+    if not key_fields:
+        raise ValueError("key_fields is required for upsert_stream_to_bq")
+
+    backend = get_backend()
+    staging = run_staging_table(target_table, staging_table)
+    plan = get_coercion_plan(backend, target_table)
+    load_schema = schema if schema is not None else plan.schema
+
+    staged = 0
+    seen_cols: list[str] = []
+    hashed: list[pd.DataFrame] = []
+    hash_index = None
+    prune = None
+    opened = False
+    try:
+        for chunk in _iter_chunks(batches, chunk_rows or STREAM_CHUNK_ROWS):
+            chunk = _prepare_frame(chunk, key_fields, plan)
+            if chunk is None:
+                continue
+            chunk = _dedup_latest(chunk, key_fields)
+            chunk, hash_index = _hash_and_filter(backend, plan, chunk, key_fields, target_table)
+            if chunk.empty:
+                continue
+            part = _prunable(plan, key_fields)
+            chunk_range = _partition_range(plan, chunk[part] if part in chunk.columns else None)
+            prune = chunk_range if not staged else _widen_range(prune, chunk_range)
+            if hash_index is not None:
+                hashed.append(chunk[key_fields + ["row_hash"]])
+            seen_cols.extend(c for c in chunk.columns if c not in seen_cols)
+
+            if not opened:
+                _open_staging(backend, staging, load_schema, location)
+                opened = True
+            fields, cols = _load_fields(load_schema, chunk.columns)
+            backend.load_staging(chunk[cols], staging, fields, location=location, write_disposition="WRITE_APPEND")
+            staged += len(chunk)
+
+        if not staged:
+            print(f"[upsert_to_bq] Empty stream, skipping upsert → {target_table}")
+            return 0
+
+        usable_cols = _check_columns(plan, seen_cols, key_fields)
+    except Exception:
+        invalidate_schema_cache(target_table)
+        if opened:
+            _drop_staging(backend, staging, location)
+        raise
+
+    print(f"[upsert_to_bq] Streamed {staged} rows → STAGING {staging}")
+    _commit_stage(backend, StagedUpsert(target_table, staging, usable_cols, key_fields, location, hash_index, hashed, prune))
+    return staged
+
+
+# Arrow-native path: typed column buffers -> RecordBatch -> staging, no pandas
+class ArrowBatchBuilder:
+    # Rows are appended column-wise and materialised as one typed RecordBatch
+    # per flush, so there is no list-of-dicts or object-dtype frame in between.
+
+    def __init__(self, schema: pa.Schema):
+        self.schema = schema
+        self._cols = {name: [] for name in schema.names}
+
+    def __len__(self):
+        return len(self._cols[self.schema.names[0]])
+
+    def append(self, **values):
+        for name, col in self._cols.items():
+            col.append(values.get(name))
+
+    def flush(self) -> pa.RecordBatch | None:
+        if not len(self):
+            return None
+        arrays = [pa.array(self._cols[f.name], type=f.type) for f in self.schema]
+        self._cols = {name: [] for name in self.schema.names}
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def _prepare_arrow(table: pa.Table, plan: CoercionPlan, key_fields: list[str]) -> pa.Table:
+    if "ingested_at" not in table.column_names:
+        ts = pa.scalar(now_utc(), type=pa.timestamp("us", tz="UTC"))
+        table = table.append_column("ingested_at", pa.repeat(ts, table.num_rows))
+
+    table = coerce_arrow_table(table, plan.schema)
+
+    keep = None
+    for k in key_fields:
+        valid = pc.is_valid(table.column(k))
+        keep = valid if keep is None else pc.and_(keep, valid)
+    return table.filter(keep)
+
+
+def upsert_arrow_to_bq(target_table: str, batches, schema=None, key_fields=None, staging_table: str = None,
+                       location: str = "US") -> int:
+    # Arrow counterpart of upsert_to_bq: accepts a pa.Table, a RecordBatch or an
+    # iterable of RecordBatches and stages them as Parquet straight from Arrow.
+    from warehouse import get_backend
+
+    if not key_fields:
+        raise ValueError("key_fields is required for upsert_arrow_to_bq")
+
+    if isinstance(batches, pa.Table):
+        table = batches
+    elif isinstance(batches, pa.RecordBatch):
+        table = pa.Table.from_batches([batches])
+    else:
+        batches = [b for b in batches if b is not None and b.num_rows]
+        if not batches:
+            print(f"[upsert_to_bq] Empty batch list, skipping upsert → {target_table}")
+            return 0
+        table = pa.Table.from_batches(batches)
+
+    if table.num_rows == 0:
+        print(f"[upsert_to_bq] Empty table, skipping upsert → {target_table}")
+        return 0
+
+    backend = get_backend()
+    plan = get_coercion_plan(backend, target_table)
+    table = _prepare_arrow(table, plan, key_fields)
+
+    keys = table.select(key_fields + ["ingested_at"]).to_pandas()
+    latest = _dedup_latest(keys, key_fields)
+    if len(latest) < len(keys):
+        table = table.take(pa.array(latest.index.to_numpy()))
+
+    # row_hash is computed on a pandas view of the (few) content columns only
+    hashed, hash_index = None, None
+    if "row_hash" in plan.columns:
+        from rowhash import content_columns
+
+        content = content_columns([c for c in table.column_names if c in plan.columns], key_fields)
+        proj = table.select(key_fields + content).to_pandas()
+        hashed, hash_index = _hash_and_filter(backend, plan, proj, key_fields, target_table)
+        table = table.take(pa.array(hashed.index.to_numpy())).append_column(
+            "row_hash", pa.array(hashed["row_hash"].to_numpy(), type=pa.int64())
+        )
+
+    if table.num_rows == 0:
+        print(f"[upsert_to_bq] No rows left to upsert → {target_table}")
+        return 0
+
+    usable_cols = _check_columns(plan, table.column_names, key_fields)
+    load_schema = schema if schema is not None else plan.schema
+    fields, cols = _load_fields(load_schema, table.column_names)
+
+    staging = run_staging_table(target_table, staging_table)
+    print(f"[upsert_to_bq] Using staging table: {staging}")
+    try:
+        _open_staging(backend, staging, load_schema, location)
+        backend.load_staging_arrow(table.select(cols), staging, fields, location=location, write_disposition="WRITE_APPEND")
+    except Exception:
+        invalidate_schema_cache(target_table)
+        _drop_staging(backend, staging, location)
+        raise
+
+    hashed = [hashed[key_fields + ["row_hash"]]] if hash_index is not None else []
+    part = _prunable(plan, key_fields)
+    prune = _partition_range(plan, table.column(part).to_pandas() if part in table.column_names else None)
+    _commit_stage(backend, StagedUpsert(target_table, staging, usable_cols, key_fields, location, hash_index, hashed, prune))
+    return table.num_rows
@@ -1,34 +1,53 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-from fred_ingest import main as fred_main
-from market_ingest import main as market_main
-from youtube_ingest import main as youtube_main
-from reddit_ingest import main as reddit_main
-from news_ingest import main as news_main
-from yahoonews_ingest import main as yahoonews_main
-
-
-def main():
-
-    print("FRED ingestion")
-    fred_main()
-
-    print("\nMarket ingestion")
-    market_main()
-
-    print("\nYouTube ingestion")
-    youtube_main()
-
-    print("\nReddit ingestion")
-    reddit_main()
-
-    print("\nNewsAPI ingestion")
-    news_main()
-
-    print("\nYahoo News ingestion")
-    yahoonews_main()
-
-
-if __name__ == "__main__":
+from dotenv import load_dotenv
+load_dotenv()
+
+from fred_ingest import main as fred_main
+from market_ingest import main as market_main
+from youtube_ingest import main as youtube_main
+from reddit_ingest import main as reddit_main
+from news_ingest import main as news_main
+from yahoonews_ingest import main as yahoonews_main
+from common import bq_client_stats, batch_commit, get_env
+
+
+def run_sources():
+
+    print("FRED ingestion")
+    fred_main()
+
+    print("\nMarket ingestion")
+    market_main()
+
+    print("\nYouTube ingestion")
+    youtube_main()
+
+    print("\nReddit ingestion")
+    reddit_main()
+
+    print("\nNewsAPI ingestion")
+    news_main()
+
+    print("\nYahoo News ingestion")
+    yahoonews_main()
+
+
+def main():
+
+    # BATCH_COMMIT=1: every source only stages; all MERGEs run at the end as
+    # one transaction, so a run lands in every table or in none. By default
+    # each source commits on its own and a failing one leaves the rest loaded
+    if get_env("BATCH_COMMIT", default="0") == "1":
+        with batch_commit():
+            run_sources()
+    else:
+        run_sources()
+
+    stats = bq_client_stats()
+    print(
+        f"\nBigQuery clients: created={stats['created']} reused={stats['reused']} "
+        f"setup={stats['setup_seconds']:.2f}s saved~{stats['saved_seconds_est']:.2f}s"
+    )
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,577 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import os
+import sys
+import glob
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import get_env, init_logging
+from volatility import VOL_PERIODS_PER_YEAR, sort_bars, ts_ns
+
+
+# GARCH(1,1) and GJR-GARCH(1,1) models of the daily log close-to-close returns
+# of market_prices, fitted for all tickers at once:
+#
+#   sigma2[t] = omega + (alpha + gamma * (e[t-1] < 0)) * e[t-1]**2 + beta * sigma2[t-1]
+#
+# Each ticker's last GARCH_WINDOW returns are demeaned and scaled to unit
+# variance, which is also the backcast for the pre-sample terms. The returns
+# are laid out time-major (bars x tickers), so each step of the recursion is
+# one vector operation over all tickers. For fixed parameters the recursion is
+# a linear filter with coefficient beta, and the derivatives of sigma2 run
+# through the same filter, which gives the analytic gradient of the Gaussian
+# log-likelihood. The few slow tickers left at the end of a fit are filtered
+# in blocks instead, as products with the powers of beta. A batched BFGS fits
+# every ticker together over (log omega, softmax logits of alpha, gamma / 2,
+# beta and the slack to 1), which keeps every model positive and stationary.
+#
+# Fitted parameters and the BFGS inverse Hessian are kept per ticker in a
+# local SQLite file; the next refit starts from them.
+
+MODELS = ("garch", "gjr")
+PARAMS = ("omega", "alpha", "gamma", "beta")
+GARCH_WINDOW = int(get_env("GARCH_WINDOW", default="1000"))
+GARCH_MIN_OBS = int(get_env("GARCH_MIN_OBS", default="250"))
+GARCH_HORIZONS = tuple(int(h) for h in get_env("GARCH_HORIZONS", default="1,5,20").split(",") if h.strip())
+GARCH_WORKERS = int(get_env("GARCH_WORKERS", default=str(os.cpu_count() or 1)))
+GARCH_MAX_ITER = int(get_env("GARCH_MAX_ITER", default="200"))
+
+_LOG2PI = np.log(2.0 * np.pi)
+# below this many series (tickers x derivatives) the blocked filter beats the time loop
+_BLOCK = 32
+_BLOCK_MAX_SERIES = 64
+_GTOL = 1e-6
+# relative ridge on the BHHH matrix of a cold start
+_RIDGE = 1e-10
+# a weight or omega below _FLOOR whose likelihood slope is below -_KKT is not at
+# an optimum; such a fit is restarted from inside the simplex, at most _RESTARTS times
+_KKT = 1e-4
+_RESTARTS = 2
+# a step that lowers the mean negative log-likelihood by less than this (relative)
+# ends the fit: flat ridges, where the gradient never gets below _GTOL
+_FTOL = 1e-10
+# cold starts: the best of this (alpha, gamma, persistence) grid by likelihood
+_GRID_ALPHA = (0.02, 0.05, 0.10)
+_GRID_GAMMA = {"garch": (0.0,), "gjr": (0.0, 0.10)}
+_GRID_PERSISTENCE = (0.70, 0.90, 0.98)
+# starts are kept this far inside the simplex so a parameter at the boundary can leave it
+_FLOOR = 1e-4
+
+
+class Panel(NamedTuple):
+    tickers: np.ndarray  # m
+    ts: np.ndarray       # m, last bar (UTC ns)
+    e: np.ndarray        # T x m standardized returns, aligned on the last bar, 0 where missing
+    valid: np.ndarray    # T x m
+    n: np.ndarray        # m, returns in the window
+    scale: np.ndarray    # m, return standard deviation of the window
+
+    def take(self, rows) -> "Panel":
+        return Panel(self.tickers[rows], self.ts[rows], self.e[:, rows], self.valid[:, rows],
+                     self.n[rows], self.scale[rows])
+
+
+def returns_panel(bars: pd.DataFrame, window: int | None = None, min_obs: int | None = None) -> Panel:
+    # bars (ticker, ts, close) -> the last `window` log returns of every ticker
+    # with at least `min_obs`
+    window = window or GARCH_WINDOW
+    min_obs = min_obs or GARCH_MIN_OBS
+    bars, codes = sort_bars(bars[["ticker", "ts", "close"]])
+    close = bars["close"].to_numpy(dtype=np.float64, na_value=np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lc = np.log(np.where(close > 0, close, np.nan))
+    r = np.full(len(bars), np.nan)
+    same = codes[1:] == codes[:-1]
+    r[1:][same] = lc[1:][same] - lc[:-1][same]
+
+    ok = ~np.isnan(r)
+    codes_r, r = codes[ok], r[ok]
+    # position counted from each ticker's last return
+    size = np.bincount(codes_r, minlength=codes.max() + 1 if len(codes) else 0)
+    back = np.cumsum(size)[codes_r] - 1 - np.arange(len(r))
+    keep = back < window
+    codes_r, r, back = codes_r[keep], r[keep], back[keep]
+    n = np.minimum(size, window)
+    fit = np.flatnonzero(n >= min_obs)
+    skipped = int((size > 0).sum()) - len(fit)
+    if skipped:
+        print(f"[garch] skipped {skipped} ticker(s) with fewer than {min_obs} returns")
+
+    row = np.full(len(size), -1)
+    row[fit] = np.arange(len(fit))
+    sel = row[codes_r] >= 0
+    i, r, back = row[codes_r[sel]], r[sel], back[sel]
+    T = int(n[fit].max(initial=0))
+    n = n[fit]
+    mean = np.bincount(i, weights=r, minlength=len(fit)) / np.maximum(n, 1)
+    dev = r - mean[i]
+    scale = np.sqrt(np.bincount(i, weights=dev * dev, minlength=len(fit)) / np.maximum(n, 1))
+    # a constant price has no variance to model: it comes out as zero volatility
+    scale[scale == 0] = 1.0
+    e = np.zeros((T, len(fit)))
+    valid = np.zeros((T, len(fit)), dtype=bool)
+    e[T - 1 - back, i] = dev / scale[i]
+    valid[T - 1 - back, i] = True
+
+    last = np.flatnonzero(np.r_[codes[1:] != codes[:-1], True]) if len(codes) else np.zeros(0, dtype=np.int64)
+    tickers = bars["ticker"].iloc[last].to_numpy(dtype=object)
+    ts = ts_ns(bars["ts"].iloc[last])
+    return Panel(tickers[fit], ts[fit], e, valid, n, scale)
+
+
+def _filter(beta: np.ndarray, x: np.ndarray, init: np.ndarray) -> np.ndarray:
+    # y[t] = beta * y[t-1] + x[t] along axis 0 of x (T x m [x c]), y[-1] = init
+    if x[0].size <= _BLOCK_MAX_SERIES:
+        return _filter_blocked(beta, x, init)
+    y = np.empty_like(x)
+    b = beta if x.ndim == 2 else beta[:, None]
+    prev = init
+    for t in range(len(x)):
+        prev = np.multiply(b, prev, out=y[t])
+        prev += x[t]
+    return y
+
+
+def _filter_blocked(beta: np.ndarray, x: np.ndarray, init: np.ndarray) -> np.ndarray:
+    # the same filter for a handful of series: within a block of _BLOCK bars it
+    # is one product with the powers of beta, and only the block carries are
+    # chained in Python
+    T, m = x.shape[:2]
+    nb = -(-T // _BLOCK)
+    xt = np.moveaxis(x, 0, -1)
+    lead = xt.shape[:-1]
+    padded = np.zeros(lead + (nb * _BLOCK,))
+    padded[..., :T] = xt
+    lag = np.subtract.outer(np.arange(_BLOCK), np.arange(_BLOCK))
+    powers = beta[:, None] ** np.arange(_BLOCK + 1)
+    tri = np.where(lag >= 0, powers[:, np.maximum(lag, 0)], 0.0)
+    y = np.matmul(padded.reshape(m, -1, _BLOCK), tri.transpose(0, 2, 1)).reshape(lead + (nb, _BLOCK))
+    head = powers[:, 1:] if x.ndim == 2 else powers[:, None, 1:]
+    carry = init
+    for b in range(nb):
+        y[..., b, :] += carry[..., None] * head
+        carry = y[..., b, -1]
+    return np.moveaxis(y.reshape(lead + (nb * _BLOCK,))[..., :T], -1, 0)
+
+
+class _Data(NamedTuple):
+    # parameter-free inputs of the recursion
+    e2: np.ndarray      # e[t]**2
+    e2lag: np.ndarray   # e[t-1]**2, backcast 1 before the first return
+    ne2lag: np.ndarray  # (e[t-1] < 0) * e[t-1]**2, backcast 1/2
+    v: np.ndarray       # valid as float
+    n: np.ndarray
+
+    def take(self, rows) -> "_Data":
+        return _Data(*(x[:, rows] for x in self[:4]), self.n[rows])
+
+
+def _data(panel: Panel) -> _Data:
+    e, v = panel.e, panel.valid
+    prev_v = np.zeros_like(v)
+    prev_v[1:] = v[:-1]
+    e_lag = np.zeros_like(e)
+    e_lag[1:] = e[:-1]
+    e2lag = np.where(prev_v, e_lag * e_lag, 1.0) * v
+    ne2lag = np.where(prev_v, (e_lag < 0) * e_lag * e_lag, 0.5) * v
+    return _Data(e * e, e2lag, ne2lag, v.astype(np.float64), panel.n.astype(np.float64))
+
+
+def _unpack(a: np.ndarray, gjr: bool):
+    # unconstrained m x k -> omega, alpha, gamma, beta and the simplex weights
+    omega = np.exp(a[:, 0])
+    z = np.concatenate([a[:, 1:], np.zeros((len(a), 1))], axis=1)
+    p = np.exp(z - z.max(axis=1, keepdims=True))
+    p /= p.sum(axis=1, keepdims=True)
+    if gjr:
+        return omega, p[:, 0], 2.0 * p[:, 1], p[:, 2], p
+    return omega, p[:, 0], np.zeros(len(a)), p[:, 1], p
+
+
+def _pack(theta: np.ndarray, gjr: bool) -> np.ndarray:
+    # m x 4 (omega, alpha, gamma, beta) on the unit-variance scale -> unconstrained
+    omega, alpha, gamma, beta = theta.T
+    parts = [alpha, gamma / 2.0, beta] if gjr else [alpha, beta]
+    p = np.maximum(np.stack(parts, axis=1), _FLOOR)
+    slack = np.maximum(1.0 - p.sum(axis=1), _FLOOR)
+    return np.column_stack([np.log(np.maximum(omega, 1e-12)), np.log(p) - np.log(slack)[:, None]])
+
+
+def _grid_start(model: str, data: _Data) -> np.ndarray:
+    # m x 4 cold starting parameters: the grid point with the best likelihood
+    gjr = model == "gjr"
+    grid = np.array([
+        (1.0 - pers, alpha, gamma, pers - alpha - gamma / 2.0)
+        for alpha in _GRID_ALPHA for gamma in _GRID_GAMMA[model] for pers in _GRID_PERSISTENCE
+        if pers - alpha - gamma / 2.0 > 0
+    ])
+    m = len(data.n)
+    best, best_f = np.tile(grid[0], (m, 1)), np.full(m, np.inf)
+    for theta in grid:
+        f = _nll(_pack(np.tile(theta, (m, 1)), gjr), data, gjr, grad=False)[0]
+        better = f < best_f
+        best[better], best_f[better] = theta, f[better]
+    return best
+
+
+def _to_a(x: np.ndarray, omega: np.ndarray, p: np.ndarray, gjr: bool) -> np.ndarray:
+    # derivatives in (omega, alpha, gamma, beta) -> in `a`; x is (..., m, k)
+    out = np.empty_like(x)
+    out[..., 0] = x[..., 0] * omega
+    q = x[..., 1:] * (np.array([1.0, 2.0, 1.0]) if gjr else 1.0)
+    pf = p[:, :-1]
+    out[..., 1:] = pf * (q - (q * pf).sum(axis=-1, keepdims=True))
+    return out
+
+
+def _nll(a: np.ndarray, data: _Data, gjr: bool, grad: bool = True, bhhh: bool = False, slopes: bool = False):
+    # mean negative log-likelihood per return, its gradient in `a` and sigma2;
+    # bhhh=True adds the outer-product (BHHH) estimate of its Hessian.
+    # slopes=True returns only the slopes of the likelihood in omega (m) and in
+    # each simplex weight (m x k, the slack last) instead
+    omega, alpha, gamma, beta, p = _unpack(a, gjr)
+    v = data.v
+    x = v * (omega + alpha * data.e2lag + gamma * data.ne2lag) + (1.0 - v) * (1.0 - beta)
+    s2 = _filter(beta, x, np.ones(len(a)))
+    nll = 0.5 * (v * (np.log(s2) + data.e2 / s2)).sum(axis=0) / data.n + 0.5 * _LOG2PI
+    if not grad:
+        return nll, None, s2
+
+    # before the first return sigma2 stays at the backcast: no derivative
+    s2lag = np.ones_like(s2)
+    s2lag[1:] = s2[:-1]
+    cols = [v, data.e2lag, data.ne2lag, v * s2lag] if gjr else [v, data.e2lag, v * s2lag]
+    ds2 = _filter(beta, np.stack(cols, axis=-1), np.zeros((len(a), len(cols))))
+    w = 0.5 * v * (1.0 / s2 - data.e2 / (s2 * s2))
+    g_theta = np.einsum("tm,tmc->mc", w, ds2) / data.n[:, None]
+    if slopes:
+        q = np.concatenate([g_theta[:, 1:] * (np.array([1.0, 2.0, 1.0]) if gjr else 1.0), np.zeros((len(a), 1))], axis=1)
+        return g_theta[:, 0], q - (q * p).sum(axis=1, keepdims=True)
+    g = _to_a(g_theta, omega, p, gjr)
+    if not bhhh:
+        return nll, g, s2
+    scores = _to_a(w[:, :, None] * ds2, omega, p, gjr)
+    return nll, g, s2, np.einsum("tmi,tmj->mij", scores, scores) / data.n[:, None, None]
+
+
+def _inv_bhhh(h: np.ndarray) -> np.ndarray:
+    ridge = _RIDGE * np.trace(h, axis1=1, axis2=2)
+    return np.linalg.inv(h + ridge[:, None, None] * np.eye(h.shape[-1]))
+
+
+def _pulled(a: np.ndarray, data: _Data, gjr: bool) -> np.ndarray:
+    # rows resting on a face of the simplex, or at omega -> 0, that the
+    # likelihood pulls them off: the gradient in a weight's logit (p * c) vanishes
+    # with the weight p, the slope c of the likelihood in that weight does not;
+    # likewise for log omega
+    omega, *_, p = _unpack(a, gjr)
+    c_omega, c = _nll(a, data, gjr, slopes=True)
+    return ((p < _FLOOR) & (c < -_KKT)).any(axis=1) | ((omega < _FLOOR) & (c_omega < -_KKT))
+
+
+def _bfgs(a: np.ndarray, hinv: np.ndarray, cold: np.ndarray, data: _Data, gjr: bool, max_iter: int):
+    # batched BFGS with Armijo backtracking; rows stop independently. Also
+    # returns each row's sigma2 at the last bar.
+    m, k = a.shape
+    a, hinv = a.copy(), hinv.copy()
+    f, g, s2, bhhh = _nll(a, data, gjr, bhhh=True)
+    s2_end = s2[-1].copy()
+    # cold rows start from the inverse BHHH matrix: it carries the softmax
+    # scaling, so a weight near the boundary gets the large step it needs
+    if cold.any():
+        hinv[cold] = _inv_bhhh(bhhh[cold])
+    iters = np.zeros(m, dtype=np.int64)
+    converged = np.abs(g).max(axis=1) < _GTOL
+    checked = np.zeros(m, dtype=bool)
+    restarts = np.zeros(m, dtype=np.int64)
+    eye = np.eye(k)
+    for _ in range(max_iter):
+        # a stop on a face the likelihood pulls away from is a false optimum:
+        # first move the parameters back inside by the start floors and fit on; if
+        # that ends on a face again, start over from the cold grid start
+        fresh = np.flatnonzero(converged & ~checked)
+        checked[fresh] = True
+        fresh = fresh[restarts[fresh] < _RESTARTS]
+        if len(fresh):
+            redo = fresh[_pulled(a[fresh], data.take(fresh), gjr)]
+            if len(redo):
+                sub = data.take(redo)
+                omega, alpha, gamma, beta, _ = _unpack(a[redo], gjr)
+                theta = np.column_stack([omega, alpha, gamma, beta])
+                again = restarts[redo] > 0
+                if again.any():
+                    theta[again] = _grid_start("gjr" if gjr else "garch", sub.take(again))
+                a[redo] = _pack(theta, gjr)
+                f[redo], g[redo], s2, h = _nll(a[redo], sub, gjr, bhhh=True)
+                s2_end[redo] = s2[-1]
+                hinv[redo] = _inv_bhhh(h)
+                restarts[redo] += 1
+                converged[redo] = checked[redo] = False
+        idx = np.flatnonzero(~converged)
+        if not len(idx):
+            break
+        d = -np.einsum("mij,mj->mi", hinv[idx], g[idx])
+        slope = (g[idx] * d).sum(axis=1)
+        sub = data.take(idx)
+        uphill = slope >= 0
+        if uphill.any():
+            hinv[idx[uphill]] = eye
+            d[uphill] = -g[idx[uphill]]
+            slope[uphill] = -(g[idx[uphill]] ** 2).sum(axis=1)
+
+        # the full step usually passes: try it with the gradient, backtrack without
+        step = np.ones(len(idx))
+        f_new, g_new, s2 = _nll(a[idx] + d, sub, gjr)
+        s2_new = s2[-1]
+        pending = np.flatnonzero(~(f_new <= f[idx] + 1e-4 * slope))
+        f_new[pending] = np.nan
+        for _ in range(40):
+            if not len(pending):
+                break
+            step[pending] *= 0.5
+            f_try = _nll(a[idx[pending]] + step[pending, None] * d[pending], sub.take(pending), gjr, grad=False)[0]
+            ok = f_try <= f[idx[pending]] + 1e-4 * step[pending] * slope[pending]
+            f_new[pending[ok]] = f_try[ok]
+            pending = pending[~ok]
+        # no decrease along d at all: at the optimum to machine precision
+        moved = ~np.isnan(f_new)
+        converged[idx[~moved]] = True
+        back = np.flatnonzero(moved & (step < 1.0))
+        if len(back):
+            _, g_new[back], s2 = _nll(a[idx[back]] + step[back, None] * d[back], sub.take(back), gjr)
+            s2_new[back] = s2[-1]
+        idx, d, step, f_new, g_new, s2_new = idx[moved], d[moved], step[moved], f_new[moved], g_new[moved], s2_new[moved]
+        if not len(idx):
+            continue
+
+        s = step[:, None] * d
+        a_new = a[idx] + s
+        y = g_new - g[idx]
+        sy = (s * y).sum(axis=1)
+        upd = sy > 1e-12
+        if upd.any():
+            rho = 1.0 / sy[upd]
+            h, su, yu = hinv[idx[upd]], s[upd], y[upd]
+            hy = np.einsum("mij,mj->mi", h, yu)
+            yhy = (yu * hy).sum(axis=1)
+            hinv[idx[upd]] = (
+                h
+                - rho[:, None, None] * (hy[:, :, None] * su[:, None, :] + su[:, :, None] * hy[:, None, :])
+                + (rho * rho * yhy + rho)[:, None, None] * su[:, :, None] * su[:, None, :]
+            )
+        df = f[idx] - f_new
+        a[idx], f[idx], g[idx], s2_end[idx] = a_new, f_new, g_new, s2_new
+        iters[idx] += 1
+        converged[idx] |= (np.abs(g_new).max(axis=1) < _GTOL) | (df <= _FTOL * (1.0 + np.abs(f_new)))
+    return a, hinv, f, s2_end, iters, converged
+
+
+def fit_panel(model: str, panel: Panel, start: np.ndarray | None = None, hinv: np.ndarray | None = None,
+              max_iter: int | None = None, periods_per_year: float | None = None) -> tuple[pd.DataFrame, np.ndarray]:
+    # fit every ticker of the panel; start is m x 4 parameters in return
+    # units (NaN rows start cold), hinv the matching inverse Hessians
+    if model not in MODELS:
+        raise ValueError(f"Unknown model '{model}'. Valid: {', '.join(MODELS)}")
+    gjr = model == "gjr"
+    m, k = len(panel.tickers), 4 if gjr else 3
+    scale = periods_per_year if periods_per_year is not None else VOL_PERIODS_PER_YEAR
+
+    data = _data(panel)
+    warm = np.zeros(m, dtype=bool) if start is None else ~np.isnan(start).any(axis=1)
+    theta = np.empty((m, len(PARAMS)))
+    if not warm.all():
+        theta[~warm] = _grid_start(model, data.take(~warm))
+    if warm.any():
+        theta[warm] = start[warm]
+        theta[warm, 0] /= panel.scale[warm] ** 2
+    h0 = np.tile(np.eye(k), (m, 1, 1))
+    if hinv is not None:
+        has = warm & ~np.isnan(hinv).any(axis=(1, 2))
+        h0[has] = hinv[has]
+    else:
+        has = np.zeros(m, dtype=bool)
+
+    # trial steps far outside the data's range overflow and fail the line search
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        a, h, f, s2_end, iters, converged = _bfgs(_pack(theta, gjr), h0, ~has, data, gjr, max_iter or GARCH_MAX_ITER)
+    omega, alpha, gamma, beta, _ = _unpack(a, gjr)
+
+    # next-bar variance, then the mean variance over each horizon
+    e_last = panel.e[-1]
+    s2_next = omega + (alpha + gamma * (e_last < 0)) * e_last ** 2 + beta * s2_end
+    pers = alpha + gamma / 2.0 + beta
+    var2 = panel.scale ** 2
+    out = {
+        "ticker": panel.tickers,
+        "ts": pd.to_datetime(panel.ts, utc=True),
+        "model": model,
+        "n": panel.n,
+        "omega": omega * var2,
+        "alpha": alpha,
+        "gamma": gamma,
+        "beta": beta,
+        "persistence": pers,
+        # log-likelihood of the demeaned returns in return units
+        "loglik": -f * panel.n - panel.n * np.log(panel.scale),
+        "iterations": iters,
+        "converged": converged,
+        "warm": warm,
+    }
+    # expected sigma2 j bars ahead: omega + pers * (the one before), no 1 / (1 - pers)
+    var, total = s2_next.copy(), np.zeros(m)
+    for j in range(1, max(GARCH_HORIZONS, default=0) + 1):
+        total += var
+        if j in GARCH_HORIZONS:
+            out[f"vol_{j}"] = np.sqrt(total / j * var2 * scale)
+        var = pers * var + omega
+    return pd.DataFrame(out), h
+
+
+def fit_garch(bars: pd.DataFrame, model: str = "gjr", start: pd.DataFrame | None = None,
+              hinv: dict | None = None, workers: int | None = None) -> tuple[pd.DataFrame, dict]:
+    # bars (ticker, ts, close) -> one row per fitted ticker and the inverse
+    # Hessians by ticker; start holds per-ticker PARAMS to warm-start from
+    panel = returns_panel(bars)
+    m = len(panel.tickers)
+    if not m:
+        return pd.DataFrame(), {}
+    k = 4 if model == "gjr" else 3
+    theta = np.full((m, len(PARAMS)), np.nan)
+    h0 = np.full((m, k, k), np.nan)
+    if start is not None and not start.empty:
+        theta = start.set_index("ticker").reindex(panel.tickers)[list(PARAMS)].to_numpy(dtype=np.float64)
+    for i, t in enumerate(panel.tickers):
+        if hinv and t in hinv and hinv[t].shape == (k, k):
+            h0[i] = hinv[t]
+
+    workers = min(workers or GARCH_WORKERS, m)
+    chunks = np.array_split(np.arange(m), workers)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(fit_panel, [model] * workers, [panel.take(c) for c in chunks],
+                                  [theta[c] for c in chunks], [h0[c] for c in chunks]))
+    else:
+        parts = [fit_panel(model, panel, theta, h0)]
+    out = pd.concat([p[0] for p in parts], ignore_index=True)
+    h = np.concatenate([p[1] for p in parts])
+    return out, dict(zip(out["ticker"], h))
+
+
+class GarchStore:
+    # local (ticker, model) -> last fitted parameters and inverse Hessian
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS garch_params ("
+            " ticker TEXT NOT NULL, model TEXT NOT NULL, ts INTEGER NOT NULL, n INTEGER NOT NULL,"
+            " params BLOB NOT NULL, hinv BLOB NOT NULL, loglik REAL,"
+            " PRIMARY KEY (ticker, model)) WITHOUT ROWID"
+        )
+
+    def load(self, model: str) -> tuple[pd.DataFrame, dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ticker, params, hinv FROM garch_params WHERE model = ?", (model,)
+            ).fetchall()
+        start = pd.DataFrame(
+            [np.frombuffer(p, dtype=np.float64) for _, p, _ in rows] or np.zeros((0, len(PARAMS))), columns=list(PARAMS)
+        )
+        start.insert(0, "ticker", [t for t, _, _ in rows])
+        hinv = {}
+        for t, _, h in rows:
+            h = np.frombuffer(h, dtype=np.float64)
+            k = int(round(np.sqrt(len(h))))
+            hinv[t] = h.reshape(k, k)
+        return start, hinv
+
+    def save(self, fits: pd.DataFrame, hinv: dict):
+        params = fits[list(PARAMS)].to_numpy(dtype=np.float64)
+        ts = ts_ns(fits["ts"])
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO garch_params (ticker, model, ts, n, params, hinv, loglik)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((t, m, int(s), int(n), p.tobytes(), hinv[t].tobytes(), float(ll))
+                     for t, m, s, n, p, ll in zip(fits["ticker"], fits["model"], ts, fits["n"], params, fits["loglik"])),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def refit(self, bars: pd.DataFrame, model: str = "gjr", workers: int | None = None) -> pd.DataFrame:
+        # fit from the stored parameters where there are any, then store the new ones
+        start, hinv = self.load(model)
+        fits, h = fit_garch(bars, model, start=start, hinv=hinv, workers=workers)
+        if not fits.empty:
+            self.save(fits, h)
+        return fits
+
+    def clear(self, model: str | None = None):
+        with self._lock:
+            if model is None:
+                self._conn.execute("DELETE FROM garch_params")
+            else:
+                self._conn.execute("DELETE FROM garch_params WHERE model = ?", (model,))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_garch_store() -> GarchStore | None:
+    # GARCH_STATE_PATH="" turns the warm starts off
+    global _store
+    with _store_lock:
+        if _store is None:
+            path = get_env("GARCH_STATE_PATH", default="senti_vol_garch.db")
+            if not path:
+                return None
+            _store = GarchStore(path)
+        return _store
+
+
+def main(argv=None):
+    args = argv if argv is not None else sys.argv[1:]
+    if len(args) < 2 or args[0] not in MODELS:
+        raise SystemExit(f"Usage: python garch.py <{'|'.join(MODELS)}> <market_prices parquet file/glob> [...]")
+    init_logging()
+    model, files = args[0], []
+    for p in args[1:]:
+        files.extend(sorted(glob.glob(p)) or [p])
+    bars = pa.concat_tables([pq.read_table(f) for f in files], promote_options="default").to_pandas()
+
+    store = get_garch_store()
+    fits = store.refit(bars, model) if store is not None else fit_garch(bars, model)[0]
+    if fits.empty:
+        print("[garch] nothing to fit")
+        return
+    print(f"[garch] {model}: {len(fits)} tickers, {int(fits['warm'].sum())} warm-started, "
+          f"{int((~fits['converged']).sum())} not converged, window={GARCH_WINDOW}")
+
+    # GARCH_OUTPUT=<file.parquet> writes the fits; otherwise they are printed
+    output = get_env("GARCH_OUTPUT", default="")
+    if output:
+        pq.write_table(pa.Table.from_pandas(fits, preserve_index=False), output)
+        print(f"[garch] wrote {output}")
+        return
+    with pd.option_context("display.width", 200, "display.max_columns", 50):
+        print(fits.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import get_env, init_logging
+from volatility import BAR_TERMS, VOL_PERIODS_PER_YEAR, bar_terms, latest, sort_bars
+
+
+# HAR-RV (heterogeneous autoregressive realized variance) forecasts of the
+# next bar's variance of every ticker in market_prices:
+#
+#   rv[t+1] = c + b_d * rv[t] + b_w * mean(rv[t-4..t]) + b_m * mean(rv[t-21..t]) + g' z[t]
+#
+# rv is a per-bar range estimator (HAR_RV_ESTIMATOR), z the optional
+# regressors: daily sentiment per asset from the sentiment index and FRED
+# series as of the bar's date.
+#
+# The coefficients are re-estimated at every bar on the previous HAR_WINDOW
+# (x, y) pairs of the ticker. No window is solved on its own: the running sums
+# of the stacked x x' and x y products give each window's normal equations as
+# one difference, and all tickers and windows are solved in a single batched
+# np.linalg.solve.
+
+# per-bar variance estimators and their row in volatility's term matrix
+RV_ESTIMATORS = {"cc": "r2", "parkinson": "park", "garman_klass": "gk", "rogers_satchell": "rs"}
+HAR_RV_ESTIMATOR = get_env("HAR_RV_ESTIMATOR", default="garman_klass")
+HAR_LAGS = tuple(int(x) for x in get_env("HAR_LAGS", default="1,5,22").split(",") if x.strip())
+# 0 re-estimates on an expanding window
+HAR_WINDOW = int(get_env("HAR_WINDOW", default="1000"))
+HAR_MIN_OBS = int(get_env("HAR_MIN_OBS", default="250"))
+# FRED observations are dated by period, not by release: a value is used from
+# observation_date + HAR_FRED_LAG_DAYS on
+HAR_FRED_LAG_DAYS = int(get_env("HAR_FRED_LAG_DAYS", default="31"))
+
+# relative ridge on the normal equations; keeps windows with a constant regressor solvable
+_RIDGE = 1e-8
+
+
+def realized_variance(bars: pd.DataFrame, estimator: str | None = None) -> pd.DataFrame:
+    # bars (ticker, ts, open, high, low, close) -> ticker, ts, rv in (ticker, ts) order
+    estimator = estimator or HAR_RV_ESTIMATOR
+    if estimator not in RV_ESTIMATORS:
+        raise ValueError(f"Unknown RV estimator '{estimator}'. Valid: {', '.join(RV_ESTIMATORS)}")
+    bars, codes = sort_bars(bars)
+    terms, _ = bar_terms(bars, codes)
+    return pd.DataFrame({"ticker": bars["ticker"], "ts": bars["ts"], "rv": terms[BAR_TERMS.index(RV_ESTIMATORS[estimator])]})
+
+
+def _ticker_start(ticker: pd.Series) -> np.ndarray:
+    # first row of each row's ticker, rows grouped by ticker
+    codes = pd.factorize(ticker)[0]
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    return np.maximum.accumulate(np.where(first, np.arange(len(codes)), 0)) if len(codes) else np.zeros(0, dtype=np.int64)
+
+
+def _rolling_mean(x: np.ndarray, start: np.ndarray, w: int) -> np.ndarray:
+    # trailing w-row mean within each ticker; NaN unless all w values are valid
+    n = len(x)
+    sums = np.zeros(n + 1)
+    np.cumsum(np.nan_to_num(x), out=sums[1:])
+    counts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(~np.isnan(x), out=counts[1:])
+    out = np.full(n, np.nan)
+    if w > n:
+        return out
+    full = (counts[w:] - counts[:n + 1 - w] == w) & (start[w - 1:] <= np.arange(n + 1 - w))
+    out[w - 1:] = np.where(full, (sums[w:] - sums[:n + 1 - w]) / w, np.nan)
+    return out
+
+
+def sentiment_regressors(index_rows: pd.DataFrame) -> pd.DataFrame:
+    # sentiment index rows (asset, bucket, count, mean) at the day grain ->
+    # ticker, date, sentiment (count-weighted mean over sources), sentiment_volume
+    if index_rows is None or index_rows.empty:
+        return pd.DataFrame(columns=["ticker", "date", "sentiment", "sentiment_volume"])
+    day = pd.to_datetime(index_rows["bucket"], utc=True).dt.tz_localize(None).dt.normalize().astype("datetime64[ns]")
+    count = index_rows["count"].to_numpy(dtype=np.float64)
+    g = pd.DataFrame({
+        "ticker": index_rows["asset"].to_numpy(), "date": day.to_numpy(),
+        "n": count, "nx": count * index_rows["mean"].to_numpy(dtype=np.float64),
+    }).groupby(["ticker", "date"], sort=False, as_index=False)[["n", "nx"]].sum()
+    return pd.DataFrame({
+        "ticker": g["ticker"], "date": g["date"],
+        "sentiment": np.divide(g["nx"], g["n"], out=np.zeros(len(g)), where=g["n"] > 0),
+        "sentiment_volume": np.log1p(g["n"]),
+    })
+
+
+def fred_regressors(fred: pd.DataFrame, lag_days: int | None = None) -> pd.DataFrame:
+    # macro_indicators rows (series_id, observation_date, value) -> date and
+    # one fred_<series_id> column, each the latest value usable on that date
+    lag = HAR_FRED_LAG_DAYS if lag_days is None else lag_days
+    if fred is None or fred.empty:
+        return pd.DataFrame(columns=["date"])
+    usable = (pd.to_datetime(fred["observation_date"]) + pd.Timedelta(days=lag)).astype("datetime64[ns]")
+    wide = (
+        pd.DataFrame({"date": usable.to_numpy(), "series": "fred_" + fred["series_id"].astype(str), "value": fred["value"]})
+        .pivot_table(index="date", columns="series", values="value", aggfunc="last")
+        .sort_index()
+        .ffill()
+    )
+    wide.columns.name = None
+    return wide.reset_index()
+
+
+def har_design(rv: pd.DataFrame, sentiment: pd.DataFrame | None = None, fred: pd.DataFrame | None = None,
+               lags=None) -> tuple[pd.DataFrame, list[str]]:
+    # rv (ticker, ts, rv) in (ticker, ts) order -> per row: the regressors at
+    # t, the target rv[t+1] (`y`) and the regressor names
+    lags = tuple(lags or HAR_LAGS)
+    start = _ticker_start(rv["ticker"])
+    x = rv["rv"].to_numpy(dtype=np.float64)
+    design = {"ticker": rv["ticker"].array, "ts": rv["ts"].array}
+    names = []
+    for lag in lags:
+        design[f"rv_{lag}"] = x if lag == 1 else _rolling_mean(x, start, lag)
+        names.append(f"rv_{lag}")
+    y = np.full(len(x), np.nan)
+    same = start[1:] == start[:-1]
+    y[:-1][same] = x[1:][same]
+    design["y"] = y
+    out = pd.DataFrame(design)
+
+    date = pd.to_datetime(rv["ts"], utc=True).dt.tz_localize(None).dt.normalize().astype("datetime64[ns]")
+    if sentiment is not None and not sentiment.empty:
+        cols = ["sentiment", "sentiment_volume"]
+        keys = pd.MultiIndex.from_arrays([rv["ticker"].to_numpy(), date.to_numpy()])
+        # no rows for a ticker and day: no news, neutral
+        joined = sentiment.set_index(["ticker", "date"])[cols].reindex(keys)
+        for c in cols:
+            out[c] = joined[c].fillna(0.0).to_numpy()
+        names += cols
+    if fred is not None and len(fred.columns) > 1:
+        order = np.argsort(date.to_numpy(), kind="stable")
+        asof = pd.merge_asof(pd.DataFrame({"date": date.to_numpy()[order]}), fred.sort_values("date"), on="date")
+        for c in fred.columns.drop("date"):
+            col = np.empty(len(out))
+            col[order] = asof[c].to_numpy(dtype=np.float64)
+            out[c] = col
+            names.append(c)
+    return out, names
+
+
+def fit_har(rv: pd.DataFrame, sentiment: pd.DataFrame | None = None, fred: pd.DataFrame | None = None,
+            window: int | None = None, min_obs: int | None = None, lags=None,
+            periods_per_year: float | None = None) -> pd.DataFrame:
+    # rolling HAR fits; one row per bar with enough history: ticker, ts, rv,
+    # the window size `n`, coefficients `b_<regressor>`, the next bar's
+    # forecast `rv_forecast` and its annualized volatility `vol_forecast`
+    window = HAR_WINDOW if window is None else window
+    min_obs = min_obs or HAR_MIN_OBS
+    scale = periods_per_year if periods_per_year is not None else VOL_PERIODS_PER_YEAR
+    design, names = har_design(rv, sentiment, fred, lags)
+    n, k = len(design), len(names) + 1
+
+    # standardize for conditioning; forecasts are unchanged, coefficients are mapped back below
+    x = design[names].to_numpy(dtype=np.float64)
+    y = design["y"].to_numpy()
+    mu = np.nanmean(x, axis=0) if n else np.zeros(len(names))
+    sd = np.nanstd(x, axis=0) if n else np.ones(len(names))
+    sd[~(sd > 0)] = 1.0
+    s_y = np.nanmean(np.abs(y)) if np.isfinite(y).any() else 1.0
+    s_y = s_y if s_y > 0 else 1.0
+    z = np.empty((n, k + 1))
+    z[:, 0] = 1.0
+    z[:, 1:k] = (x - mu) / sd
+    z[:, k] = y / s_y
+
+    # running sums of z z' over the complete (x, y) pairs
+    pair = np.isfinite(z).all(axis=1)
+    zz = np.where(pair[:, None, None], z[:, :, None] * z[:, None, :], 0.0)
+    sums = np.zeros((n + 1, k + 1, k + 1))
+    np.cumsum(zz, axis=0, out=sums[1:])
+    counts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(pair, out=counts[1:])
+
+    # the forecast at row t uses pairs t - window .. t - 1 of its ticker
+    t = np.arange(n)
+    start = _ticker_start(design["ticker"])
+    lo = start if window <= 0 else np.maximum(t - window, start)
+    obs = counts[t] - counts[lo]
+    ok = (obs >= max(min_obs, k + 1)) & np.isfinite(z[:, :k]).all(axis=1)
+    rows = np.flatnonzero(ok)
+    win = sums[rows] - sums[lo[rows]]
+    xtx = win[:, :k, :k]
+    xtx += _RIDGE * obs[rows, None, None] * np.eye(k)
+    coef = np.linalg.solve(xtx, win[:, :k, k:])[..., 0]
+
+    # back to the original units of x and rv
+    b = coef[:, 1:] * s_y / sd
+    c = coef[:, 0] * s_y - b @ mu
+    out = {"ticker": design["ticker"].array[rows], "ts": design["ts"].array[rows], "rv": rv["rv"].to_numpy()[rows], "n": obs[rows]}
+    out["b_const"] = c
+    for j, name in enumerate(names):
+        out[f"b_{name}"] = b[:, j]
+    forecast = (z[rows, :k] * coef).sum(axis=1) * s_y
+    out["rv_forecast"] = forecast
+    out["vol_forecast"] = np.sqrt(np.maximum(forecast, 0.0) * scale)
+    return pd.DataFrame(out)
+
+
+def _read_parquet(paths) -> pd.DataFrame:
+    files = []
+    for p in paths:
+        files.extend(sorted(glob.glob(p)) or [p])
+    return pa.concat_tables([pq.read_table(f) for f in files], promote_options="default").to_pandas()
+
+
+def main(argv=None):
+    args = argv if argv is not None else sys.argv[1:]
+    if not args:
+        raise SystemExit("Usage: python har.py <market_prices parquet file/glob> [...]")
+    init_logging()
+    rv = realized_variance(_read_parquet(args))
+
+    # HAR_SENTIMENT=0 leaves out the sentiment index; HAR_FRED=<parquet glob>
+    # adds an export of macro_indicators, the table fred_ingest.py writes
+    sentiment = None
+    if get_env("HAR_SENTIMENT", default="1") == "1":
+        from sentiment_index import get_sentiment_index
+        index = get_sentiment_index()
+        if index is not None:
+            sentiment = sentiment_regressors(index.series("day"))
+    fred_path = get_env("HAR_FRED", default="")
+    fred = fred_regressors(_read_parquet([fred_path])) if fred_path else None
+
+    fits = fit_har(rv, sentiment, fred)
+    regressors = [c[2:] for c in fits.columns if c.startswith("b_") and c != "b_const"]
+    print(f"[har] {len(rv)} bars, {rv['ticker'].nunique()} tickers, {len(fits)} rolling fits, "
+          f"window={HAR_WINDOW or 'expanding'}, regressors={', '.join(regressors)}")
+
+    # HAR_OUTPUT=<file.parquet> writes every bar's fit; otherwise the latest per ticker is printed
+    output = get_env("HAR_OUTPUT", default="")
+    if output:
+        pq.write_table(pa.Table.from_pandas(fits, preserve_index=False), output)
+        print(f"[har] wrote {output}")
+        return
+    with pd.option_context("display.width", 200, "display.max_columns", 50):
+        print(latest(fits).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+import os
+import re
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from common import get_env, stable_id
+
+
+# Shared CORE + CTX + proximity relevance filter for the text ingestors.
+# A text is relevant when a CORE term (the commodity: wti, brent, opec, ...)
+# starts within `proximity` characters of a CTX term (the market angle: price,
+# supply, outage, ...).
+#
+# The text is scanned once with a combined CORE|CTX pattern. Hits come out in
+# position order, so the nearest opposite-kind hit is always the last one seen
+# and the proximity test is a single merge pass instead of comparing every
+# core position with every ctx position.
+#
+# Whole columns (assets.AssetRouter.route_frame) first go through candidates():
+# an Arrow kernel drops the rows that cannot match (no CORE or no CTX term
+# anywhere), and only the rest are scanned. backfill.py spreads large inputs
+# over worker processes.
+
+RELEVANCE_CHUNK_ROWS = int(get_env("RELEVANCE_CHUNK_ROWS", default="50000"))
+
+# Large vocabularies (RELEVANCE_TERMS_FILE) use KeywordMatcher instead: an
+# Aho-Corasick automaton over word tokens, so scan time depends on the text
+# length only, not on how many terms are tracked.
+TERM_CACHE_DIR = get_env("TERM_CACHE_DIR", default=os.path.join(tempfile.gettempdir(), "senti_vol_terms"))
+
+
+def terms_pattern(terms) -> str:
+    return "|".join(re.escape(t) for t in terms)
+
+
+class RelevanceMatcher:
+
+    def __init__(self, core: str, ctx: str, proximity: int = 80):
+        self.core_pattern, self.ctx_pattern = core, ctx
+        self.proximity = int(proximity)
+        self.core_re = re.compile(rf"\b(?:{core})\b", re.I)
+        self.ctx_re = re.compile(rf"\b(?:{ctx})\b", re.I)
+        # the scan runs on lowercased text; case-insensitive matching is several
+        # times slower in `re`, so it is only kept for patterns that need it
+        flags = re.I if any(c.isupper() for c in core + ctx) else 0
+        self._scan_re = re.compile(rf"\b(?:(?P<core>{core})|(?P<ctx>{ctx}))\b", flags)
+        # a term can be both (e.g. "refinery"): the scan reports it as CORE, so
+        # CORE hits are re-checked against CTX at the same start
+        self._ctx_at = re.compile(rf"(?:{ctx})\b", flags)
+
+    @classmethod
+    def from_terms(cls, core_terms, ctx_terms, proximity: int = 80) -> "RelevanceMatcher":
+        # lowercase literals keep the scan off the slow re.I path
+        return cls(terms_pattern(t.lower() for t in core_terms), terms_pattern(t.lower() for t in ctx_terms), proximity)
+
+    def hits(self, text: str):
+        # (start, end, is_core, is_ctx) in position order
+        t = text.lower()
+        for m in self._scan_re.finditer(t):
+            if m.lastgroup == "core":
+                yield m.start(), m.end(), True, self._ctx_at.match(t, m.start()) is not None
+            else:
+                yield m.start(), m.end(), False, True
+
+    def find(self, text: str) -> tuple[int, int] | None:
+        # first (core_start, ctx_start) pair within proximity
+        return first_pair(self.hits(text), self.proximity) if text else None
+
+    def is_relevant(self, text: str) -> bool:
+        return self.find(text) is not None
+
+    def has_core(self, text: str) -> bool:
+        return bool(text) and self.core_re.search(text) is not None
+
+    @property
+    def fingerprint(self) -> str:
+        # cache namespace: scores are only reusable under the same vocabulary
+        return stable_id(f"{SCORE_VERSION}\x1f{self.core_pattern}\x1f{self.ctx_pattern}\x1f{self.proximity}")
+
+    def score(self, text: str) -> "RelevanceScore":
+        return score_hits(list(self.hits(text)), self.proximity) if text else RelevanceScore(0.0, 0, 0, ())
+
+    def score_columns(self, texts, cache: "ScoreCache | None" = None) -> dict[str, list]:
+        # one value per text under the table column names; each distinct text
+        # is scored at most once, repeats come from the cache
+        cache = cache if cache is not None else get_score_cache()
+        texts = list(texts)
+        keys = [stable_id(t) if isinstance(t, str) and t else None for t in texts]
+        ns = self.fingerprint
+        known = cache.get_many(ns, {k for k in keys if k is not None})
+
+        fresh = {}
+        for key, text in zip(keys, texts):
+            if key is not None and key not in known and key not in fresh:
+                fresh[key] = score_row(self.score(text))
+        if fresh:
+            cache.put_many(ns, fresh)
+            known.update(fresh)
+
+        return score_frame_columns([known[k] if k is not None else EMPTY_SCORE_ROW for k in keys])
+
+    def candidates(self, arr: pa.Array) -> np.ndarray:
+        # rows holding some CORE and some CTX substring; a superset of the
+        # relevant rows (no word boundaries), so the exact scan only runs here
+        try:
+            both = pc.and_(
+                pc.match_substring_regex(arr, self.core_pattern, ignore_case=True),
+                pc.match_substring_regex(arr, self.ctx_pattern, ignore_case=True),
+            )
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # pattern outside RE2 syntax: scan every non-null row
+            both = pc.is_valid(arr)
+        return np.flatnonzero(pc.fill_null(both, False).to_numpy(zero_copy_only=False))
+
+
+# bump when the score formula changes so cached scores are not reused
+SCORE_VERSION = 1
+SCORE_COLUMNS = ("relevance_score", "relevance_core_hits", "relevance_ctx_hits", "relevance_spans")
+
+
+class RelevanceScore(NamedTuple):
+    score: float     # 0 when not relevant, otherwise in (0, 1)
+    core_hits: int
+    ctx_hits: int
+    spans: tuple     # (start, end) of the CORE/CTX terms in in-range pairs
+
+
+EMPTY_SCORE_ROW = (0.0, 0, 0, "[]")
+
+
+def score_row(r: RelevanceScore) -> tuple:
+    # cache / column representation
+    return r.score, r.core_hits, r.ctx_hits, json.dumps(r.spans, separators=(",", ":"))
+
+
+def score_frame_columns(rows) -> dict[str, list]:
+    return {name: [r[i] for r in rows] for i, name in enumerate(SCORE_COLUMNS)}
+
+
+# Proximity logic over a hit list: (start, end, is_core, is_ctx) by start
+
+def first_pair(hits, proximity: int) -> tuple[int, int] | None:
+    # the nearest opposite-kind hit is always the last one seen
+    last_core = last_ctx = None
+    for pos, _, is_core, is_ctx in hits:
+        if is_core and is_ctx:
+            return pos, pos
+        if is_core:
+            if last_ctx is not None and pos - last_ctx <= proximity:
+                return pos, last_ctx
+            last_core = pos
+        else:
+            if last_core is not None and pos - last_core <= proximity:
+                return last_core, pos
+            last_ctx = pos
+    return None
+
+
+def score_hits(hits: list, proximity: int) -> RelevanceScore:
+    core = [(s, e) for s, e, is_core, _ in hits if is_core]
+    ctx = [(s, e) for s, e, _, is_ctx in hits if is_ctx]
+
+    # nearest CTX hit for every CORE hit; both lists are sorted by start,
+    # so the ctx pointer only ever moves forward
+    near, spans = [], set()
+    j = 0
+    for span in core:
+        while j < len(ctx) and ctx[j][0] < span[0]:
+            j += 1
+        best = None
+        for k in (j - 1, j):
+            if 0 <= k < len(ctx):
+                d = abs(ctx[k][0] - span[0])
+                if d <= proximity and (best is None or d < best[0]):
+                    best = (d, ctx[k])
+        if best is not None:
+            near.append(best[0])
+            spans.update((span, best[1]))
+
+    if not near:
+        return RelevanceScore(0.0, len(core), len(ctx), ())
+    # closer pairs and more of them score higher; any in-range pair is > 0
+    score = (1 - min(near) / (proximity + 1)) * (1 - 0.5 ** len(near))
+    return RelevanceScore(round(score, 4), len(core), len(ctx), tuple(sorted(spans)))
+
+
+def as_string_array(texts) -> pa.Array:
+    # list, pandas or Arrow texts -> one Arrow string array
+    if isinstance(texts, pa.ChunkedArray):
+        texts = texts.combine_chunks()
+    elif not isinstance(texts, pa.Array):
+        # Arrow-backed pandas columns convert without a copy
+        texts = pa.array(texts, from_pandas=True)
+    if pa.types.is_null(texts.type):
+        return texts.cast(pa.string())
+    return texts
+
+
+# Score cache: in-memory LRU in front of a bounded sqlite store, keyed by
+# (matcher fingerprint, stable_id(text)). The table and value columns are
+# parameters so sentiment.py keeps its scores in the same kind of store.
+
+RELEVANCE_CACHE_SIZE = int(get_env("RELEVANCE_CACHE_SIZE", default="100000"))
+RELEVANCE_CACHE_MAX_ROWS = int(get_env("RELEVANCE_CACHE_MAX_ROWS", default="2000000"))
+RELEVANCE_CACHE_COLUMNS = (("score", "REAL"), ("core", "INTEGER"), ("ctx", "INTEGER"), ("spans", "TEXT"))
+# store hits whose use times are buffered before they are written on their own
+_TOUCH_BATCH = 10_000
+
+
+class ScoreCache:
+
+    def __init__(self, path: str | None, max_memory: int = RELEVANCE_CACHE_SIZE,
+                 max_rows: int = RELEVANCE_CACHE_MAX_ROWS, table: str = "relevance_scores",
+                 columns: tuple = RELEVANCE_CACHE_COLUMNS):
+        self.path = path
+        self.table = table
+        self.columns = [name for name, _ in columns]
+        self.max_memory = max_memory
+        self.max_rows = max_rows
+        self.hits = self.misses = 0
+        self._mem: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        # keys read from the store since the last write; their use time is
+        # written with the next put_many instead of a transaction per read
+        self._touched: list = []
+        # rows in the store as of the last count plus this process' inserts since
+        self._rows = 0
+        if path:
+            self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            decl = "".join(f" {name} {kind}," for name, kind in columns)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                f" ns TEXT NOT NULL, k TEXT NOT NULL,{decl}"
+                " used REAL NOT NULL, PRIMARY KEY (ns, k)) WITHOUT ROWID"
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used)")
+            (self._rows,) = self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+
+    def _remember(self, key, value):
+        self._mem[key] = value
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_memory:
+            self._mem.popitem(last=False)
+
+    def get_many(self, ns: str, keys) -> dict:
+        found, todo = {}, []
+        with self._lock:
+            for k in keys:
+                v = self._mem.get((ns, k))
+                if v is None:
+                    todo.append(k)
+                else:
+                    self._mem.move_to_end((ns, k))
+                    found[k] = v
+
+            if todo and self._conn is not None:
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS score_keys (k TEXT PRIMARY KEY) WITHOUT ROWID")
+                self._conn.execute("DELETE FROM score_keys")
+                self._conn.executemany("INSERT OR IGNORE INTO score_keys VALUES (?)", ((k,) for k in todo))
+                rows = self._conn.execute(
+                    f"SELECT s.k, {', '.join('s.' + c for c in self.columns)} FROM {self.table} s"
+                    " JOIN score_keys b ON b.k = s.k WHERE s.ns = ?", (ns,)
+                ).fetchall()
+                self._touched.extend((ns, r[0]) for r in rows)
+                if len(self._touched) >= _TOUCH_BATCH:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        self._touch()
+                        self._conn.execute("COMMIT")
+                    except Exception:
+                        self._conn.execute("ROLLBACK")
+                        raise
+                for k, *value in rows:
+                    found[k] = tuple(value)
+                    self._remember((ns, k), tuple(value))
+
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def _touch(self):
+        # inside a write transaction
+        self._conn.executemany(
+            f"UPDATE {self.table} SET used = ? WHERE ns = ? AND k = ?",
+            ((time.time(), ns, k) for ns, k in self._touched),
+        )
+        self._touched = []
+
+    def put_many(self, ns: str, values: dict):
+        with self._lock:
+            for k, v in values.items():
+                self._remember((ns, k), v)
+            if self._conn is None:
+                return
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (ns, k, {', '.join(self.columns)}, used)"
+                    f" VALUES (?, ?, {', '.join('?' * len(self.columns))}, ?)",
+                    ((ns, k, *v, now) for k, v in values.items()),
+                )
+                self._touch()
+                # replaced keys count as inserts too, so the store is counted
+                # only once the estimate passes max_rows; the least recently
+                # used rows then go, down to 10% below the limit, which leaves
+                # at least max_rows / 10 inserts until the next count
+                self._rows += len(values)
+                if self._rows > self.max_rows:
+                    (n,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+                    low = self.max_rows - self.max_rows // 10
+                    if n > low:
+                        self._conn.execute(
+                            f"DELETE FROM {self.table} WHERE (ns, k) IN"
+                            f" (SELECT ns, k FROM {self.table} ORDER BY used LIMIT ?)", (n - low,)
+                        )
+                    self._rows = min(n, low)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+_score_cache = None
+_score_cache_lock = threading.Lock()
+
+
+def get_score_cache() -> ScoreCache:
+    # RELEVANCE_CACHE_PATH="" keeps the cache in memory only
+    global _score_cache
+    with _score_cache_lock:
+        if _score_cache is None:
+            _score_cache = ScoreCache(get_env("RELEVANCE_CACHE_PATH", default="senti_vol_relevance.db") or None)
+        return _score_cache
+
+
+# Keyword automaton
+
+# words, single punctuation characters and whitespace runs; covers every
+# character, so token offsets are just running sums of token lengths
+_TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+_WORD_RE = re.compile(r"\w+")
+
+CORE, CTX = 1, 2
+
+
+class KeywordAutomaton:
+    # Aho-Corasick over tokens. Terms match whole tokens only, which gives the
+    # same word boundaries as \b...\b around a literal term.
+
+    def __init__(self, terms: dict[str, int]):
+        # terms: lowercased term -> CORE/CTX bit flags
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[tuple[tuple[int, int], ...]] = [()]
+
+        for term, kind in terms.items():
+            state = 0
+            for tok in _TOKEN_RE.findall(term):
+                nxt = self.goto[state].get(tok)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][tok] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] = ((len(term), kind),)
+
+        # breadth-first failure links; outputs are merged along them so a
+        # state reports every term that ends at it
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for tok, nxt in self.goto[state].items():
+                f = self.fail[state]
+                while f and tok not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(tok, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def scan(self, text: str) -> list[tuple[int, int, int]]:
+        # (start, end, kind) for every term occurrence, overlaps included, by start
+        goto, fail, out = self.goto, self.fail, self.out
+        found = []
+        state = pos = 0
+        for tok in _TOKEN_RE.findall(text.lower()):
+            pos += len(tok)
+            while state and tok not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(tok, 0)
+            for length, kind in out[state]:
+                found.append((pos - length, pos, kind))
+        found.sort()
+        return found
+
+
+class KeywordMatcher(RelevanceMatcher):
+    # literal CORE/CTX vocabularies of any size; same find/score/candidates API
+
+    def __init__(self, core_terms, ctx_terms, proximity: int = 80):
+        core_terms = clean_terms(core_terms)
+        ctx_terms = clean_terms(ctx_terms)
+        self.core_pattern, self.ctx_pattern = terms_pattern(core_terms), terms_pattern(ctx_terms)
+        self.proximity = int(proximity)
+        terms = dict.fromkeys(core_terms, CORE)
+        for t in ctx_terms:
+            terms[t] = terms.get(t, 0) | CTX
+        self.automaton = cached_automaton(terms)
+        # first word of every term, for the batch prefilter (RE2 gives up on
+        # alternations this large)
+        firsts = {CORE: first_words(core_terms), CTX: first_words(ctx_terms)}
+        if all(f is not None for f in firsts.values()):
+            self._first_tokens = {kind: pa.array(sorted(f)) for kind, f in firsts.items()}
+        else:
+            self._first_tokens = None
+
+    def hits(self, text: str):
+        for start, end, kind in self.automaton.scan(text):
+            yield start, end, bool(kind & CORE), bool(kind & CTX)
+
+    def has_core(self, text: str) -> bool:
+        return bool(text) and any(kind & CORE for _, _, kind in self.automaton.scan(text))
+
+    def candidates(self, arr: pa.Array) -> np.ndarray:
+        if self._first_tokens is None:
+            return np.flatnonzero(pc.is_valid(arr).to_numpy(zero_copy_only=False))
+        return token_candidates(arr, [self._first_tokens[CORE], self._first_tokens[CTX]])
+
+
+def token_candidates(arr: pa.Array, required: list[pa.Array]) -> np.ndarray:
+    # rows holding at least one word from every `required` set; tokens are
+    # split on anything that is not a Unicode letter/digit/underscore, like \w
+    keep = []
+    for start in range(0, len(arr), RELEVANCE_CHUNK_ROWS):
+        chunk = arr.slice(start, RELEVANCE_CHUNK_ROWS)
+        toks = pc.split_pattern_regex(pc.utf8_lower(chunk), r"[^\pL\pN_]+")
+        flat = pc.list_flatten(toks)
+        parents = pc.list_parent_indices(toks).to_numpy()
+        rows = np.ones(len(chunk), dtype=bool)
+        for words in required:
+            hit = pc.is_in(flat, value_set=words).to_numpy(zero_copy_only=False)
+            found = np.zeros(len(chunk), dtype=bool)
+            found[parents[hit]] = True
+            rows &= found
+        keep.append(start + np.flatnonzero(rows))
+    return np.concatenate(keep) if keep else np.empty(0, dtype=np.int64)
+
+
+def first_words(terms) -> set[str] | None:
+    # None when some term starts with punctuation (no word to prefilter on)
+    firsts = {_TOKEN_RE.match(t).group() for t in terms}
+    return firsts if all(_WORD_RE.fullmatch(f) for f in firsts) else None
+
+
+def clean_terms(terms) -> list[str]:
+    # stripped, lowercased and deduplicated, in their first order
+    return list(dict.fromkeys(t.strip().lower() for t in terms if t and t.strip()))
+
+
+def cached_automaton(terms: dict[str, int]) -> KeywordAutomaton:
+    # compiled once per vocabulary; keyed by its content so edits rebuild it
+    digest = hashlib.sha1(repr(sorted(terms.items())).encode("utf-8")).hexdigest()
+    path = os.path.join(TERM_CACHE_DIR, f"automaton_{digest}.pkl") if TERM_CACHE_DIR else None
+    if path and os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            pass
+
+    automaton = KeywordAutomaton(terms)
+    if path:
+        try:
+            os.makedirs(TERM_CACHE_DIR, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(automaton, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[relevance] Could not cache term automaton in {TERM_CACHE_DIR}: {e}")
+    return automaton
+
+
+def read_terms_sections(path: str) -> dict[tuple[str, str | None], list[str]]:
+    # [core] / [ctx] sections, optionally per asset ([core NG=F]); one term
+    # per line, '#' starts a comment
+    sections: dict[tuple[str, str | None], list[str]] = {}
+    current = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                kind, _, asset = line[1:-1].strip().partition(" ")
+                kind = kind.lower()
+                if kind not in ("core", "ctx"):
+                    raise ValueError(f"Unknown section [{line[1:-1]}] in {path}. Valid: [core], [ctx], [core <asset>], [ctx <asset>]")
+                current = sections.setdefault((kind, asset.strip() or None), [])
+                continue
+            if current is None:
+                raise ValueError(f"Term '{line}' in {path} is outside a [core]/[ctx] section")
+            current.append(line)
+    return sections
+
+
+def read_terms_file(path: str) -> tuple[list[str], list[str]]:
+    sections = read_terms_sections(path)
+    return sections.get(("core", None), []), sections.get(("ctx", None), [])
+
+
+def matcher_from_env(default: RelevanceMatcher) -> RelevanceMatcher:
+    # RELEVANCE_TERMS_FILE and/or comma-separated RELEVANCE_CORE_TERMS /
+    # RELEVANCE_CTX_TERMS switch an ingestor to the keyword automaton;
+    # without them it keeps its built-in patterns
+    path = get_env("RELEVANCE_TERMS_FILE", default="")
+    extra_core = [t for t in get_env("RELEVANCE_CORE_TERMS", default="").split(",") if t.strip()]
+    extra_ctx = [t for t in get_env("RELEVANCE_CTX_TERMS", default="").split(",") if t.strip()]
+    if not (path or extra_core or extra_ctx):
+        return default
+
+    core, ctx = read_terms_file(path) if path else ([], [])
+    matcher = KeywordMatcher(core + extra_core, ctx + extra_ctx, proximity=default.proximity)
+    if not matcher.core_pattern or not matcher.ctx_pattern:
+        raise ValueError("RELEVANCE_TERMS_FILE / RELEVANCE_*_TERMS need at least one core and one ctx term")
+    return matcher
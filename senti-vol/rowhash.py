@@ -0,0 +1,137 @@
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from common import get_env
+
+
+# Row-content hashing for change detection.
+# Targets that carry a `row_hash INT64` column only get MERGE updates when the
+# hash differs, and a local key -> hash index lets upsert_to_bq drop unchanged
+# rows before they are staged at all.
+
+HASH_COLUMN = "row_hash"
+
+# never part of the content hash: they change on every run
+_VOLATILE_COLS = ("ingested_at", HASH_COLUMN)
+
+
+def content_columns(columns, key_fields: list[str]) -> list[str]:
+    return sorted(c for c in columns if c not in key_fields and c not in _VOLATILE_COLS)
+
+
+def _hashable(s: pd.Series) -> pd.Series:
+    # same instant must hash the same whatever resolution pandas picked
+    if isinstance(s.dtype, pd.DatetimeTZDtype):
+        return s.dt.tz_convert("UTC").astype("datetime64[us, UTC]")
+    if pd.api.types.is_datetime64_dtype(s.dtype):
+        return s.astype("datetime64[us]")
+    return s
+
+
+def add_row_hash(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    if not cols:
+        return df.assign(**{HASH_COLUMN: pd.Series(0, index=df.index, dtype="int64")})
+    frame = pd.DataFrame({c: _hashable(df[c]) for c in cols}, index=df.index)
+    hashed = pd.util.hash_pandas_object(frame, index=False).to_numpy(dtype=np.uint64)
+    # BigQuery INT64 is signed
+    return df.assign(**{HASH_COLUMN: hashed.view(np.int64)})
+
+
+def index_table(backend, table: str) -> str:
+    # the same project.dataset.table name exists on every backend; hashes
+    # recorded against one warehouse say nothing about another
+    return f"{backend.identity}|{table}"
+
+
+def key_strings(df: pd.DataFrame, key_fields: list[str]) -> pd.Series:
+    keys = df[key_fields[0]].astype(str)
+    if len(key_fields) > 1:
+        keys = keys.str.cat([df[k].astype(str) for k in key_fields[1:]], sep="\x1f")
+    return keys
+
+
+class HashIndex:
+    # local (table, key) -> row_hash store, updated only after a MERGE succeeds
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS row_hashes ("
+            " tbl TEXT NOT NULL, k TEXT NOT NULL, h INTEGER NOT NULL, PRIMARY KEY (tbl, k))"
+            " WITHOUT ROWID"
+        )
+
+    def drop_unchanged(self, table: str, df: pd.DataFrame, key_fields: list[str]) -> pd.DataFrame:
+        keys = key_strings(df, key_fields)
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_keys (k TEXT PRIMARY KEY) WITHOUT ROWID")
+            self._conn.execute("DELETE FROM batch_keys")
+            self._conn.executemany("INSERT OR IGNORE INTO batch_keys VALUES (?)", ((k,) for k in keys.unique()))
+            known = self._conn.execute(
+                "SELECT r.k, r.h FROM row_hashes r JOIN batch_keys b ON b.k = r.k WHERE r.tbl = ?", (table,)
+            ).fetchall()
+        if not known:
+            return df
+
+        known_keys, known_hashes = zip(*known)
+        pos = pd.Index(known_keys).get_indexer(keys)
+        found = pos >= 0
+        unchanged = np.zeros(len(df), dtype=bool)
+        unchanged[found] = np.asarray(known_hashes, dtype=np.int64)[pos[found]] == df[HASH_COLUMN].to_numpy()[found]
+        return df[~unchanged]
+
+    def record(self, table: str, df: pd.DataFrame, key_fields: list[str]):
+        keys = key_strings(df, key_fields)
+        rows = zip([table] * len(df), keys.tolist(), df[HASH_COLUMN].astype("int64").tolist())
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO row_hashes (tbl, k, h) VALUES (?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self, table: str | None = None):
+        # table: an index_table() key, or a target table (full or bare name) on every backend
+        with self._lock:
+            if table is None:
+                self._conn.execute("DELETE FROM row_hashes")
+            else:
+                self._conn.execute(
+                    "DELETE FROM row_hashes WHERE tbl = ? OR tbl GLOB ? OR tbl GLOB ?",
+                    (table, f"*|{table}", f"*.{table}"),
+                )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_hash_index() -> HashIndex | None:
+    # ROW_HASH_INDEX_PATH="" turns the client-side index off (MERGE still
+    # skips unchanged rows server-side)
+    global _index
+    with _index_lock:
+        if _index is None:
+            path = get_env("ROW_HASH_INDEX_PATH", default="senti_vol_row_hashes.db")
+            if not path:
+                return None
+            _index = HashIndex(path)
+            # after a target was truncated or recreated: ROW_HASH_RESET=1 clears
+            # the whole index, or a comma-separated list of target tables
+            reset = get_env("ROW_HASH_RESET", default="").strip()
+            if reset == "1":
+                _index.clear()
+                print("[rowhash] Cleared the row_hash index")
+            elif reset:
+                for table in (t.strip() for t in reset.split(",")):
+                    if table:
+                        _index.clear(table)
+                        print(f"[rowhash] Cleared the row_hash index → {table}")
+        return _index
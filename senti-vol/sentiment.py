@@ -0,0 +1,333 @@
+import os
+import threading
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from common import get_env, stable_id
+from relevance import ScoreCache, as_string_array
+
+
+# Lexicon sentiment stage for the text ingestors, run on the frame right
+# before upsert_to_bq.
+#
+# A whole text column is tokenized in one pass over its UTF-8 bytes (tokens
+# are \w runs, as in relevance.token_candidates), every token is mapped to
+# its lexicon row with one hash lookup (index_in), and the per-category counts
+# are the product of the sparse document x term matrix with the term x
+# category lexicon matrix. The document x term matrix is never built: its
+# nonzeros are the matched tokens, so the product is one bincount per category.
+
+SENTIMENT_LEXICON_FILE = get_env(
+    "SENTIMENT_LEXICON_FILE",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentiment_lexicon.txt"),
+)
+SENTIMENT_CHUNK_ROWS = int(get_env("SENTIMENT_CHUNK_ROWS", default="50000"))
+
+# negation window in tokens; 0 scores plain word counts (Lexicon)
+SENTIMENT_NEGATION_WINDOW = int(get_env("SENTIMENT_NEGATION_WINDOW", default="3"))
+DEFAULT_INTENSITY = 1.5
+
+# bump when the score formula changes so cached scores are not reused
+SENTIMENT_VERSION = 1
+
+CATEGORIES = ("positive", "negative", "uncertainty", "litigious")
+SECTIONS = CATEGORIES + ("negation", "intensifier")
+SENTIMENT_COLUMNS = (
+    "sentiment_score", "sentiment_positive", "sentiment_negative", "sentiment_uncertainty",
+    "sentiment_litigious", "sentiment_negated", "sentiment_tokens",
+)
+
+
+class Tokens(NamedTuple):
+    n_docs: int
+    doc: np.ndarray    # row of every token
+    words: pa.Array    # lowercased tokens, flattened in row order
+
+
+# word bytes: ASCII [A-Za-z0-9_] like \w, and every byte of a multi-byte
+# UTF-8 sequence (non-ASCII letters), except the punctuation masked below
+_WORD_BYTE = np.zeros(256, dtype=bool)
+_WORD_BYTE[list(b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")] = True
+_WORD_BYTE[0x80:] = True
+
+
+def _utf8_buffers(arr: pa.Array) -> tuple[np.ndarray, np.ndarray]:
+    # (offsets rebased to 0, value bytes) of a large_string array, no copies
+    _, obuf, dbuf = arr.buffers()
+    offs = np.frombuffer(obuf, dtype=np.int64)[arr.offset: arr.offset + len(arr) + 1]
+    lo, hi = int(offs[0]), int(offs[-1])
+    data = np.frombuffer(dbuf, dtype=np.uint8)[lo:hi] if hi > lo else np.zeros(0, dtype=np.uint8)
+    return offs - lo, data
+
+
+def tokenize(arr: pa.Array) -> Tokens:
+    # Word tokens of every row, found on the column's UTF-8 bytes at once:
+    # a token starts at a word byte whose predecessor is not one (or that
+    # starts a row). Regex splitting in Arrow costs ~10x more per row.
+    arr = pc.utf8_lower(arr)
+    if arr.null_count:
+        arr = pc.fill_null(arr, "")
+    if not pa.types.is_large_string(arr.type):
+        arr = arr.cast(pa.large_string())
+    offs, data = _utf8_buffers(arr)
+
+    word = _WORD_BYTE[data]
+    # U+2000-U+206F (unicode dashes, curly quotes, ellipsis, spaces) and NBSP
+    for lead, follow, width in ((0xE2, (0x80, 0x81), 3), (0xC2, (0xA0,), 2)):
+        at = np.flatnonzero(data[:len(data) - width + 1] == lead)
+        at = at[np.isin(data[at + 1], follow)]
+        for k in range(width):
+            word[at + k] = False
+
+    prev = np.zeros_like(word)
+    prev[1:] = word[:-1]
+    prev[offs[:-1][offs[:-1] < len(word)]] = False
+    nxt = np.zeros_like(word)
+    nxt[:-1] = word[1:]
+    nxt[offs[1:][offs[1:] > 0] - 1] = False
+    starts = np.flatnonzero(word & ~prev)
+    ends = np.flatnonzero(word & ~nxt) + 1
+
+    tok_offs = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=tok_offs[1:])
+    chars = pc.filter(pa.array(data), pa.array(word)).buffers()[1]
+    words = pa.Array.from_buffers(pa.large_string(), len(starts), [None, pa.py_buffer(tok_offs), chars])
+    doc = np.searchsorted(offs[1:], starts, side="right")
+    return Tokens(len(arr), doc, words)
+
+
+def read_lexicon(path: str) -> dict[str, list[str]]:
+    # [positive] / [negative] / [uncertainty] / [litigious] sections plus the
+    # [negation] / [intensifier] modifiers, one entry per line, '#' starts a
+    # comment
+    sections: dict[str, list[str]] = {}
+    current = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                name = line[1:-1].strip().lower()
+                if name not in SECTIONS:
+                    raise ValueError(f"Unknown section [{name}] in {path}. Valid: {', '.join(f'[{c}]' for c in SECTIONS)}")
+                current = sections.setdefault(name, [])
+                continue
+            if current is None:
+                raise ValueError(f"Word '{line}' in {path} is outside a category section")
+            current.append(line.lower())
+    return sections
+
+
+def _intensifiers(lines) -> dict[str, float]:
+    # "sharply" or "sharply 1.8"; weights below 1 dampen ("slightly 0.5")
+    out = {}
+    for line in lines:
+        word, _, weight = line.partition(" ")
+        out[word] = float(weight) if weight.strip() else DEFAULT_INTENSITY
+    return out
+
+
+class Lexicon:
+    # Plain word counts; the modifier sections are loaded (their words get
+    # token ids too) but only ContextLexicon uses them.
+
+    def __init__(self, sections: dict[str, list[str]]):
+        self._sections = sorted((name, sorted(words)) for name, words in sections.items())
+        boost = _intensifiers(sections.get("intensifier", ()))
+        negators = set(sections.get("negation", ()))
+        vocab = sorted({w for cat in CATEGORIES for w in sections.get(cat, ())} | negators | set(boost))
+        self.terms = pa.array(vocab, type=pa.large_string())
+        index = {w: i for i, w in enumerate(vocab)}
+
+        # per-token-id tables, with one extra row at the end for id -1 (a word
+        # outside the lexicon) so lookups need no masking
+        self.matrix = np.zeros((len(vocab) + 1, len(CATEGORIES)), dtype=bool)
+        for k, cat in enumerate(CATEGORIES):
+            for w in sections.get(cat, ()):
+                self.matrix[index[w], k] = True
+        self.polarity = self.matrix[:, 0].astype(np.int8) - self.matrix[:, 1].astype(np.int8)
+        self.negator = np.zeros(len(vocab) + 1, dtype=bool)
+        self.negator[[index[w] for w in negators]] = True
+        self.intensity = np.ones(len(vocab) + 1, dtype=np.float64)
+        for w, weight in boost.items():
+            self.intensity[index[w]] = weight
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "Lexicon":
+        return cls(read_lexicon(path), **kwargs)
+
+    @property
+    def fingerprint(self) -> str:
+        # cache namespace: scores are only reusable under the same lexicon
+        return stable_id(f"{SENTIMENT_VERSION}\x1f{type(self).__name__}\x1f{self._sections!r}")
+
+    def term_ids(self, words: pa.Array) -> np.ndarray:
+        # lexicon row of every token, -1 when the word is not in the lexicon
+        return pc.fill_null(pc.index_in(words, value_set=self.terms), -1).to_numpy()
+
+    def counts(self, tokens: Tokens, ids: np.ndarray) -> np.ndarray:
+        # (documents x terms) @ (terms x categories), over the nonzeros only
+        hit = ids >= 0
+        doc, rows = tokens.doc[hit], self.matrix[ids[hit]]
+        out = np.empty((tokens.n_docs, len(CATEGORIES)), dtype=np.int64)
+        for k in range(len(CATEGORIES)):
+            out[:, k] = np.bincount(doc[rows[:, k]], minlength=tokens.n_docs)
+        return out
+
+    def polar_weights(self, tokens: Tokens, ids: np.ndarray, counts: np.ndarray):
+        # (positive weight, negative weight, negated words) per document
+        return counts[:, 0], counts[:, 1], np.zeros(tokens.n_docs, dtype=np.int64)
+
+    def score_columns(self, texts) -> dict[str, np.ndarray]:
+        arr = as_string_array(texts)
+        parts = []
+        for start in range(0, len(arr), SENTIMENT_CHUNK_ROWS):
+            tokens = tokenize(arr.slice(start, SENTIMENT_CHUNK_ROWS))
+            ids = self.term_ids(tokens.words)
+            counts = self.counts(tokens, ids)
+            pos, neg, negated = self.polar_weights(tokens, ids, counts)
+            n_tokens = np.bincount(tokens.doc, minlength=tokens.n_docs)
+            parts.append((counts, pos, neg, negated, n_tokens))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            parts = [(np.zeros((0, len(CATEGORIES)), dtype=np.int64), empty, empty, empty, empty)]
+        counts, pos, neg, negated, n_tokens = (np.concatenate(p) for p in zip(*parts))
+
+        # net tone in [-1, 1]; 0 when the text has no positive/negative words
+        polar = pos + neg
+        score = np.divide(pos - neg, polar, out=np.zeros(len(counts)), where=polar > 0)
+
+        cols = {"sentiment_score": np.round(score, 4)}
+        for k, cat in enumerate(CATEGORIES):
+            cols[f"sentiment_{cat}"] = counts[:, k]
+        cols["sentiment_negated"] = negated.astype(np.int64)
+        cols["sentiment_tokens"] = n_tokens.astype(np.int64)
+        return cols
+
+    def cached_score_columns(self, texts: pd.Series, ids: pd.Series, cache: ScoreCache | None = None) -> dict[str, np.ndarray]:
+        # score_columns() for rows keyed by `ids` (post/article/comment ids):
+        # the cache key is the id plus a hash of the text, so a row is scored
+        # again only when it is new or its text was edited
+        cache = cache if cache is not None else get_sentiment_cache()
+        texts = pd.Series(texts).reset_index(drop=True)
+        hashes = pd.util.hash_array(texts.to_numpy(dtype=object, na_value=""), categorize=False)
+        keys = [f"{i}\x1f{h:016x}" for i, h in zip(pd.Series(ids).astype(str).tolist(), hashes.tolist())]
+        ns = self.fingerprint
+        known = cache.get_many(ns, set(keys))
+
+        todo = {}
+        for pos, k in enumerate(keys):
+            if k not in known:
+                todo.setdefault(k, pos)
+        if todo:
+            cols = self.score_columns(texts.iloc[list(todo.values())])
+            fresh = dict(zip(todo, zip(*(cols[c].tolist() for c in SENTIMENT_COLUMNS))))
+            cache.put_many(ns, fresh)
+            known.update(fresh)
+
+        rows = np.array([known[k] for k in keys], dtype=np.float64).reshape(len(keys), len(SENTIMENT_COLUMNS))
+        return {c: rows[:, i] if i == 0 else rows[:, i].astype(np.int64) for i, c in enumerate(SENTIMENT_COLUMNS)}
+
+
+class ContextLexicon(Lexicon):
+    # Negation and intensity on top of the word counts, for headlines like
+    # "no supply cut" or "sharply lower prices":
+    #  - a polar word with a negator among the `window` tokens before it (same
+    #    row) counts for the opposite polarity
+    #  - its weight is multiplied by the intensity of the tokens right before
+    #    and after it ("sharply lower", "fell sharply")
+    # Everything works on the token-id stream of the chunk: the negator test
+    # is a difference of a running count, the neighbours are shifted indexes,
+    # so no rule touches the text again.
+
+    def __init__(self, sections: dict[str, list[str]], window: int = 3):
+        super().__init__(sections)
+        self.window = int(window)
+
+    @property
+    def fingerprint(self) -> str:
+        return stable_id(f"{super().fingerprint}\x1f{self.window}")
+
+    def polar_weights(self, tokens: Tokens, ids: np.ndarray, counts: np.ndarray):
+        n = tokens.n_docs
+        at = np.flatnonzero(self.polarity[ids])
+        if not len(at):
+            zero = np.zeros(n, dtype=np.float64)
+            return zero, zero, np.zeros(n, dtype=np.int64)
+        doc = tokens.doc[at]
+        sign = self.polarity[ids[at]].astype(np.float64)
+
+        # token range [first, last] of each polar word's row
+        bounds = np.searchsorted(tokens.doc, np.arange(n + 1))
+        first, last = bounds[doc], bounds[doc + 1] - 1
+
+        # negators among tokens [max(at - window, first), at)
+        seen = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(self.negator[ids], out=seen[1:])
+        negated = seen[at] > seen[np.maximum(at - self.window, first)]
+        sign[negated] = -sign[negated]
+
+        before = np.where(at > first, self.intensity[ids[at - 1]], 1.0)
+        after = np.where(at < last, self.intensity[ids[np.minimum(at + 1, len(ids) - 1)]], 1.0)
+        weight = sign * before * after
+
+        pos = np.bincount(doc, weights=np.maximum(weight, 0), minlength=n)
+        neg = np.bincount(doc, weights=np.maximum(-weight, 0), minlength=n)
+        return pos, neg, np.bincount(doc[negated], minlength=n)
+
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+def get_lexicon() -> Lexicon:
+    global _lexicon
+    with _lexicon_lock:
+        if _lexicon is None:
+            if SENTIMENT_NEGATION_WINDOW > 0:
+                _lexicon = ContextLexicon.from_file(SENTIMENT_LEXICON_FILE, window=SENTIMENT_NEGATION_WINDOW)
+            else:
+                _lexicon = Lexicon.from_file(SENTIMENT_LEXICON_FILE)
+        return _lexicon
+
+
+# Sentiment cache: (lexicon fingerprint, id + text hash) -> score columns, in
+# the same LRU + bounded sqlite store as the relevance scores
+
+SENTIMENT_CACHE_SIZE = int(get_env("SENTIMENT_CACHE_SIZE", default="100000"))
+SENTIMENT_CACHE_MAX_ROWS = int(get_env("SENTIMENT_CACHE_MAX_ROWS", default="2000000"))
+SENTIMENT_CACHE_COLUMNS = tuple(
+    (c[len("sentiment_"):], "REAL" if c == "sentiment_score" else "INTEGER") for c in SENTIMENT_COLUMNS
+)
+
+_sentiment_cache = None
+_sentiment_cache_lock = threading.Lock()
+
+
+def get_sentiment_cache() -> ScoreCache:
+    # SENTIMENT_CACHE_PATH="" keeps the cache in memory only
+    global _sentiment_cache
+    with _sentiment_cache_lock:
+        if _sentiment_cache is None:
+            _sentiment_cache = ScoreCache(
+                get_env("SENTIMENT_CACHE_PATH", default="senti_vol_sentiment.db") or None,
+                max_memory=SENTIMENT_CACHE_SIZE, max_rows=SENTIMENT_CACHE_MAX_ROWS,
+                table="sentiment_scores", columns=SENTIMENT_CACHE_COLUMNS,
+            )
+        return _sentiment_cache
+
+
+def add_sentiment(df: pd.DataFrame, texts: pd.Series, key_field: str | None = None) -> pd.DataFrame:
+    # the sentiment stage: scores `texts` (aligned with df's rows) and adds
+    # SENTIMENT_COLUMNS; with a key_field, rows already scored in an earlier
+    # run (same id, same text) come from the sentiment cache
+    if df.empty:
+        return df.assign(**{c: pd.Series(dtype=object) for c in SENTIMENT_COLUMNS})
+    lexicon = get_lexicon()
+    if key_field is None:
+        return df.assign(**lexicon.score_columns(texts))
+    return df.assign(**lexicon.cached_score_columns(texts, key_field + ":" + df[key_field].astype(str)))
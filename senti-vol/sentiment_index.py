@@ -0,0 +1,292 @@
+import sys
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from common import get_env
+
+
+# Rolling sentiment index: hourly and daily aggregates of sentiment_score per
+# (source, asset) - count, mean, dispersion and a volume-weighted mean - kept
+# as persisted Welford accumulators (n, mean, m2, sum_w, sum_wx) in a local
+# sqlite file. Each ingest run merges only its own rows into the touched
+# buckets, so the latest index is a primary-key read, never a scan of the
+# warehouse tables.
+#
+# Sources re-fetch the same posts/articles on every run (and Reddit scores
+# change), so every (source, item, asset) contribution is remembered: a row
+# seen again unchanged is skipped, a changed one is taken out of its old bucket
+# (reverse Welford) and added again with its new values.
+
+# bucket width in seconds; buckets are stored as UTC epoch seconds
+GRAINS = {"hour": 3600, "day": 86400}
+
+_ACC_COLS = ["n", "mean", "m2", "sum_w", "sum_wx"]
+_BUCKET_KEY = ["source", "asset", "grain", "bucket"]
+
+
+def bucket_stats(frame: pd.DataFrame) -> pd.DataFrame:
+    # per-bucket accumulators of x (weights w) for a batch of rows
+    frame = frame.assign(wx=frame["w"] * frame["x"])
+    dev = frame["x"] - frame.groupby(_BUCKET_KEY, sort=False)["x"].transform("mean")
+    g = frame.assign(d2=dev ** 2).groupby(_BUCKET_KEY, sort=False)
+    stats = g.agg(n=("x", "size"), mean=("x", "mean"), m2=("d2", "sum"), sum_w=("w", "sum"), sum_wx=("wx", "sum"))
+    return stats.reset_index()[_BUCKET_KEY + _ACC_COLS]
+
+
+def merge_stats(a: pd.DataFrame, b: pd.DataFrame, sign: int = 1) -> pd.DataFrame:
+    # Chan et al. pairwise combine of accumulators a and b (aligned on the
+    # bucket key, missing side = empty); sign=-1 removes b from a
+    m = a.merge(b, on=_BUCKET_KEY, how="outer" if sign > 0 else "left", suffixes=("_a", "_b"))
+    na, nb = (m[f"n_{s}"].fillna(0).to_numpy(dtype=np.float64) for s in "ab")
+    ma, mb = (m[f"mean_{s}"].fillna(0).to_numpy(dtype=np.float64) for s in "ab")
+    m2a, m2b = (m[f"m2_{s}"].fillna(0).to_numpy(dtype=np.float64) for s in "ab")
+    n = na + sign * nb
+    safe = np.where(n > 0, n, 1)
+    if sign > 0:
+        delta = mb - ma
+        mean = ma + delta * nb / safe
+        m2 = m2a + m2b + delta ** 2 * na * nb / safe
+    else:
+        mean = (na * ma - nb * mb) / safe
+        m2 = m2a - m2b - nb * n / np.where(na > 0, na, 1) * (mb - mean) ** 2
+    empty = n <= 0
+    out = m[_BUCKET_KEY].copy()
+    out["n"] = np.where(empty, 0, n).astype(np.int64)
+    out["mean"] = np.where(empty, 0.0, mean)
+    # reverse updates can leave tiny negative round-off
+    out["m2"] = np.where(empty, 0.0, np.maximum(m2, 0.0))
+    for c in ("sum_w", "sum_wx"):
+        total = m[f"{c}_a"].fillna(0).to_numpy() + sign * m[f"{c}_b"].fillna(0).to_numpy()
+        out[c] = np.where(empty, 0.0, total)
+    return out
+
+
+def index_columns(acc: pd.DataFrame) -> pd.DataFrame:
+    # accumulators -> published index columns
+    n = acc["n"].to_numpy(dtype=np.float64)
+    sum_w = acc["sum_w"].to_numpy(dtype=np.float64)
+    out = acc[_BUCKET_KEY].copy()
+    out["bucket"] = pd.to_datetime(acc["bucket"].astype("int64"), unit="s", utc=True)
+    out["count"] = acc["n"].astype("int64")
+    out["mean"] = acc["mean"].to_numpy()
+    out["std"] = np.sqrt(np.divide(acc["m2"].to_numpy(), n - 1, out=np.zeros(len(acc)), where=n > 1))
+    out["weighted_mean"] = np.divide(acc["sum_wx"].to_numpy(), sum_w, out=np.zeros(len(acc)), where=sum_w > 0)
+    out["weight"] = sum_w
+    return out
+
+
+def _epoch_seconds(ts: pd.Series) -> np.ndarray:
+    # whole seconds since the epoch; -1 for missing timestamps
+    missing = ts.isna().to_numpy()
+    secs = ts.fillna(pd.Timestamp(0, tz="UTC")).astype("datetime64[s, UTC]").astype("int64").to_numpy()
+    return np.where(missing, -1, secs)
+
+
+class SentimentIndex:
+    # local (source, asset, grain, bucket) -> accumulator store plus the
+    # per-item contributions already folded into it
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentiment_acc ("
+            " source TEXT NOT NULL, asset TEXT NOT NULL, grain TEXT NOT NULL, bucket INTEGER NOT NULL,"
+            " n INTEGER NOT NULL, mean REAL NOT NULL, m2 REAL NOT NULL, sum_w REAL NOT NULL, sum_wx REAL NOT NULL,"
+            " PRIMARY KEY (grain, source, asset, bucket)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentiment_items ("
+            " source TEXT NOT NULL, k TEXT NOT NULL, asset TEXT NOT NULL,"
+            " ts INTEGER NOT NULL, x REAL NOT NULL, w REAL NOT NULL,"
+            " PRIMARY KEY (source, k, asset)) WITHOUT ROWID"
+        )
+
+    def _known_items(self, source: str, keys: list[str]) -> pd.DataFrame:
+        self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_keys (k TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._conn.execute("DELETE FROM batch_keys")
+        self._conn.executemany("INSERT OR IGNORE INTO batch_keys VALUES (?)", ((k,) for k in keys))
+        rows = self._conn.execute(
+            # CROSS JOIN keeps the batch as the outer loop: one primary-key
+            # probe per key instead of a scan of every remembered item
+            "SELECT i.k, i.asset, i.ts, i.x, i.w FROM batch_keys b CROSS JOIN sentiment_items i"
+            " WHERE i.source = ? AND i.k = b.k", (source,)
+        ).fetchall()
+        return pd.DataFrame(rows, columns=["k", "asset", "ts", "x", "w"])
+
+    def _accumulators(self, keys: pd.DataFrame) -> pd.DataFrame:
+        self._conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS batch_buckets ("
+            " source TEXT, asset TEXT, grain TEXT, bucket INTEGER, PRIMARY KEY (source, asset, grain, bucket)) WITHOUT ROWID"
+        )
+        self._conn.execute("DELETE FROM batch_buckets")
+        self._conn.executemany("INSERT OR IGNORE INTO batch_buckets VALUES (?, ?, ?, ?)", keys.itertuples(index=False))
+        rows = self._conn.execute(
+            "SELECT a.source, a.asset, a.grain, a.bucket, a.n, a.mean, a.m2, a.sum_w, a.sum_wx"
+            " FROM batch_buckets b CROSS JOIN sentiment_acc a"
+            " WHERE a.grain = b.grain AND a.source = b.source AND a.asset = b.asset AND a.bucket = b.bucket"
+        ).fetchall()
+        return pd.DataFrame(rows, columns=_BUCKET_KEY + _ACC_COLS)
+
+    def update(self, source: str, df: pd.DataFrame, key_field: str, time_field: str,
+               weight_field: str | None = None) -> int:
+        # fold the rows of one ingest run into the index; returns how many
+        # (item, asset) contributions were added or changed
+        if df is None or df.empty:
+            return 0
+        ts = df[time_field]
+        if not isinstance(ts.dtype, pd.DatetimeTZDtype):
+            ts = pd.to_datetime(ts, utc=True, errors="coerce")
+        x = pd.to_numeric(df["sentiment_score"], errors="coerce")
+        if weight_field is not None and weight_field in df.columns:
+            # volume weight: 1 + upvotes/likes, so zero-score rows still count
+            w = 1.0 + pd.to_numeric(df[weight_field], errors="coerce").fillna(0).clip(lower=0)
+        else:
+            w = pd.Series(1.0, index=df.index)
+        asset = df["asset"] if "asset" in df.columns else pd.Series("", index=df.index)
+        batch = pd.DataFrame({
+            "k": df[key_field].astype(str).to_numpy(),
+            "asset": asset.fillna("").astype(str).to_numpy(),
+            "ts": _epoch_seconds(ts),
+            "x": x.to_numpy(dtype=np.float64, na_value=np.nan),
+            "w": w.to_numpy(dtype=np.float64),
+        })
+        batch = batch[batch["ts"] >= 0].dropna(subset=["k", "x"]).drop_duplicates(subset=["k", "asset"], keep="last")
+        if batch.empty:
+            return 0
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                known = self._known_items(source, batch["k"].unique().tolist())
+                if not known.empty:
+                    both = batch.merge(known, on=["k", "asset"], how="left", suffixes=("", "_old"), indicator=True)
+                    same = ((both["_merge"] == "both") & (both["ts"] == both["ts_old"])
+                            & np.isclose(both["x"], both["x_old"]) & np.isclose(both["w"], both["w_old"]))
+                    batch = batch[~same.to_numpy()]
+                    old = both[(both["_merge"] == "both") & ~same][["k", "asset", "ts_old", "x_old", "w_old"]]
+                    old.columns = ["k", "asset", "ts", "x", "w"]
+                else:
+                    old = known
+                if not batch.empty:
+                    add, remove = self._bucket_rows(source, batch), self._bucket_rows(source, old)
+                    keys = pd.concat([add[_BUCKET_KEY], remove[_BUCKET_KEY]]).drop_duplicates()
+                    acc = merge_stats(self._accumulators(keys), bucket_stats(add))
+                    if not remove.empty:
+                        acc = merge_stats(acc, bucket_stats(remove), sign=-1)
+                    self._write(source, acc, batch)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if len(batch):
+            print(f"[sentiment_index] {source}: folded {len(batch)} new/changed rows")
+        return len(batch)
+
+    @staticmethod
+    def _bucket_rows(source: str, items: pd.DataFrame) -> pd.DataFrame:
+        # one row per (item, grain)
+        ts = items["ts"].to_numpy(dtype=np.int64)
+        parts = []
+        for grain, width in GRAINS.items():
+            parts.append(pd.DataFrame({
+                "source": source, "asset": items["asset"].to_numpy(), "grain": grain,
+                "bucket": ts // width * width,
+                "x": items["x"].to_numpy(), "w": items["w"].to_numpy(),
+            }))
+        return pd.concat(parts, ignore_index=True)
+
+    def _write(self, source: str, acc: pd.DataFrame, items: pd.DataFrame):
+        live = acc[acc["n"] > 0]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO sentiment_acc (source, asset, grain, bucket, n, mean, m2, sum_w, sum_wx)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", live.itertuples(index=False)
+        )
+        self._conn.executemany(
+            "DELETE FROM sentiment_acc WHERE source = ? AND asset = ? AND grain = ? AND bucket = ?",
+            acc.loc[acc["n"] <= 0, _BUCKET_KEY].itertuples(index=False),
+        )
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO sentiment_items (source, k, asset, ts, x, w) VALUES (?, ?, ?, ?, ?, ?)",
+            zip([source] * len(items), *(items[c].tolist() for c in ["k", "asset", "ts", "x", "w"])),
+        )
+
+    def series(self, grain: str = "hour", source: str | None = None, asset: str | None = None,
+               start=None, end=None) -> pd.DataFrame:
+        # index rows for a bucket range [start, end), bounds as timestamps
+        sql = "SELECT source, asset, grain, bucket, n, mean, m2, sum_w, sum_wx FROM sentiment_acc WHERE grain = ?"
+        params = [grain]
+        for col, op, val in (("source", "=", source), ("asset", "=", asset), ("bucket", ">=", start), ("bucket", "<", end)):
+            if val is not None:
+                sql += f" AND {col} {op} ?"
+                params.append(int(pd.to_datetime(val, utc=True).timestamp()) if col == "bucket" else val)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY source, asset, bucket", params).fetchall()
+        return index_columns(pd.DataFrame(rows, columns=_BUCKET_KEY + _ACC_COLS))
+
+    def latest(self, grain: str = "hour") -> pd.DataFrame:
+        # newest bucket per (source, asset): a range read of the grain's
+        # accumulator rows, not of any raw table
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT a.source, a.asset, a.grain, a.bucket, a.n, a.mean, a.m2, a.sum_w, a.sum_wx"
+                " FROM (SELECT source, asset, MAX(bucket) AS bucket FROM sentiment_acc WHERE grain = ?"
+                "       GROUP BY source, asset) t"
+                " JOIN sentiment_acc a ON a.source = t.source AND a.asset = t.asset"
+                "  AND a.grain = ? AND a.bucket = t.bucket", (grain, grain)
+            ).fetchall()
+        return index_columns(pd.DataFrame(rows, columns=_BUCKET_KEY + _ACC_COLS))
+
+    def clear(self, source: str | None = None):
+        with self._lock:
+            for table in ("sentiment_acc", "sentiment_items"):
+                if source is None:
+                    self._conn.execute(f"DELETE FROM {table}")
+                else:
+                    self._conn.execute(f"DELETE FROM {table} WHERE source = ?", (source,))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_sentiment_index() -> SentimentIndex | None:
+    # SENTIMENT_INDEX_PATH="" turns the index off
+    global _index
+    with _index_lock:
+        if _index is None:
+            path = get_env("SENTIMENT_INDEX_PATH", default="senti_vol_index.db")
+            if not path:
+                return None
+            _index = SentimentIndex(path)
+        return _index
+
+
+def update_sentiment_index(source: str, df: pd.DataFrame, key_field: str, time_field: str,
+                           weight_field: str | None = None) -> int:
+    # ingestors register this with common.after_commit, so it only sees rows
+    # whose MERGE committed (under batch_commit: after the whole batch)
+    index = get_sentiment_index()
+    if index is None:
+        return 0
+    return index.update(source, df, key_field, time_field, weight_field)
+
+
+def main(argv=None):
+    args = argv if argv is not None else sys.argv[1:]
+    grain = args[0] if args else "hour"
+    if grain not in GRAINS:
+        raise SystemExit(f"Usage: python sentiment_index.py [{'|'.join(GRAINS)}]")
+    index = get_sentiment_index()
+    if index is None:
+        raise SystemExit("SENTIMENT_INDEX_PATH is empty, no index to read")
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(index.latest(grain).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import sys
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+from common import get_env, init_logging
+from volatility import (
+    BAR_TERMS, ESTIMATORS, GROUP_HEADS, PRICE_COLUMNS, TERM_GROUP, VOL_PERIODS_PER_YEAR, VOL_WINDOWS,
+    add_vol_columns, bar_terms, log_prices, log_terms, prefix_sums, rolling_sums, sort_bars, ts_ns, window_variances,
+)
+
+
+# Incremental rolling-window state for the realized-volatility features.
+#
+# Per ticker the store keeps a ring buffer of the last 2 * max(windows) + 1
+# bars and, per window, the running sums of every estimator term plus the
+# running count of valid bars. A new bar adds its terms and subtracts those of
+# the bar leaving each window: O(1) per bar and window, vectorized over
+# tickers. Re-fetched bars that did not change are skipped; a corrected or
+# late bar inside the ring rewinds only that ticker: its ring is re-scored
+# from the corrected bar on and the window sums are rebuilt from the ring.
+#
+# Corrections to the last max(windows) bars are exact. An older bar still in
+# the ring only reports the windows the ring can cover; bars older than the
+# ring no longer affect any current window and are ignored (recompute that
+# history with volatility.realized_vol).
+
+_EMPTY_TS = np.iinfo(np.int64).min
+
+
+class _Books:
+    # in-memory state of the tickers touched by one update
+    def __init__(self, tickers: list[str], depth: int, n_windows: int):
+        t = len(tickers)
+        self.tickers = tickers
+        self.n = np.zeros(t, dtype=np.int64)                       # bars ever appended
+        self.ts = np.full((t, depth), _EMPTY_TS, dtype=np.int64)   # ring, slot = bar % depth
+        self.px = np.full((t, depth, len(PRICE_COLUMNS)), np.nan)
+        self.sums = np.zeros((t, n_windows, len(BAR_TERMS)))
+        self.counts = np.zeros((t, n_windows, len(GROUP_HEADS)), dtype=np.int64)
+
+    def ring(self, rows: np.ndarray) -> pd.DataFrame:
+        # ring bars of `rows` in time order: ticker, ts, prices, _t (row)
+        depth = self.ts.shape[1]
+        n = self.n[rows]
+        bar = np.arange(depth)[None, :] + np.maximum(n - depth, 0)[:, None]
+        keep = bar < n[:, None]
+        r = np.broadcast_to(rows[:, None], bar.shape)[keep]
+        slot = bar[keep] % depth
+        px = self.px[r, slot]
+        frame = pd.DataFrame({"_t": r, "_ts": self.ts[r, slot]})
+        for k, col in enumerate(PRICE_COLUMNS):
+            frame[col] = px[:, k]
+        return frame
+
+
+class VolState:
+    # local ticker -> ring buffer + window sums store
+
+    def __init__(self, path: str, windows=None, periods_per_year: float | None = None):
+        self.path = path
+        self.windows = tuple(sorted(windows or VOL_WINDOWS))
+        self.depth = 2 * max(self.windows) + 1
+        self.scale = periods_per_year if periods_per_year is not None else VOL_PERIODS_PER_YEAR
+        self._key = ",".join(str(w) for w in self.windows)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vol_state ("
+            " ticker TEXT PRIMARY KEY, windows TEXT NOT NULL, n INTEGER NOT NULL,"
+            " ts BLOB NOT NULL, px BLOB NOT NULL, sums BLOB NOT NULL, counts BLOB NOT NULL) WITHOUT ROWID"
+        )
+
+    def _load(self, tickers: list[str] | None) -> _Books:
+        if tickers is None:
+            rows = self._conn.execute("SELECT * FROM vol_state ORDER BY ticker").fetchall()
+            tickers = [r[0] for r in rows]
+        else:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_keys (k TEXT PRIMARY KEY) WITHOUT ROWID")
+            self._conn.execute("DELETE FROM batch_keys")
+            self._conn.executemany("INSERT OR IGNORE INTO batch_keys VALUES (?)", ((t,) for t in tickers))
+            rows = self._conn.execute(
+                "SELECT s.* FROM batch_keys b CROSS JOIN vol_state s WHERE s.ticker = b.k"
+            ).fetchall()
+        books = _Books(tickers, self.depth, len(self.windows))
+        pos = {t: i for i, t in enumerate(tickers)}
+        stale = 0
+        for ticker, key, n, ts, px, sums, counts in rows:
+            if key != self._key:
+                # windows changed: this ticker starts over
+                stale += 1
+                continue
+            i = pos[ticker]
+            books.n[i] = n
+            books.ts[i] = np.frombuffer(ts, dtype=np.int64)
+            books.px[i] = np.frombuffer(px, dtype=np.float64).reshape(books.px.shape[1:])
+            books.sums[i] = np.frombuffer(sums, dtype=np.float64).reshape(books.sums.shape[1:])
+            books.counts[i] = np.frombuffer(counts, dtype=np.int64).reshape(books.counts.shape[1:])
+        if stale:
+            print(f"[vol_state] {stale} ticker(s) stored with other windows, starting them over")
+        return books
+
+    def _save(self, books: _Books, rows: np.ndarray):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO vol_state (ticker, windows, n, ts, px, sums, counts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((books.tickers[i], self._key, int(books.n[i]), books.ts[i].tobytes(), books.px[i].tobytes(),
+              books.sums[i].tobytes(), books.counts[i].tobytes()) for i in rows),
+        )
+
+    def _features(self, tickers, ts, sums: np.ndarray, counts: np.ndarray) -> dict:
+        # feature columns from window sums (m x W x k) and valid counts (m x W x groups)
+        out = {"ticker": tickers, "ts": pd.to_datetime(ts, utc=True)}
+        for wi, w in enumerate(self.windows):
+            full = counts[:, wi, TERM_GROUP].T == w
+            add_vol_columns(out, window_variances(np.where(full, sums[:, wi].T, np.nan), w), w, ESTIMATORS, self.scale)
+        return out
+
+    def update(self, bars: pd.DataFrame) -> pd.DataFrame:
+        # fold new, late or corrected bars (ticker, ts, open, high, low, close)
+        # into the state; returns the features of every bar whose windows changed
+        if bars is None or bars.empty:
+            return pd.DataFrame()
+        bars = bars.loc[bars["ticker"].notna() & bars["ts"].notna(), ["ticker", "ts", *PRICE_COLUMNS]]
+        if bars.empty:
+            return pd.DataFrame()
+        bars, _ = sort_bars(bars)
+        bars = bars.assign(_ts=ts_ns(bars["ts"])).drop_duplicates(["ticker", "_ts"], keep="last")
+        tickers = bars["ticker"].drop_duplicates().tolist()
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                books = self._load(tickers)
+                bars = bars.assign(_t=pd.Index(tickers).get_indexer(bars["ticker"]))
+                bars = self._drop_unchanged(books, bars)
+                if bars.empty:
+                    self._conn.execute("COMMIT")
+                    return pd.DataFrame()
+
+                t = bars["_t"].to_numpy()
+                last = np.where(books.n > 0, books.ts[np.arange(len(tickers)), (books.n - 1) % self.depth], _EMPTY_TS)
+                late = np.zeros(len(tickers), dtype=bool)
+                late[t[bars["_ts"].to_numpy() <= last[t]]] = True
+                fresh = np.bincount(t, minlength=len(tickers))
+                # new tickers, corrections and long gaps are re-scored in one vectorized pass
+                rebuild = (books.n == 0) | late | (fresh > max(self.windows))
+                parts = [
+                    self._append(books, bars[~rebuild[t]]),
+                    self._rebuild(books, bars[rebuild[t]], np.flatnonzero(rebuild & (fresh > 0))),
+                ]
+                touched = np.unique(t)
+                self._save(books, touched)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        n_late = int(late.sum())
+        print(f"[vol_state] {len(bars)} bars over {len(touched)} tickers"
+              + (f" ({n_late} rewound for late/corrected bars)" if n_late else ""))
+        parts = [p for p in parts if not p.empty]
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+    def _drop_unchanged(self, books: _Books, bars: pd.DataFrame) -> pd.DataFrame:
+        # sources re-send their recent history every run; bars equal to the
+        # ring are no-ops. The re-sent bars are normally the ring's own tail,
+        # so the k-th last old bar of a ticker is compared with its k-th last
+        # ring slot; anything that does not line up is treated as changed.
+        t = bars["_t"].to_numpy()
+        ts = bars["_ts"].to_numpy()
+        n = books.n[t]
+        last = np.where(n > 0, books.ts[t, (n - 1) % self.depth], _EMPTY_TS)
+        old = ts <= last
+        if not old.any():
+            return bars
+        back = bars[old].groupby("_t", sort=False).cumcount(ascending=False).to_numpy()
+        bar = n[old] - 1 - back
+        slot = bar % self.depth
+        same = (bar >= np.maximum(n[old] - self.depth, 0)) & (books.ts[t[old], slot] == ts[old])
+        new_px = bars.loc[old, list(PRICE_COLUMNS)].to_numpy(dtype=np.float64, na_value=np.nan)
+        ring_px = books.px[t[old], slot]
+        same &= ((new_px == ring_px) | (np.isnan(new_px) & np.isnan(ring_px))).all(axis=1)
+        keep = np.ones(len(bars), dtype=bool)
+        keep[np.flatnonzero(old)[same]] = False
+        return bars[keep]
+
+    def _append(self, books: _Books, bars: pd.DataFrame) -> pd.DataFrame:
+        # bars newer than each ticker's last bar, in time order
+        if bars.empty:
+            return pd.DataFrame()
+        depth = self.depth
+        t = bars["_t"].to_numpy()
+        step = bars.groupby("_t", sort=False).cumcount().to_numpy()
+        ts = bars["_ts"].to_numpy()
+        px = bars[list(PRICE_COLUMNS)].to_numpy(dtype=np.float64, na_value=np.nan)
+        parts = []
+        for s in range(step.max() + 1):
+            # the s-th new bar of every ticker that has one
+            at = step == s
+            i, n = t[at], books.n[t[at]]
+            prev_lc = log_prices(*books.px[i, (n - 1) % depth].T)[3]
+            add = log_terms(*log_prices(*px[at].T), np.where(n > 0, prev_lc, np.nan))
+            books.ts[i, n % depth] = ts[at]
+            books.px[i, n % depth] = px[at]
+            add_sum, add_cnt = np.nan_to_num(add).T, ~np.isnan(add[GROUP_HEADS]).T
+            for wi, w in enumerate(self.windows):
+                books.sums[i, wi] += add_sum
+                books.counts[i, wi] += add_cnt
+                # the bar leaving the window (its own previous close is still in the ring)
+                gone = n - w
+                has = gone >= 0
+                if has.any():
+                    j, g = i[has], gone[has]
+                    gone_prev = np.where(g > 0, log_prices(*books.px[j, (g - 1) % depth].T)[3], np.nan)
+                    drop = log_terms(*log_prices(*books.px[j, g % depth].T), gone_prev)
+                    books.sums[j, wi] -= np.nan_to_num(drop).T
+                    books.counts[j, wi] -= ~np.isnan(drop[GROUP_HEADS]).T
+            books.n[i] = n + 1
+            parts.append(pd.DataFrame(self._features(
+                np.asarray(books.tickers, dtype=object)[i], ts[at], books.sums[i], books.counts[i]
+            )))
+        return pd.concat(parts, ignore_index=True).sort_values(["ticker", "ts"], kind="stable").reset_index(drop=True)
+
+    def _rebuild(self, books: _Books, bars: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+        # re-score ring + new bars of `rows` with the batch engine, then keep
+        # the last `depth` bars and their window sums as the new state
+        if not len(rows):
+            return pd.DataFrame()
+        depth = self.depth
+        ring = books.ring(rows)
+        # a full ring has lost the bars before its oldest one
+        full = books.n[rows] >= depth
+        oldest = pd.Series(np.where(full, books.ts[rows, books.n[rows] % depth], _EMPTY_TS), index=rows)
+        too_old = bars["_ts"].to_numpy() < oldest.reindex(bars["_t"]).to_numpy()
+        if too_old.any():
+            print(f"[vol_state] ignored {int(too_old.sum())} bars older than the state window")
+            bars = bars[~too_old]
+        since = bars.groupby("_t")["_ts"].min()
+
+        merged = pd.concat([ring, bars[["_t", "_ts", *PRICE_COLUMNS]]], ignore_index=True)
+        merged = merged.drop_duplicates(["_t", "_ts"], keep="last")
+        order = np.lexsort((merged["_ts"].to_numpy(), merged["_t"].to_numpy()))
+        merged = merged.take(order).reset_index(drop=True)
+        codes = merged["_t"].to_numpy()
+        terms, first = bar_terms(merged, codes)
+        prefix = prefix_sums(terms, first)
+
+        # new state: last `depth` bars per ticker and the sums over each window's tail
+        size = np.bincount(codes, minlength=len(books.tickers))
+        end = np.cumsum(size)[rows]
+        start = end - size[rows]
+        keep = np.minimum(size[rows], depth)
+        books.n[rows] = keep
+        books.ts[rows] = _EMPTY_TS
+        books.px[rows] = np.nan
+        r, slot = np.meshgrid(rows, np.arange(depth), indexing="ij")
+        valid = slot < keep[:, None]
+        src = ((end - keep)[:, None] + slot)[valid]
+        books.ts[r[valid], slot[valid]] = merged["_ts"].to_numpy()[src]
+        books.px[r[valid], slot[valid]] = merged[list(PRICE_COLUMNS)].to_numpy()[src]
+        for wi, w in enumerate(self.windows):
+            lo = np.maximum(end - w, start)
+            books.sums[rows, wi] = (prefix.sums[:, end] - prefix.sums[:, lo]).T
+            books.counts[rows, wi] = (prefix.counts[:, end] - prefix.counts[:, lo]).T
+
+        # features of every bar from each ticker's first new/corrected bar on
+        out = {"ticker": np.asarray(books.tickers, dtype=object)[codes], "ts": pd.to_datetime(merged["_ts"], utc=True)}
+        for w in self.windows:
+            add_vol_columns(out, window_variances(rolling_sums(prefix, w), w), w, ESTIMATORS, self.scale)
+        changed = merged["_ts"].to_numpy() >= since.reindex(codes).to_numpy()
+        return pd.DataFrame(out)[changed].reset_index(drop=True)
+
+    def latest(self) -> pd.DataFrame:
+        # features at every stored ticker's last bar, from the state alone
+        with self._lock:
+            books = self._load(None)
+        rows = np.flatnonzero(books.n > 0)
+        ts = books.ts[rows, (books.n[rows] - 1) % self.depth]
+        return pd.DataFrame(self._features(np.asarray(books.tickers, dtype=object)[rows], ts,
+                                           books.sums[rows], books.counts[rows]))
+
+    def clear(self, ticker: str | None = None):
+        with self._lock:
+            if ticker is None:
+                self._conn.execute("DELETE FROM vol_state")
+            else:
+                self._conn.execute("DELETE FROM vol_state WHERE ticker = ?", (ticker,))
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_vol_state() -> VolState | None:
+    # VOL_STATE_PATH="" turns the incremental state off
+    global _state
+    with _state_lock:
+        if _state is None:
+            path = get_env("VOL_STATE_PATH", default="senti_vol_vol_state.db")
+            if not path:
+                return None
+            _state = VolState(path)
+        return _state
+
+
+def update_vol_state(bars: pd.DataFrame) -> pd.DataFrame:
+    # market_ingest registers this with common.after_commit, so the buffers only
+    # advance on bars whose MERGE committed (under batch_commit: after the whole batch)
+    state = get_vol_state()
+    if state is None:
+        return pd.DataFrame()
+    return state.update(bars)
+
+
+def main(argv=None):
+    args = argv if argv is not None else sys.argv[1:]
+    if args:
+        raise SystemExit("Usage: python vol_state.py")
+    init_logging()
+    state = get_vol_state()
+    if state is None:
+        raise SystemExit("VOL_STATE_PATH is empty, no state to read")
+    with pd.option_context("display.width", 200, "display.max_columns", 50):
+        print(state.latest().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
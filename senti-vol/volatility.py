@@ -0,0 +1,203 @@
+from dotenv import load_dotenv
+load_dotenv()
+
+import sys
+import glob
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import get_env, init_logging
+
+
+# Realized-volatility features over market_prices bars (ticker, ts, open, high,
+# low, close): close-to-close, Parkinson, Garman-Klass, Rogers-Satchell and
+# Yang-Zhang estimators over trailing windows of VOL_WINDOWS bars.
+#
+# All tickers are computed at once: the frame is sorted by (ticker, ts), the
+# per-bar log terms of every estimator form one matrix, and each window is a
+# difference of its cumulative sums - O(rows) per window, no per-ticker loop.
+# A window is reported only when it holds `w` valid bars of one ticker.
+
+ESTIMATORS = ("cc", "parkinson", "garman_klass", "rogers_satchell", "yang_zhang")
+VOL_WINDOWS = tuple(int(w) for w in get_env("VOL_WINDOWS", default="20,60,120").split(",") if w.strip())
+# annualization factor (bars per year); 1 keeps per-bar volatility
+VOL_PERIODS_PER_YEAR = float(get_env("VOL_PERIODS_PER_YEAR", default="252"))
+
+_LN2 = np.log(2.0)
+
+PRICE_COLUMNS = ("open", "high", "low", "close")
+
+# per-bar terms, one row each in the rolling matrix
+BAR_TERMS = ("r", "r2", "park", "gk", "rs", "o", "o2", "c", "c2")
+# terms that are valid on the same bars share one running count: the group of
+# each term, and the first term of each group
+TERM_GROUP = np.array([0, 0, 1, 1, 1, 2, 2, 2, 2])
+GROUP_HEADS = [0, 2, 5]
+
+
+def ts_ns(ts: pd.Series) -> np.ndarray:
+    # UTC nanoseconds since the epoch
+    if not isinstance(ts.dtype, pd.DatetimeTZDtype):
+        ts = pd.to_datetime(ts, utc=True)
+    if ts.dtype.unit != "ns":
+        ts = ts.astype("datetime64[ns, UTC]")
+    # tz-aware values are stored as UTC whatever the zone
+    return ts.array.asi8
+
+
+def sort_bars(df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray]:
+    # bars in (ticker, ts) order plus their ticker codes; exports usually
+    # arrive sorted already and are then not copied
+    codes = pd.factorize(df["ticker"], sort=True)[0]
+    ts = ts_ns(df["ts"])
+    dc, dt = np.diff(codes), np.diff(ts)
+    if np.all((dc > 0) | ((dc == 0) & (dt >= 0))):
+        return df.reset_index(drop=True), codes
+    order = np.lexsort((ts, codes))
+    return df.take(order).reset_index(drop=True), codes[order]
+
+
+def log_prices(o, h, l, c) -> tuple[np.ndarray, ...]:
+    # log open/high/low/close; a bar with a missing or non-positive price is all NaN
+    o, h, l, c = (np.asarray(x, dtype=np.float64) for x in (o, h, l, c))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ok = (o > 0) & (h > 0) & (l > 0) & (c > 0) & (h >= l)
+        return tuple(np.log(np.where(ok, x, np.nan)) for x in (o, h, l, c))
+
+
+def log_terms(lo, lh, ll, lc, prev_lc) -> np.ndarray:
+    # len(BAR_TERMS) x n per-bar terms; prev_lc is the previous bar's log close
+    terms = np.empty((len(BAR_TERMS), len(lo)))
+    r, r2, park, gk, rs, on, on2, oc, oc2 = terms
+    hl2 = (lh - ll) ** 2
+    np.subtract(lc, lo, out=oc)                                    # open-to-close (Yang-Zhang)
+    np.subtract(lc, prev_lc, out=r)                                # close-to-close return
+    np.subtract(lo, prev_lc, out=on)                               # overnight (Yang-Zhang)
+    np.multiply(hl2, 1.0 / (4.0 * _LN2), out=park)                 # Parkinson
+    np.subtract(0.5 * hl2, (2.0 * _LN2 - 1.0) * oc ** 2, out=gk)   # Garman-Klass
+    rs[:] = (lh - lc) * (lh - lo) + (ll - lc) * (ll - lo)          # Rogers-Satchell
+    # Yang-Zhang needs the overnight gap: a bar without one does not count
+    oc[np.isnan(on)] = np.nan
+    np.square(r, out=r2)
+    np.square(on, out=on2)
+    np.square(oc, out=oc2)
+    return terms
+
+
+def bar_terms(df: pd.DataFrame, codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # df sorted by (ticker, ts) -> (len(BAR_TERMS) x n matrix, first row of each ticker)
+    n = len(df)
+    first = np.ones(n, dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+
+    lo, lh, ll, lc = log_prices(*(df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in PRICE_COLUMNS))
+    prev_lc = np.empty(n)
+    prev_lc[:1] = np.nan
+    prev_lc[1:] = lc[:-1]
+    prev_lc[first] = np.nan
+    return log_terms(lo, lh, ll, lc, prev_lc), first
+
+
+class PrefixSums(NamedTuple):
+    sums: np.ndarray    # k x (n + 1) running sums of the valid terms
+    counts: np.ndarray  # validity groups x (n + 1) running counts of valid bars
+    start: np.ndarray   # first row of each row's ticker
+
+
+def prefix_sums(terms: np.ndarray, first: np.ndarray) -> PrefixSums:
+    k, n = terms.shape
+    sums = np.zeros((k, n + 1))
+    np.cumsum(np.nan_to_num(terms), axis=1, out=sums[:, 1:])
+    counts = np.zeros((len(GROUP_HEADS), n + 1), dtype=np.int32)
+    np.cumsum(~np.isnan(terms[GROUP_HEADS]), axis=1, out=counts[:, 1:])
+    start = np.maximum.accumulate(np.where(first, np.arange(n), 0)) if n else np.zeros(0, dtype=np.int64)
+    return PrefixSums(sums, counts, start)
+
+
+def rolling_sums(prefix: PrefixSums, w: int) -> np.ndarray:
+    # trailing w-bar sums per term within each ticker; NaN unless all w bars
+    # are valid and belong to the row's ticker
+    k, n = prefix.sums.shape[0], len(prefix.start)
+    out = np.full((k, n), np.nan)
+    if w > n:
+        return out
+    sums, counts = prefix.sums, prefix.counts
+    window = out[:, w - 1:]
+    np.subtract(sums[:, w:], sums[:, :n + 1 - w], out=window)
+    same_ticker = prefix.start[w - 1:] <= np.arange(n + 1 - w)
+    partial = (counts[:, w:] - counts[:, :n + 1 - w] != w) | ~same_ticker
+    window[partial[TERM_GROUP]] = np.nan
+    return out
+
+
+def window_variances(sums: np.ndarray, w: int) -> dict[str, np.ndarray]:
+    # per-bar variance of each estimator from the window sums of BAR_TERMS
+    s = dict(zip(BAR_TERMS, sums))
+    sample_var = lambda x, x2: (x2 - x * x / w) / (w - 1) if w > 1 else np.full(len(x), np.nan)
+    rs = s["rs"] / w
+    k = 0.34 / (1.34 + (w + 1) / (w - 1)) if w > 1 else 0.0
+    return {
+        "cc": sample_var(s["r"], s["r2"]),
+        "parkinson": s["park"] / w,
+        "garman_klass": s["gk"] / w,
+        "rogers_satchell": rs,
+        "yang_zhang": sample_var(s["o"], s["o2"]) + k * sample_var(s["c"], s["c2"]) + (1.0 - k) * rs,
+    }
+
+
+def add_vol_columns(out: dict, variances: dict, w: int, estimators, scale: float):
+    for est in estimators:
+        # Garman-Klass can come out marginally negative on flat windows
+        out[f"{est}_{w}"] = np.sqrt(np.maximum(variances[est], 0.0) * scale)
+
+
+def realized_vol(df: pd.DataFrame, windows=None, estimators=None, periods_per_year: float | None = None) -> pd.DataFrame:
+    # one row per input bar: ticker, ts and `<estimator>_<window>` columns
+    # (annualized volatility, NaN until the window is full)
+    windows = tuple(windows or VOL_WINDOWS)
+    estimators = tuple(estimators or ESTIMATORS)
+    unknown = [e for e in estimators if e not in ESTIMATORS]
+    if unknown:
+        raise ValueError(f"Unknown estimators {unknown}. Valid: {', '.join(ESTIMATORS)}")
+    scale = periods_per_year if periods_per_year is not None else VOL_PERIODS_PER_YEAR
+
+    bars, codes = sort_bars(df)
+    prefix = prefix_sums(*bar_terms(bars, codes))
+    out = {"ticker": bars["ticker"], "ts": bars["ts"]}
+    for w in windows:
+        add_vol_columns(out, window_variances(rolling_sums(prefix, w), w), w, estimators, scale)
+    return pd.DataFrame(out)
+
+
+def latest(features: pd.DataFrame) -> pd.DataFrame:
+    # last bar per ticker
+    return features.groupby("ticker", sort=True).tail(1).reset_index(drop=True)
+
+
+def main(argv=None):
+    args = argv if argv is not None else sys.argv[1:]
+    if not args:
+        raise SystemExit("Usage: python volatility.py <market_prices parquet file/glob> [...]")
+    init_logging()
+    files = []
+    for p in args:
+        files.extend(sorted(glob.glob(p)) or [p])
+    bars = pa.concat_tables([pq.read_table(f) for f in files], promote_options="default").to_pandas()
+    features = realized_vol(bars)
+    print(f"[volatility] {len(bars)} bars, {bars['ticker'].nunique()} tickers, windows={VOL_WINDOWS}")
+
+    # VOL_OUTPUT=<file.parquet> writes every bar's features; otherwise the latest per ticker is printed
+    output = get_env("VOL_OUTPUT", default="")
+    if output:
+        pq.write_table(pa.Table.from_pandas(features, preserve_index=False), output)
+        print(f"[volatility] wrote {output}")
+        return
+    with pd.option_context("display.width", 200, "display.max_columns", 50):
+        print(latest(features).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+import sqlite3
+import threading
+import uuid
+import numpy as np
+import io
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timezone
+from google.cloud import bigquery
+
+from common import get_env, bq_client, invalidate_schema_cache
+
+
+# Warehouse backends behind upsert_to_bq.
+# WAREHOUSE_BACKEND=bigquery (default) talks to BigQuery; WAREHOUSE_BACKEND=sqlite
+# runs the same stage -> ROW_NUMBER dedup -> MERGE flow against a local file
+# (LOCAL_WAREHOUSE_PATH) so the pipeline can be run and benchmarked offline.
+
+# Mirror of the BigQuery table DDL; the local backend creates its tables from it.
+TABLE_SCHEMAS = {
+    "news_articles": [
+        bigquery.SchemaField("source", "STRING"),
+        bigquery.SchemaField("article_id", "STRING"),
+        bigquery.SchemaField("asset", "STRING"),
+        bigquery.SchemaField("published_at", "TIMESTAMP"),
+        bigquery.SchemaField("title", "STRING"),
+        bigquery.SchemaField("description", "STRING"),
+        bigquery.SchemaField("url", "STRING"),
+        bigquery.SchemaField("author", "STRING"),
+        bigquery.SchemaField("relevance_score", "FLOAT64"),
+        bigquery.SchemaField("relevance_core_hits", "INT64"),
+        bigquery.SchemaField("relevance_ctx_hits", "INT64"),
+        bigquery.SchemaField("relevance_spans", "STRING"),
+        bigquery.SchemaField("sentiment_score", "FLOAT64"),
+        bigquery.SchemaField("sentiment_positive", "INT64"),
+        bigquery.SchemaField("sentiment_negative", "INT64"),
+        bigquery.SchemaField("sentiment_uncertainty", "INT64"),
+        bigquery.SchemaField("sentiment_litigious", "INT64"),
+        bigquery.SchemaField("sentiment_negated", "INT64"),
+        bigquery.SchemaField("sentiment_tokens", "INT64"),
+        bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+        bigquery.SchemaField("row_hash", "INT64"),
+    ],
+    "reddit_posts": [
+        bigquery.SchemaField("source", "STRING"),
+        bigquery.SchemaField("post_id", "STRING"),
+        bigquery.SchemaField("asset", "STRING"),
+        bigquery.SchemaField("created_at", "TIMESTAMP"),
+        bigquery.SchemaField("subreddit", "STRING"),
+        bigquery.SchemaField("author", "STRING"),
+        bigquery.SchemaField("title", "STRING"),
+        bigquery.SchemaField("selftext", "STRING"),
+        bigquery.SchemaField("url", "STRING"),
+        bigquery.SchemaField("score", "INT64"),
+        bigquery.SchemaField("num_comments", "INT64"),
+        bigquery.SchemaField("relevance_score", "FLOAT64"),
+        bigquery.SchemaField("relevance_core_hits", "INT64"),
+        bigquery.SchemaField("relevance_ctx_hits", "INT64"),
+        bigquery.SchemaField("relevance_spans", "STRING"),
+        bigquery.SchemaField("sentiment_score", "FLOAT64"),
+        bigquery.SchemaField("sentiment_positive", "INT64"),
+        bigquery.SchemaField("sentiment_negative", "INT64"),
+        bigquery.SchemaField("sentiment_uncertainty", "INT64"),
+        bigquery.SchemaField("sentiment_litigious", "INT64"),
+        bigquery.SchemaField("sentiment_negated", "INT64"),
+        bigquery.SchemaField("sentiment_tokens", "INT64"),
+        bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+        bigquery.SchemaField("row_hash", "INT64"),
+    ],
+    "youtube_comments": [
+        bigquery.SchemaField("comment_id", "STRING"),
+        bigquery.SchemaField("asset", "STRING"),
+        bigquery.SchemaField("video_id", "STRING"),
+        bigquery.SchemaField("keyword", "STRING"),
+        bigquery.SchemaField("author", "STRING"),
+        bigquery.SchemaField("author_channel_id", "STRING"),
+        bigquery.SchemaField("text", "STRING"),
+        bigquery.SchemaField("like_count", "INT64"),
+        bigquery.SchemaField("published_at", "TIMESTAMP"),
+        bigquery.SchemaField("relevance_score", "FLOAT64"),
+        bigquery.SchemaField("relevance_core_hits", "INT64"),
+        bigquery.SchemaField("relevance_ctx_hits", "INT64"),
+        bigquery.SchemaField("relevance_spans", "STRING"),
+        bigquery.SchemaField("sentiment_score", "FLOAT64"),
+        bigquery.SchemaField("sentiment_positive", "INT64"),
+        bigquery.SchemaField("sentiment_negative", "INT64"),
+        bigquery.SchemaField("sentiment_uncertainty", "INT64"),
+        bigquery.SchemaField("sentiment_litigious", "INT64"),
+        bigquery.SchemaField("sentiment_negated", "INT64"),
+        bigquery.SchemaField("sentiment_tokens", "INT64"),
+        bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+        bigquery.SchemaField("row_hash", "INT64"),
+    ],
+    "macro_indicators": [
+        bigquery.SchemaField("series_id", "STRING"),
+        bigquery.SchemaField("observation_date", "DATE"),
+        bigquery.SchemaField("value", "FLOAT64"),
+        bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+        bigquery.SchemaField("row_hash", "INT64"),
+    ],
+    "market_prices": [
+        bigquery.SchemaField("ticker", "STRING"),
+        bigquery.SchemaField("ts", "TIMESTAMP"),
+        bigquery.SchemaField("open", "FLOAT64"),
+        bigquery.SchemaField("high", "FLOAT64"),
+        bigquery.SchemaField("low", "FLOAT64"),
+        bigquery.SchemaField("close", "FLOAT64"),
+        bigquery.SchemaField("volume", "INT64"),
+        bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+        bigquery.SchemaField("row_hash", "INT64"),
+    ],
+}
+
+
+# Partition column per table (BigQuery reports its own; the local backend uses this)
+TABLE_PARTITIONS = {
+    "news_articles": "published_at",
+    "reddit_posts": "created_at",
+    "youtube_comments": "published_at",
+    "macro_indicators": "observation_date",
+    "market_prices": "ts",
+}
+
+
+def _sql_literal(value, field_type: str) -> str:
+    ftype = (field_type or "").upper()
+    if ftype == "DATE":
+        return f'DATE "{pd.Timestamp(value):%Y-%m-%d}"'
+    if ftype in ("TIMESTAMP", "DATETIME"):
+        ts = pd.Timestamp(value)
+        ts = ts.tz_convert("UTC") if ts.tzinfo else ts
+        return f'{ftype} "{ts:%Y-%m-%d %H:%M:%S.%f}"'
+    if ftype in ("INT64", "INTEGER"):
+        return str(int(value))
+    return repr(value)
+
+
+def _staging_select(staging: str, usable_cols: list[str], key_fields: list[str], quote: str) -> str:
+    q = lambda c: f"{quote}{c}{quote}"
+    rn_partition = ", ".join(q(k) for k in key_fields)
+    if "ingested_at" in usable_cols:
+        rn_order = "SAFE_CAST(ingested_at AS TIMESTAMP) DESC" if quote == "`" else "ingested_at DESC"
+    else:
+        rn_order = rn_partition
+
+    col_list = ", ".join(q(c) for c in usable_cols)
+    return f"""
+        SELECT
+          {col_list},
+          ROW_NUMBER() OVER (
+            PARTITION BY {rn_partition}
+            ORDER BY {rn_order}
+          ) AS rn
+        FROM {q(staging)}
+    """
+
+
+def build_merge_sql(target_table: str, staging: str, usable_cols: list[str], key_fields: list[str],
+                    prune: tuple | None = None) -> str:
+    staging_select = _staging_select(staging, usable_cols, key_fields, quote="`")
+
+    col_list = ", ".join([f"`{c}`" for c in usable_cols])
+    insert_vals = ", ".join([f"S.`{c}`" for c in usable_cols])
+    non_key_cols = [c for c in usable_cols if c not in key_fields]
+    update_assignments = ",\n      ".join([f"T.`{c}` = S.`{c}`" for c in non_key_cols])
+    on_clause = " AND ".join([f"T.`{k}` = S.`{k}`" for k in key_fields])
+    if prune is not None:
+        # constant range on the target's partition column lets BigQuery prune;
+        # upsert_to_bq only passes one when that column is part of the key
+        field, ftype, lo, hi = prune
+        on_clause += f"\n          AND T.`{field}` BETWEEN {_sql_literal(lo, ftype)} AND {_sql_literal(hi, ftype)}"
+
+    # rows whose content hash did not change are left alone
+    hash_guard = " AND T.`row_hash` IS DISTINCT FROM S.`row_hash`" if "row_hash" in non_key_cols else ""
+
+    matched = f"""
+        WHEN MATCHED{hash_guard} THEN
+          UPDATE SET
+          {update_assignments}""" if non_key_cols else ""
+
+    return f"""
+        MERGE `{target_table}` T
+        USING (
+          SELECT * FROM ({staging_select}) WHERE rn = 1
+        ) S
+        ON {on_clause}{matched}
+        WHEN NOT MATCHED THEN
+          INSERT ({col_list})
+          VALUES ({insert_vals});
+        """
+
+
+class WarehouseBackend:
+    name = "base"
+
+    @property
+    def identity(self) -> str:
+        # which warehouse the tables live in; local state derived from a
+        # table's contents (row_hash index) is kept per identity
+        return self.name
+
+    def get_schema(self, table: str) -> list:
+        raise NotImplementedError
+
+    def describe(self, table: str) -> tuple[list, str | None]:
+        # (schema, partition column or None)
+        return self.get_schema(table), None
+
+    def load_staging(self, df: pd.DataFrame, staging: str, schema, location: str = "US",
+                     write_disposition: str = "WRITE_TRUNCATE"):
+        raise NotImplementedError
+
+    def merge(self, target_table: str, staging: str, usable_cols: list[str], key_fields: list[str], location: str = "US",
+              prune: tuple | None = None):
+        raise NotImplementedError
+
+    def load_staging_arrow(self, table: pa.Table, staging: str, schema, location: str = "US",
+                           write_disposition: str = "WRITE_TRUNCATE"):
+        self.load_staging(table.to_pandas(), staging, schema, location=location, write_disposition=write_disposition)
+
+    def merge_many(self, stages):
+        # all-or-nothing MERGE of several staged upserts (common.StagedUpsert)
+        raise NotImplementedError
+
+    def create_staging(self, staging: str, schema, expires: datetime, location: str = "US"):
+        raise NotImplementedError
+
+    def drop_table(self, table: str, location: str = "US"):
+        raise NotImplementedError
+
+
+class BigQueryBackend(WarehouseBackend):
+    name = "bigquery"
+
+    def get_schema(self, table: str) -> list:
+        return bq_client().get_table(table).schema
+
+    def describe(self, table: str) -> tuple[list, str | None]:
+        tbl = bq_client().get_table(table)
+        partition_field = None
+        if tbl.time_partitioning is not None:
+            # None here means ingestion-time partitioning: nothing to bound
+            partition_field = tbl.time_partitioning.field
+        elif tbl.range_partitioning is not None:
+            partition_field = tbl.range_partitioning.field
+        return tbl.schema, partition_field
+
+    def create_staging(self, staging: str, schema, expires: datetime, location: str = "US"):
+        # expiry is the safety net for runs that die before dropping their stage
+        tbl = bigquery.Table(staging, schema=schema)
+        tbl.expires = expires
+        bq_client().create_table(tbl, exists_ok=True)
+
+    def drop_table(self, table: str, location: str = "US"):
+        bq_client().delete_table(table, not_found_ok=True)
+
+    def load_staging(self, df: pd.DataFrame, staging: str, schema, location: str = "US",
+                     write_disposition: str = "WRITE_TRUNCATE"):
+        client = bq_client()
+
+        job_config = bigquery.LoadJobConfig(write_disposition=write_disposition)
+        job_config.schema = schema
+
+        print(f"[upsert_to_bq] Loading {len(df)} rows → STAGING {staging}")
+        load_job = client.load_table_from_dataframe(df, staging, job_config=job_config, location=location)
+        load_job.result()
+        print(f"[upsert_to_bq] Staging load complete: job_id={load_job.job_id}")
+
+    def load_staging_arrow(self, table: pa.Table, staging: str, schema, location: str = "US",
+                           write_disposition: str = "WRITE_TRUNCATE"):
+        # Arrow -> Parquet in memory -> load job; no DataFrame conversion
+        buf = io.BytesIO()
+        pq.write_table(table, buf, compression="snappy")
+        buf.seek(0)
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=write_disposition,
+        )
+        job_config.schema = schema
+
+        print(f"[upsert_to_bq] Loading {table.num_rows} rows (arrow) → STAGING {staging}")
+        load_job = bq_client().load_table_from_file(buf, staging, job_config=job_config, location=location)
+        load_job.result()
+        print(f"[upsert_to_bq] Staging load complete: job_id={load_job.job_id}")
+
+    def merge(self, target_table: str, staging: str, usable_cols: list[str], key_fields: list[str], location: str = "US",
+              prune: tuple | None = None):
+        merge_sql = build_merge_sql(target_table, staging, usable_cols, key_fields, prune=prune)
+
+        print("[upsert_to_bq] Running MERGE...")
+        merge_job = bq_client().query(merge_sql, location=location)
+        try:
+            merge_job.result()
+        except Exception as e:
+            print(f"[upsert_to_bq] MERGE failed for target {target_table}: {e}\nSQL:\n{merge_sql}")
+            raise
+        print(f"[upsert_to_bq] MERGE complete: job_id={merge_job.job_id}")
+
+    def merge_many(self, stages):
+        statements = "\n".join(
+            build_merge_sql(st.target_table, st.staging, st.usable_cols, st.key_fields, prune=st.prune)
+            for st in stages
+        )
+        script = f"""
+        BEGIN
+          BEGIN TRANSACTION;
+          {statements}
+          COMMIT TRANSACTION;
+        EXCEPTION WHEN ERROR THEN
+          ROLLBACK TRANSACTION;
+          RAISE USING MESSAGE = @@error.message;
+        END;
+        """
+
+        print(f"[upsert_to_bq] Running {len(stages)} MERGE(s) as one transaction...")
+        job = bq_client().query(script, location=stages[0].location)
+        try:
+            job.result()
+        except Exception as e:
+            print(f"[upsert_to_bq] Batch MERGE failed: {e}\nSQL:\n{script}")
+            raise
+        print(f"[upsert_to_bq] Batch MERGE complete: job_id={job.job_id}")
+
+
+# Local (SQLite) backend
+
+_SQLITE_TYPES = {
+    "INT64": "INTEGER", "INTEGER": "INTEGER", "BOOL": "INTEGER", "BOOLEAN": "INTEGER",
+    "FLOAT64": "REAL", "FLOAT": "REAL", "NUMERIC": "REAL", "BIGNUMERIC": "REAL", "DOUBLE": "REAL",
+}
+
+
+def _local_name(table: str) -> str:
+    # project.dataset.table -> table
+    return table.rsplit(".", 1)[-1]
+
+
+def _iso_strings(s: pd.Series, unit: str, suffix: str = "") -> pd.Series:
+    # numpy's C formatter; Series.dt.strftime is ~10x slower
+    values = s.dt.tz_localize(None) if s.dt.tz is not None else s
+    text = np.datetime_as_string(values.to_numpy(dtype=f"datetime64[{unit}]"), unit=unit)
+    out = pd.Series(np.char.add(text, suffix) if suffix else text, index=s.index, dtype=object)
+    return out.where(s.notna(), None)
+
+
+def _sqlite_column(s: pd.Series, field_type: str) -> list:
+    ftype = (field_type or "").upper()
+    if ftype in ("TIMESTAMP", "DATETIME"):
+        s = _iso_strings(pd.to_datetime(s, utc=True, errors="coerce"), "us", "Z")
+    elif ftype == "DATE":
+        s = _iso_strings(pd.to_datetime(s, errors="coerce"), "D")
+    return s.astype(object).where(s.notna(), None).tolist()
+
+
+class SQLiteBackend(WarehouseBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS _staging_expiry (name TEXT PRIMARY KEY, expires TEXT)")
+        # a new id per database file: a deleted and recreated file is a different warehouse
+        self._conn.execute("CREATE TABLE IF NOT EXISTS _warehouse_meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._conn.execute("INSERT OR IGNORE INTO _warehouse_meta (k, v) VALUES ('id', ?)", (uuid.uuid4().hex,))
+        self._id = self._conn.execute("SELECT v FROM _warehouse_meta WHERE k = 'id'").fetchone()[0]
+
+    @property
+    def identity(self) -> str:
+        return f"sqlite:{self._id}"
+
+    def _ensure_table(self, name: str):
+        schema = TABLE_SCHEMAS.get(name)
+        if schema is None:
+            raise RuntimeError(f"No local schema registered for table '{name}'")
+
+        existing = {r[1] for r in self._conn.execute(f'PRAGMA table_info("{name}")')}
+        if not existing:
+            cols = ", ".join(f'"{f.name}" {_SQLITE_TYPES.get(f.field_type.upper(), "TEXT")}' for f in schema)
+            self._conn.execute(f'CREATE TABLE "{name}" ({cols})')
+            return schema
+
+        # columns added to TABLE_SCHEMAS after the local file was created
+        for f in schema:
+            if f.name not in existing:
+                self._conn.execute(
+                    f'ALTER TABLE "{name}" ADD COLUMN "{f.name}" {_SQLITE_TYPES.get(f.field_type.upper(), "TEXT")}'
+                )
+        return schema
+
+    def get_schema(self, table: str) -> list:
+        with self._lock:
+            return list(self._ensure_table(_local_name(table)))
+
+    def describe(self, table: str) -> tuple[list, str | None]:
+        return self.get_schema(table), TABLE_PARTITIONS.get(_local_name(table))
+
+    def create_staging(self, staging: str, schema, expires: datetime, location: str = "US"):
+        name = _local_name(staging)
+        decl = ", ".join(f'"{f.name}" {_SQLITE_TYPES.get(f.field_type.upper(), "TEXT")}' for f in schema)
+        with self._lock:
+            self._drop_expired_staging()
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({decl})')
+            self._conn.execute(
+                "INSERT OR REPLACE INTO _staging_expiry (name, expires) VALUES (?, ?)",
+                (name, expires.isoformat()),
+            )
+
+    def _drop_expired_staging(self):
+        now = datetime.now(timezone.utc).isoformat()
+        for (name,) in self._conn.execute("SELECT name FROM _staging_expiry WHERE expires < ?", (now,)).fetchall():
+            self._conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self._conn.execute("DELETE FROM _staging_expiry WHERE name = ?", (name,))
+
+    def drop_table(self, table: str, location: str = "US"):
+        name = _local_name(table)
+        with self._lock:
+            self._conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self._conn.execute("DELETE FROM _staging_expiry WHERE name = ?", (name,))
+
+    def load_staging(self, df: pd.DataFrame, staging: str, schema, location: str = "US",
+                     write_disposition: str = "WRITE_TRUNCATE"):
+        name = _local_name(staging)
+        types = {f.name: f.field_type for f in schema}
+        cols = [c for c in df.columns if c in types]
+        decl = ", ".join(f'"{f.name}" {_SQLITE_TYPES.get(f.field_type.upper(), "TEXT")}' for f in schema)
+        data = [_sqlite_column(df[c], types[c]) for c in cols]
+        col_list = ", ".join(f'"{c}"' for c in cols)
+        placeholders = ", ".join("?" for _ in cols)
+
+        print(f"[upsert_to_bq] Loading {len(df)} rows → STAGING {name} (sqlite, {write_disposition})")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if write_disposition == "WRITE_TRUNCATE":
+                    self._conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+                self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({decl})')
+                self._conn.executemany(f'INSERT INTO "{name}" ({col_list}) VALUES ({placeholders})', zip(*data))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _merge_sql(self, target_table: str, staging: str, usable_cols: list[str], key_fields: list[str]):
+        target, stg = _local_name(target_table), _local_name(staging)
+        staging_select = _staging_select(stg, usable_cols, key_fields, quote='"')
+
+        col_list = ", ".join(f'"{c}"' for c in usable_cols)
+        keys = ", ".join(f'"{k}"' for k in key_fields)
+        non_key_cols = [c for c in usable_cols if c not in key_fields]
+        if non_key_cols:
+            on_conflict = "DO UPDATE SET " + ", ".join(f'"{c}" = excluded."{c}"' for c in non_key_cols)
+            if "row_hash" in non_key_cols:
+                on_conflict += f' WHERE "{target}"."row_hash" IS NOT excluded."row_hash"'
+        else:
+            on_conflict = "DO NOTHING"
+
+        index_sql = f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{target}__{"__".join(key_fields)}" ON "{target}" ({keys})'
+        # MERGE equivalent: the unique key index turns matched rows into updates
+        merge_sql = f"""
+        INSERT INTO "{target}" ({col_list})
+        SELECT {col_list} FROM ({staging_select}) WHERE rn = 1
+        ON CONFLICT ({keys}) {on_conflict}
+        """
+        return index_sql, merge_sql
+
+    def _run_merges(self, statements) -> int:
+        rows = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for index_sql, merge_sql in statements:
+                    self._conn.execute(index_sql)
+                    rows += self._conn.execute(merge_sql).rowcount
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                self._conn.execute("ROLLBACK")
+                print(f"[upsert_to_bq] MERGE failed: {e}")
+                raise
+        return rows
+
+    def merge(self, target_table: str, staging: str, usable_cols: list[str], key_fields: list[str], location: str = "US",
+              prune: tuple | None = None):
+        # no partitions locally: the unique key index already bounds the lookup
+        print("[upsert_to_bq] Running MERGE (sqlite)...")
+        rows = self._run_merges([self._merge_sql(target_table, staging, usable_cols, key_fields)])
+        print(f"[upsert_to_bq] MERGE complete: rows={rows}")
+
+    def merge_many(self, stages):
+        print(f"[upsert_to_bq] Running {len(stages)} MERGE(s) as one transaction (sqlite)...")
+        rows = self._run_merges(
+            [self._merge_sql(st.target_table, st.staging, st.usable_cols, st.key_fields) for st in stages]
+        )
+        print(f"[upsert_to_bq] Batch MERGE complete: rows={rows}")
+
+    def query_df(self, sql: str, params=()) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> WarehouseBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            kind = get_env("WAREHOUSE_BACKEND", default="bigquery").lower().strip()
+            if kind == "bigquery":
+                _backend = BigQueryBackend()
+            elif kind == "sqlite":
+                _backend = SQLiteBackend(get_env("LOCAL_WAREHOUSE_PATH", default="senti_vol_local.db"))
+            else:
+                raise EnvironmentError(f"Unknown WAREHOUSE_BACKEND '{kind}'. Valid: bigquery, sqlite")
+        return _backend
+
+
+def set_backend(backend: WarehouseBackend | None):
+    # explicit override (benchmarks / offline runs); None resets to env selection
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    # cached plans belong to the previous backend's tables
+    invalidate_schema_cache()
@@ -1,243 +1,245 @@
-from dotenv import load_dotenv
-load_dotenv()
-
-import json
-import time
-import logging
-import re
-from datetime import datetime, timezone
-from typing import List
-
-import pandas as pd
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
-from common import (
-    get_env,
-    bq_table,
-    upsert_to_bq,
-    init_logging,
-    stable_id,
-    now_utc
-)
-
-
-YOUTUBE_API_KEY = get_env("YOUTUBE_API_KEY", required=True)
-GCP_PROJECT_ID = get_env("GCP_PROJECT_ID", required=True)
-BQ_DATASET = get_env("BQ_DATASET", required=True)
-
-YT_KEYWORDS = [
-    k.strip() for k in get_env(
-        "YT_KEYWORDS",
-        default="crude oil,WTI oil price"
-    ).split(",")
-]
-
-# Enforce maximums here
-YT_MAX_VIDEOS_PER_KEYWORD = int(get_env("YT_MAX_VIDEOS_PER_KEYWORD", default="3"))
-YT_MAX_COMMENTS_PER_VIDEO = int(get_env("YT_MAX_COMMENTS_PER_VIDEO", default="5"))
-
-TARGET_TABLE = bq_table("youtube_comments")
-STAGING_TABLE = bq_table("youtube_comments_staging")
-KEY_FIELDS = ["comment_id"]
-
-init_logging()
-logger = logging.getLogger("youtube_ingest")
-
-
-CORE_RE = re.compile(
-    r"\b(wti|brent|crude oil|crude|petroleum|opec\+?|eia|nyme?x|ice(?: brent)?|barrel|refiner(?:y|ies)|upstream|downstream)\b",
-    re.I,
-)
-
-CTX_RE = re.compile(
-    r"\b(price|prices|futures|market|spot|curve|spread|backwardation|contango|hedg(?:e|ing)|inventory|stocks?|output|production|exports?|imports?|demand|supply|rig count|shutdown|outage|sanctions?|disruption|capacity|maintenance|pipeline|refinery|quota|cuts?)\b",
-    re.I,
-)
-PROXIMITY_CHARS = int(get_env("YT_PROXIMITY_CHARS", default="60"))
-
-
-def is_relevant_comment(text: str) -> bool:
-    
-    if not text:
-        return False
-    if not CORE_RE.search(text) or not CTX_RE.search(text):
-        return False
-    t = text.lower()
-    core_hits = [m.start() for m in CORE_RE.finditer(t)]
-    ctx_hits  = [m.start() for m in CTX_RE.finditer(t)]
-    if not core_hits or not ctx_hits:
-        return False
-    return any(abs(i - j) <= PROXIMITY_CHARS for i in core_hits for j in ctx_hits)
-
-
-
-def build_youtube_client(api_key: str):
-    return build("youtube", "v3", developerKey=api_key, cache_discovery=False)
-
-def search_videos(youtube, query: str, max_results: int = 3) -> List[str]:
-    try:
-        resp = youtube.search().list(
-            q=query,
-            part="id",
-            type="video",
-            maxResults=max_results,
-            order="relevance"
-        ).execute()
-    except HttpError as e:
-        logger.error("Search failed for %s: %s", query, e)
-        return []
-    items = resp.get("items", []) or []
-    return [it["id"]["videoId"] for it in items if it.get("id", {}).get("videoId")]
-
-def get_video_meta(youtube, video_id: str):
-    try:
-        resp = youtube.videos().list(
-            part="snippet,statistics",
-            id=video_id,
-            maxResults=1
-        ).execute()
-        items = resp.get("items") or []
-        if not items:
-            return ("","",0)
-        snip = items[0].get("snippet", {})
-        stats = items[0].get("statistics", {})
-        title = snip.get("title") or ""
-        desc  = snip.get("description") or ""
-        c = int(stats.get("commentCount") or 0)
-        return (title, desc, c)
-    except Exception as e:
-        logger.warning("get_video_meta failed for %s: %s", video_id, e)
-        return ("","",0)
-
-def fetch_comments_for_video(youtube, video_id: str, max_comments: int = 5):
-    comments = []
-    req = youtube.commentThreads().list(
-        part="snippet",
-        videoId=video_id,
-        textFormat="plainText",
-        maxResults=max_comments
-    )
-
-    collected = 0
-    while req and collected < max_comments:
-        try:
-            resp = req.execute()
-        except HttpError as e:
-            logger.warning("Comments fetch failed for %s: %s", video_id, e)
-            time.sleep(3)
-            break
-
-        for item in resp.get("items", []):
-            try:
-                s = item["snippet"]["topLevelComment"]["snippet"]
-            except Exception:
-                continue
-
-            text = (s.get("textOriginal") or s.get("textDisplay") or "").strip()
-
-            
-            if not is_relevant_comment(text):
-                continue
-
-            comment_id = item.get("id") or stable_id(
-                f"{video_id}|{text}|{s.get('publishedAt')}"
-            )
-
-            comments.append({
-                "comment_id": comment_id,
-                "video_id": video_id,
-                "author": s.get("authorDisplayName"),
-                "author_channel_id": (s.get("authorChannelId") or {}).get("value"),
-                "text": text,
-                "like_count": int(s.get("likeCount") or 0),
-                "published_at": s.get("publishedAt"),
-                "ingested_at": now_utc(),
-            })
-            collected += 1
-            if collected >= max_comments:
-                break
-
-        req = youtube.commentThreads().list_next(req, resp)
-        time.sleep(0.15)
-
-    return comments
-
-
-
-def build_df(rows, keyword: str):
-    if not rows:
-        return pd.DataFrame()
-
-    df = pd.DataFrame(rows)
-    df["keyword"] = keyword
-
-    cols = [
-        "comment_id", "video_id", "keyword", "author", "author_channel_id",
-        "text", "like_count", "published_at", "ingested_at"
-    ]
-
-    for c in cols:
-        if c not in df.columns:
-            df[c] = None
-
-    return df[cols]
-
-
-
-def main():
-    logger.info("Starting YouTube ingestion (keywords=%s)", YT_KEYWORDS)
-
-    youtube = build_youtube_client(YOUTUBE_API_KEY)
-    frames = []
-
-    for kw in YT_KEYWORDS:
-        logger.info("Searching for keyword='%s'", kw)
-        videos = search_videos(youtube, kw, max_results=YT_MAX_VIDEOS_PER_KEYWORD)
-        logger.info("Found %d videos for '%s'", len(videos), kw)
-
-        for vid in videos:
-            title, desc, comment_count = get_video_meta(youtube, vid)
-
-
-            title_desc_blob = f"{title} {desc}".strip()
-            if not is_relevant_comment(title_desc_blob):
-                logger.info("Skipping video %s (not relevant by CORE+CTX+proximity)", vid)
-                continue
-
-            if comment_count == 0:
-                logger.info("Skipping %s (no comments / disabled)", vid)
-                continue
-
-            logger.info("Fetching up to %d comments for video %s", YT_MAX_COMMENTS_PER_VIDEO, vid)
-            rows = fetch_comments_for_video(youtube, vid, max_comments=YT_MAX_COMMENTS_PER_VIDEO)
-            if not rows:
-                logger.info("No relevant comments collected for %s", vid)
-                continue
-
-            df = build_df(rows, kw)
-            frames.append(df)
-
-    if not frames:
-        logger.info("No comments collected across all keywords.")
-        return
-
-    full_df = pd.concat(frames, ignore_index=True)
-
-    full_df["published_at"] = pd.to_datetime(full_df["published_at"], utc=True, errors="coerce")
-
-    logger.info("Upserting %d comments → %s", len(full_df), TARGET_TABLE)
-
-    upsert_to_bq(
-        target_table=TARGET_TABLE,
-        df=full_df,
-        schema=None,               
-        key_fields=KEY_FIELDS,
-        staging_table=STAGING_TABLE
-    )
-
-    logger.info("YouTube ingestion complete.")
-
-
-if __name__ == "__main__":
-    main()
+from dotenv import load_dotenv
+load_dotenv()
+
+import json
+import time
+import logging
+from datetime import datetime, timezone
+from typing import List
+
+import pandas as pd
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from common import (
+    get_env,
+    bq_table,
+    upsert_stream_to_bq,
+    after_commit,
+    init_logging,
+    stable_id,
+    now_utc
+)
+from relevance import SCORE_COLUMNS, RelevanceMatcher, matcher_from_env
+from assets import router_from_env
+from sentiment import add_sentiment
+from sentiment_index import update_sentiment_index
+
+
+YOUTUBE_API_KEY = get_env("YOUTUBE_API_KEY", required=True)
+GCP_PROJECT_ID = get_env("GCP_PROJECT_ID", required=True)
+BQ_DATASET = get_env("BQ_DATASET", required=True)
+
+YT_KEYWORDS = [
+    k.strip() for k in get_env(
+        "YT_KEYWORDS",
+        default="crude oil,WTI oil price"
+    ).split(",")
+]
+
+# Enforce maximums here
+YT_MAX_VIDEOS_PER_KEYWORD = int(get_env("YT_MAX_VIDEOS_PER_KEYWORD", default="3"))
+YT_MAX_COMMENTS_PER_VIDEO = int(get_env("YT_MAX_COMMENTS_PER_VIDEO", default="5"))
+
+TARGET_TABLE = bq_table("youtube_comments")
+STAGING_TABLE = bq_table("youtube_comments_staging")
+KEY_FIELDS = ["comment_id", "asset"]
+
+init_logging()
+logger = logging.getLogger("youtube_ingest")
+
+
+PROXIMITY_CHARS = int(get_env("YT_PROXIMITY_CHARS", default="60"))
+RELEVANCE = matcher_from_env(RelevanceMatcher(
+    core=r"wti|brent|crude oil|crude|petroleum|opec\+?|eia|nyme?x|ice(?: brent)?|barrel|refiner(?:y|ies)|upstream|downstream",
+    ctx=r"price|prices|futures|market|spot|curve|spread|backwardation|contango|hedg(?:e|ing)|inventory|stocks?|output|production|exports?|imports?|demand|supply|rig count|shutdown|outage|sanctions?|disruption|capacity|maintenance|pipeline|refinery|quota|cuts?",
+    proximity=PROXIMITY_CHARS,
+))
+is_relevant_comment = RELEVANCE.is_relevant
+ROUTER = router_from_env(RELEVANCE)
+
+
+def build_youtube_client(api_key: str):
+    return build("youtube", "v3", developerKey=api_key, cache_discovery=False)
+
+def search_videos(youtube, query: str, max_results: int = 3) -> List[str]:
+    try:
+        resp = youtube.search().list(
+            q=query,
+            part="id",
+            type="video",
+            maxResults=max_results,
+            order="relevance"
+        ).execute()
+    except HttpError as e:
+        logger.error("Search failed for %s: %s", query, e)
+        return []
+    items = resp.get("items", []) or []
+    return [it["id"]["videoId"] for it in items if it.get("id", {}).get("videoId")]
+
+def get_video_meta(youtube, video_id: str):
+    try:
+        resp = youtube.videos().list(
+            part="snippet,statistics",
+            id=video_id,
+            maxResults=1
+        ).execute()
+        items = resp.get("items") or []
+        if not items:
+            return ("","",0)
+        snip = items[0].get("snippet", {})
+        stats = items[0].get("statistics", {})
+        title = snip.get("title") or ""
+        desc  = snip.get("description") or ""
+        c = int(stats.get("commentCount") or 0)
+        return (title, desc, c)
+    except Exception as e:
+        logger.warning("get_video_meta failed for %s: %s", video_id, e)
+        return ("","",0)
+
+def fetch_comments_for_video(youtube, video_id: str, max_comments: int = 5):
+    comments = []
+    req = youtube.commentThreads().list(
+        part="snippet",
+        videoId=video_id,
+        textFormat="plainText",
+        maxResults=max_comments
+    )
+
+    collected = 0
+    while req and collected < max_comments:
+        try:
+            resp = req.execute()
+        except HttpError as e:
+            logger.warning("Comments fetch failed for %s: %s", video_id, e)
+            time.sleep(3)
+            break
+
+        page = []
+        for item in resp.get("items", []):
+            try:
+                s = item["snippet"]["topLevelComment"]["snippet"]
+            except Exception:
+                continue
+            page.append((item, s, (s.get("textOriginal") or s.get("textDisplay") or "").strip()))
+
+        # one routing call per page: a row per (comment, relevant asset)
+        texts = pd.Series([text for _, _, text in page], dtype=object)
+        routed = ROUTER.route_frame(pd.DataFrame({"i": range(len(page))}), texts)
+        keep = list(dict.fromkeys(routed["i"]))[:max_comments - collected]
+        routed = routed[routed["i"].isin(keep)]
+        for r in routed.itertuples(index=False):
+            item, s, text = page[r.i]
+            comment_id = item.get("id") or stable_id(
+                f"{video_id}|{text}|{s.get('publishedAt')}"
+            )
+
+            comments.append({
+                "comment_id": comment_id,
+                "video_id": video_id,
+                "author": s.get("authorDisplayName"),
+                "author_channel_id": (s.get("authorChannelId") or {}).get("value"),
+                "text": text,
+                "like_count": int(s.get("likeCount") or 0),
+                "published_at": s.get("publishedAt"),
+                "ingested_at": now_utc(),
+                "asset": r.asset,
+                **{c: getattr(r, c) for c in SCORE_COLUMNS},
+            })
+        collected += len(keep)
+        if collected >= max_comments:
+            break
+
+        req = youtube.commentThreads().list_next(req, resp)
+        time.sleep(0.15)
+
+    return comments
+
+
+
+def build_df(rows, keyword: str):
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(rows)
+    df["keyword"] = keyword
+
+    cols = [
+        "comment_id", "video_id", "keyword", "author", "author_channel_id",
+        "text", "like_count", "published_at", "ingested_at", "asset", *SCORE_COLUMNS
+    ]
+
+    for c in cols:
+        if c not in df.columns:
+            df[c] = None
+
+    df = df[cols]
+    return add_sentiment(df, df["text"], key_field="comment_id")
+
+
+
+def iter_comment_frames(youtube):
+    # one small frame per video; consumed lazily by upsert_stream_to_bq
+    for kw in YT_KEYWORDS:
+        logger.info("Searching for keyword='%s'", kw)
+        videos = search_videos(youtube, kw, max_results=YT_MAX_VIDEOS_PER_KEYWORD)
+        logger.info("Found %d videos for '%s'", len(videos), kw)
+
+        for vid in videos:
+            title, desc, comment_count = get_video_meta(youtube, vid)
+
+
+            title_desc_blob = f"{title} {desc}".strip()
+            if not ROUTER.route(title_desc_blob):
+                logger.info("Skipping video %s (not relevant by CORE+CTX+proximity)", vid)
+                continue
+
+            if comment_count == 0:
+                logger.info("Skipping %s (no comments / disabled)", vid)
+                continue
+
+            logger.info("Fetching up to %d comments for video %s", YT_MAX_COMMENTS_PER_VIDEO, vid)
+            rows = fetch_comments_for_video(youtube, vid, max_comments=YT_MAX_COMMENTS_PER_VIDEO)
+            if not rows:
+                logger.info("No relevant comments collected for %s", vid)
+                continue
+
+            yield build_df(rows, kw)
+
+
+
+def keep_index_rows(frames, kept: list):
+    # passes the stream through, keeping what the sentiment index needs
+    for frame in frames:
+        if frame is not None and not frame.empty:
+            kept.append(frame[["comment_id", "asset", "published_at", "like_count", "sentiment_score"]])
+        yield frame
+
+
+def main():
+    logger.info("Starting YouTube ingestion (keywords=%s)", YT_KEYWORDS)
+
+    youtube = build_youtube_client(YOUTUBE_API_KEY)
+
+    logger.info("Streaming comments → %s", TARGET_TABLE)
+
+    kept = []
+    n = upsert_stream_to_bq(
+        target_table=TARGET_TABLE,
+        batches=keep_index_rows(iter_comment_frames(youtube), kept),
+        schema=None,
+        key_fields=KEY_FIELDS,
+        staging_table=STAGING_TABLE
+    )
+
+    if not n:
+        logger.info("No comments collected across all keywords.")
+        return
+
+    after_commit(update_sentiment_index, "youtube", pd.concat(kept, ignore_index=True), key_field="comment_id",
+                 time_field="published_at", weight_field="like_count")
+    logger.info("YouTube ingestion complete (%d comments).", n)
+
+
+if __name__ == "__main__":
+    main()